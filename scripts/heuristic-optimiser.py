@@ -10,8 +10,10 @@ import os
 import socket
 import sys
 
+import IMCoalHMM.cma_es
 import IMCoalHMM.genetic_algorithm
 import IMCoalHMM.particle_swarm
+import IMCoalHMM.surrogate
 
 _alignments = None
 _config = None
@@ -194,6 +196,49 @@ class _Transformer(object):
         return transformed_sequence
 
 
+def _likelihood_processes(optimiser):
+    """
+    Determine the number of worker processes for computing the likelihood.
+    :param optimiser: The optimiser that will maximise the likelihood.
+    :return: The 'likelihood.processes' setting, or None if the optimiser evaluates in worker processes of its own.
+    """
+    # The serial particle swarm never evaluates in a pool, unless the surrogate screen switches it to synchronous.
+    serial = (isinstance(optimiser, IMCoalHMM.particle_swarm.Optimiser) and
+              optimiser.evaluation == IMCoalHMM.particle_swarm.EvaluationMode.SERIAL and
+              _config.try_float('optimiser.screen_fraction', None) is None)
+    if not serial and optimiser.processes is not None and optimiser.processes > 1:
+        return None
+    return _config.try_int('likelihood.processes', None)
+
+
+def _maximise(optimiser, fitness_function, parameter_count):
+    """
+    Maximise a fitness function with the optimiser, pre-screening candidates with a surrogate if configured.
+    :param optimiser: The optimiser.
+    :param fitness_function: The fitness function to maximise.
+    :param parameter_count: The number of parameters.
+    :return: The final context of the optimiser.
+    """
+    fraction = _config.try_float('optimiser.screen_fraction', None)
+    if fraction is None:
+        return optimiser.maximise(fitness_function, parameter_count)
+
+    assert not isinstance(optimiser, IMCoalHMM.surrogate.Optimiser), 'the surrogate optimiser cannot be screened'
+    assert getattr(optimiser, 'evaluation', None) != IMCoalHMM.particle_swarm.EvaluationMode.ASYNCHRONOUS, \
+        'the asynchronous particle swarm cannot be screened'
+    if isinstance(optimiser, IMCoalHMM.particle_swarm.Optimiser):
+        optimiser.evaluation = IMCoalHMM.particle_swarm.EvaluationMode.SYNCHRONOUS
+
+    screen = IMCoalHMM.surrogate.SurrogateScreen(fitness_function, fraction, optimiser.processes)
+    try:
+        context = optimiser.maximise(fitness_function, parameter_count, batch_fitness_function=screen)
+    finally:
+        screen.terminate()
+    _log_comment('')
+    _log_comment('screened_evaluations = {0}'.format(screen.evaluations))
+    return context
+
+
 def _execute_model_i(optimiser):
     """
     Execute an experiment for the isolation model using the specified optimiser.
@@ -201,7 +246,7 @@ def _execute_model_i(optimiser):
     :return: None
     """
     from IMCoalHMM.isolation_model import IsolationModel
-    from IMCoalHMM.hmm import Forwarder
+    from IMCoalHMM.hmm import make_forwarders
     from IMCoalHMM.likelihood import Likelihood
 
     no_states = _config.try_int('model.states', 10)
@@ -222,9 +267,10 @@ def _execute_model_i(optimiser):
 
     _log_header()
 
-    forwarders = [Forwarder(arg, NSYM = 3) for arg in _alignments]
+    forwarders = make_forwarders(_alignments, NSYM=3)
     model = IsolationModel(no_states)
-    log_likelihood = Likelihood(model, forwarders)
+    log_likelihood = Likelihood(model, forwarders, processes=_likelihood_processes(optimiser),
+                                memo_size=_config.try_int('likelihood.memo_size', None))
 
     def fitness_function(parameters):
         transformed_parameters = transformer.transform(parameters)
@@ -234,7 +280,7 @@ def _execute_model_i(optimiser):
         _process_logged_context(context, transformer)
 
     optimiser.log = log_function
-    mle_context = optimiser.maximise(fitness_function, len(transformer.names))
+    mle_context = _maximise(optimiser, fitness_function, len(transformer.names))
     mle_parameters, mle_log_likelihood = _process_final_context(mle_context, transformer)
 
     mle_split_time, mle_coal_rate, mle_recomb_rate = mle_parameters
@@ -246,6 +292,8 @@ def _execute_model_i(optimiser):
     _log_comment('mle_recomb_rate    = {0}'.format(mle_recomb_rate))
     _log_comment('mle_theta          = {0}'.format(mle_theta))
     _log_comment('mle_log_likelihood = {0}'.format(mle_log_likelihood))
+    if log_likelihood.memo is not None:
+        _log_comment(log_likelihood.memo_report())
 
 
 def _execute_model_iim(optimiser):
@@ -254,7 +302,7 @@ def _execute_model_iim(optimiser):
     :param optimiser: The optimiser to use while executing the model.
     :return: None
     """
-    from IMCoalHMM.hmm import Forwarder
+    from IMCoalHMM.hmm import make_forwarders
     from IMCoalHMM.isolation_with_migration_model import IsolationMigrationModel
     from IMCoalHMM.likelihood import Likelihood
 
@@ -285,9 +333,10 @@ def _execute_model_iim(optimiser):
 
     _log_header()
 
-    forwarders = [Forwarder(arg, NSYM = 3) for arg in _alignments]
+    forwarders = make_forwarders(_alignments, NSYM=3)
     model = IsolationMigrationModel(no_migration_states, no_ancestral_states)
-    log_likelihood = Likelihood(model, forwarders)
+    log_likelihood = Likelihood(model, forwarders, processes=_likelihood_processes(optimiser),
+                                memo_size=_config.try_int('likelihood.memo_size', None))
 
     def fitness_function(parameters):
         transformed_parameters = transformer.transform(parameters)
@@ -297,7 +346,7 @@ def _execute_model_iim(optimiser):
         _process_logged_context(context, transformer)
 
     optimiser.log = log_function
-    mle_context = optimiser.maximise(fitness_function, len(transformer.names))
+    mle_context = _maximise(optimiser, fitness_function, len(transformer.names))
     mle_parameters, mle_log_likelihood = _process_final_context(mle_context, transformer)
 
     mle_isolation_time, mle_mig_time, mle_coal_rate, mle_recomb_rate, mle_mig_rate = mle_parameters
@@ -311,6 +360,8 @@ def _execute_model_iim(optimiser):
     _log_comment('mle_mig_rate       = {0}'.format(mle_mig_rate))
     _log_comment('mle_theta          = {0}'.format(mle_theta))
     _log_comment('mle_log_likelihood = {0}'.format(mle_log_likelihood))
+    if log_likelihood.memo is not None:
+        _log_comment(log_likelihood.memo_report())
 
 
 def _execute_model_iim_epochs(optimiser):
@@ -319,7 +370,7 @@ def _execute_model_iim_epochs(optimiser):
     :param optimiser: The optimiser to use while executing the model.
     :return: None
     """
-    from IMCoalHMM.hmm import Forwarder
+    from IMCoalHMM.hmm import make_forwarders
     from IMCoalHMM.isolation_with_migration_model_epochs import IsolationMigrationEpochsModel
     from IMCoalHMM.likelihood import Likelihood
 
@@ -357,9 +408,10 @@ def _execute_model_iim_epochs(optimiser):
 
     _log_header()
 
-    forwarders = [Forwarder(arg, NSYM = 3) for arg in _alignments]
+    forwarders = make_forwarders(_alignments, NSYM=3)
     model = IsolationMigrationEpochsModel(epoch_factor, no_migration_states, no_ancestral_states)
-    log_likelihood = Likelihood(model, forwarders)
+    log_likelihood = Likelihood(model, forwarders, processes=_likelihood_processes(optimiser),
+                                memo_size=_config.try_int('likelihood.memo_size', None))
 
     def fitness_function(parameters):
         transformed_parameters = transformer.transform(parameters)
@@ -369,7 +421,7 @@ def _execute_model_iim_epochs(optimiser):
         _process_logged_context(context, transformer)
 
     optimiser.log = log_function
-    mle_context = optimiser.maximise(fitness_function, len(transformer.names))
+    mle_context = _maximise(optimiser, fitness_function, len(transformer.names))
     mle_parameters, mle_log_likelihood = _process_final_context(mle_context, transformer)
 
     mle_isolation_time = mle_parameters[0]
@@ -387,23 +439,55 @@ def _execute_model_iim_epochs(optimiser):
     for i, mig_rate in enumerate(mle_mig_rates):
         _log_comment('mle_mig_rate_{0}     = {1}'.format(i + 1, mig_rate))
     _log_comment('mle_log_likelihood = {0}'.format(mle_log_likelihood))
+    if log_likelihood.memo is not None:
+        _log_comment(log_likelihood.memo_report())
 
 
 def _find_alignments():
     """
-    Find all alignment directories based on settings provided by the configuration file.
-    :return: A list of alignment directories.
+    Find all alignments based on settings provided by the configuration file.
+    :return: A list of alignment files and segment directories.
     """
-    dirs = []
+    from IMCoalHMM.observations import is_segment_directory
+
+    alignments = []
     for path in _config.get_str('alignments').split(':'):
-        if os.path.exists(os.path.join(path, 'data_structure')):
-            dirs.append(path)
+        if os.path.isfile(path) or is_segment_directory(path):
+            alignments.append(path)
         else:
-            for entry_name in os.listdir(path):
+            for entry_name in sorted(os.listdir(path)):
                 entry = os.path.join(path, entry_name)
-                if os.path.isdir(entry):
-                    dirs.append(entry)
-    return dirs
+                if os.path.isfile(entry) or is_segment_directory(entry):
+                    alignments.append(entry)
+    return alignments
+
+
+def _parse_cma_es():
+    """
+    Parse the settings for the CMA evolution strategy.
+    :return: The CMA-ES instance.
+    """
+    optimiser = IMCoalHMM.cma_es.Optimiser()
+    optimiser.initial_sigma = _config.try_float('optimiser.initial_sigma', optimiser.initial_sigma)
+    optimiser.max_iterations = _config.try_int('optimiser.max_iterations', optimiser.max_iterations)
+    optimiser.population_size = _config.try_int('optimiser.population_size', optimiser.population_size)
+    optimiser.processes = _config.try_int('optimiser.processes', optimiser.processes)
+    optimiser.timeout = _config.try_timedelta('optimiser.timeout', optimiser.timeout)
+    return optimiser
+
+
+def _parse_surrogate():
+    """
+    Parse the settings for the surrogate-assisted optimiser.
+    :return: The surrogate-assisted optimiser instance.
+    """
+    optimiser = IMCoalHMM.surrogate.Optimiser()
+    optimiser.batch_size = _config.try_int('optimiser.batch_size', optimiser.batch_size)
+    optimiser.initial_points = _config.try_int('optimiser.initial_points', optimiser.initial_points)
+    optimiser.max_iterations = _config.try_int('optimiser.max_iterations', optimiser.max_iterations)
+    optimiser.processes = _config.try_int('optimiser.processes', optimiser.processes)
+    optimiser.timeout = _config.try_timedelta('optimiser.timeout', optimiser.timeout)
+    return optimiser
 
 
 def _parse_ga_crossover():
@@ -507,7 +591,11 @@ def _parse_ga():
     optimiser.elite_count = _config.try_int('optimiser.elite_count', optimiser.elite_count)
     optimiser.hall_of_fame_size = _config.try_int('optimiser.hall_of_fame_size', optimiser.hall_of_fame_size)
     optimiser.max_generations = _config.try_int('optimiser.max_generations', optimiser.max_generations)
+    optimiser.min_diversity = _config.try_float('optimiser.min_diversity', optimiser.min_diversity)
     optimiser.population_size = _config.try_int('optimiser.population_size', optimiser.population_size)
+    optimiser.processes = _config.try_int('optimiser.processes', optimiser.processes)
+    optimiser.stall_generations = _config.try_int('optimiser.stall_generations', optimiser.stall_generations)
+    optimiser.stall_tolerance = _config.try_float('optimiser.stall_tolerance', optimiser.stall_tolerance)
     optimiser.timeout = _config.try_timedelta('optimiser.timeout', optimiser.timeout)
     optimiser.initialisation = _parse_ga_initialisation()
     optimiser.selection = _parse_ga_selection()
@@ -524,11 +612,21 @@ def _parse_pso():
     optimiser = IMCoalHMM.particle_swarm.Optimiser()
     optimiser.max_iterations = _config.try_int('optimiser.max_iterations', optimiser.max_iterations)
     optimiser.max_initial_velocity = _config.try_float('optimiser.max_initial_velocity', optimiser.max_initial_velocity)
+    optimiser.min_diversity = _config.try_float('optimiser.min_diversity', optimiser.min_diversity)
     optimiser.particle_count = _config.try_int('optimiser.particle_count', optimiser.particle_count)
     optimiser.omega = _config.try_float('optimiser.omega', optimiser.omega)
     optimiser.phi_particle = _config.try_float('optimiser.phi_particle', optimiser.phi_particle)
     optimiser.phi_swarm = _config.try_float('optimiser.phi_swarm', optimiser.phi_swarm)
+    optimiser.stall_iterations = _config.try_int('optimiser.stall_iterations', optimiser.stall_iterations)
+    optimiser.stall_tolerance = _config.try_float('optimiser.stall_tolerance', optimiser.stall_tolerance)
     optimiser.timeout = _config.try_timedelta('optimiser.timeout', optimiser.timeout)
+    optimiser.evaluation = _config.try_str('optimiser.evaluation', optimiser.evaluation)
+    optimiser.processes = _config.try_int('optimiser.processes', optimiser.processes)
+    assert optimiser.evaluation in (
+        IMCoalHMM.particle_swarm.EvaluationMode.SERIAL,
+        IMCoalHMM.particle_swarm.EvaluationMode.SYNCHRONOUS,
+        IMCoalHMM.particle_swarm.EvaluationMode.ASYNCHRONOUS), \
+        'invalid evaluation: {0}'.format(optimiser.evaluation)
     return optimiser
 
 
@@ -548,9 +646,98 @@ def _parse_optimiser():
         _process_final_context = _process_final_pso_context
         _process_logged_context = _process_logged_pso_context
         return _parse_pso()
+    if value == 'cma_es':
+        _process_final_context = _process_final_cma_es_context
+        _process_logged_context = _process_logged_cma_es_context
+        return _parse_cma_es()
+    if value == 'surrogate':
+        _process_final_context = _process_final_surrogate_context
+        _process_logged_context = _process_logged_surrogate_context
+        return _parse_surrogate()
     assert False, 'invalid optimiser: {0}'.format(value)
 
 
+def _process_final_cma_es_context(context, transformer):
+    """
+    Process the final context returned from the CMA-ES optimiser.
+    :param context: The final context returned from the CMA-ES optimiser.
+    :param transformer: The object that can transform the parameters from percentages.
+    :return: A tuple of 1) the mle_parameters, and 2) the mle_log_likelihood.
+    """
+    from IMCoalHMM.cma_es import Context
+    assert isinstance(context, Context)
+
+    _log_comment('')
+    _log_comment('iterations         = {0}'.format(context.iteration))
+    _log_comment('evaluations        = {0}'.format(context.evaluations))
+    _log_comment('exit_condition     = {0}'.format(context.exit_condition))
+    _log_comment('execution_time     = {0}'.format(context.elapsed))
+
+    best = context.best
+    return transformer.transform(best.positions), best.fitness
+
+
+def _process_logged_cma_es_context(context, transformer):
+    """
+    Process a logged context returned from the CMA-ES optimiser.
+    :param context: A logged context returned from the CMA-ES optimiser.
+    :param transformer: The object that can transform the parameters from percentages.
+    :return: None
+    """
+    from IMCoalHMM.cma_es import Context
+    assert isinstance(context, Context)
+
+    _log_comment('')
+    _log_comment('best_fitness.{0} = {1}'.format(context.iteration, context.best.fitness))
+    _log_comment('sigma.{0} = {1}'.format(context.iteration, context.sigma))
+    _log_comment('')
+    _log_comment('\t'.join(['iteration', 'candidate', 'fitness'] + transformer.names))
+
+    for i, candidate in enumerate(context.candidates):
+        x = transformer.transform(candidate.positions)
+        _log('\t'.join(map(str, [context.iteration, i, candidate.fitness] + x)))
+
+
+def _process_final_surrogate_context(context, transformer):
+    """
+    Process the final context returned from the surrogate-assisted optimiser.
+    :param context: The final context returned from the surrogate-assisted optimiser.
+    :param transformer: The object that can transform the parameters from percentages.
+    :return: A tuple of 1) the mle_parameters, and 2) the mle_log_likelihood.
+    """
+    from IMCoalHMM.surrogate import Context
+    assert isinstance(context, Context)
+
+    _log_comment('')
+    _log_comment('iterations         = {0}'.format(context.iteration))
+    _log_comment('evaluations        = {0}'.format(context.evaluations))
+    _log_comment('exit_condition     = {0}'.format(context.exit_condition))
+    _log_comment('execution_time     = {0}'.format(context.elapsed))
+
+    best = context.best
+    return transformer.transform(best.positions), best.fitness
+
+
+def _process_logged_surrogate_context(context, transformer):
+    """
+    Process a logged context returned from the surrogate-assisted optimiser.
+    :param context: A logged context returned from the surrogate-assisted optimiser.
+    :param transformer: The object that can transform the parameters from percentages.
+    :return: None
+    """
+    from IMCoalHMM.surrogate import Context
+    assert isinstance(context, Context)
+
+    _log_comment('')
+    _log_comment('best_fitness.{0} = {1}'.format(context.iteration, context.best.fitness))
+    _log_comment('')
+    _log_comment('\t'.join(['iteration', 'point', 'fitness'] + transformer.names))
+
+    for i, solution in enumerate(context.batch):
+        x = transformer.transform(solution.positions)
+        _log('\t'.join(map(str, [context.iteration, i, solution.fitness] + x)))
+
+
 def _process_final_ga_context(context, transformer):
     """
     Process the final context returned from the genetic algorithm optimiser.
@@ -582,6 +769,7 @@ def _process_logged_ga_context(context, transformer):
 
     _log_comment('')
     _log_comment('best_fitness.{0} = {1}'.format(context.generation, context.hall_of_fame[0].fitness))
+    _log_comment('diversity.{0} = {1}'.format(context.generation, context.diversity))
     _log_comment('')
     _log_comment('\t'.join(['iteration', 'individual', 'fitness'] + transformer.names))
 
@@ -621,6 +809,7 @@ def _process_logged_pso_context(context, transformer):
 
     _log_comment('')
     _log_comment('best_fitness.{0} = {1}'.format(context.iteration, context.best.fitness))
+    _log_comment('diversity.{0} = {1}'.format(context.iteration, context.diversity))
     _log_comment('')
     _log_comment('\t'.join(['iteration', 'particle', 'fitness'] + transformer.names))
 
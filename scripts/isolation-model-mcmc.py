@@ -7,7 +7,9 @@ from argparse import ArgumentParser
 
 from IMCoalHMM.isolation_model import IsolationModel
 from IMCoalHMM.likelihood import Likelihood
-from IMCoalHMM.hmm import Forwarder
+from IMCoalHMM.hmm import make_forwarders
+from IMCoalHMM.multi_fidelity import subsample_estimate
+from IMCoalHMM.transforms import ParameterTransform
 
 from IMCoalHMM.mcmc import MCMC, MC3, LogNormPrior
 from math import log
@@ -73,7 +75,17 @@ and uniform coalescence and recombination rates."""
                             default=default,
                             help="Meta-parameter mean of the %s (%g)" % (description, default))
 
-    parser.add_argument('alignments', nargs='*', help='Alignments in ZipHMM format')
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of processes to spread the alignment segments over (1)")
+    parser.add_argument("--warm-start",
+                        type=float,
+                        default=None,
+                        help="Start the chains from a maximum likelihood estimate on a random subset with this "
+                             "fraction of the alignments, growing until the estimates agree (start from the priors)")
+
+    parser.add_argument('alignments', nargs='*', help='Alignments in ZipHMM format, dataset files or directories of segments')
 
     options = parser.parse_args()
     if len(options.alignments) < 1 and not (options.sample_priors or options.mcmc_priors):
@@ -85,6 +97,9 @@ and uniform coalescence and recombination rates."""
     if options.logfile and not options.mc3:
         parser.error("the --logfile option is only valid together with the --mc3 option.")
 
+    if options.warm_start is not None and not 0.0 < options.warm_start < 1.0:
+        parser.error("the --warm-start fraction must be between 0 and 1.")
+
     # Specify priors and proposal distributions... 
     # I am sampling in log-space to make it easier to make a random walk
     split_prior = LogNormPrior(log(options.split))
@@ -108,16 +123,33 @@ and uniform coalescence and recombination rates."""
 
         sys.exit(0) # Successful termination
 
+    forwarders = None
+    if not options.mc3 or options.warm_start is not None:
+        forwarders = make_forwarders(options.alignments, NSYM=3)
+
+    initial_theta = None
+    if options.warm_start is not None:
+        warm_start = subsample_estimate(IsolationModel(options.states), forwarders,
+                                        (options.split, 1 / (options.theta / 2), options.rho),
+                                        initial_fraction=options.warm_start,
+                                        transform=ParameterTransform.log(3),
+                                        likelihood_processes=options.processes,
+                                        full_data=False)
+        initial_theta = warm_start.estimate
+        for level in warm_start.levels:
+            print >> sys.stderr, 'Warm start %s: log-likelihood %g after %d evaluations in %.1f seconds' % \
+                (level.description, level.log_likelihood, level.evaluations, level.elapsed)
+
     if options.mc3:
         mcmc = MC3(priors, input_files=options.alignments,
                    model=IsolationModel(options.states),
                    thinning=options.thinning, no_chains=options.mc3_chains,
                    switching=options.thinning/10,
-                   temperature_scale=options.temperature_scale)
+                   temperature_scale=options.temperature_scale,
+                   initial_theta=initial_theta)
     else:
-        forwarders = [Forwarder(arg, NSYM = 3) for arg in options.alignments]
-        log_likelihood = Likelihood(IsolationModel(options.states), forwarders)
-        mcmc = MCMC(priors, log_likelihood, thinning=options.thinning)
+        log_likelihood = Likelihood(IsolationModel(options.states), forwarders, processes=options.processes)
+        mcmc = MCMC(priors, log_likelihood, thinning=options.thinning, initial_theta=initial_theta)
 
 
     with open(options.outfile, 'w') as outfile:
@@ -3,11 +3,16 @@
 """Script for estimating parameters in an isolation model.
 """
 
+import sys
 from argparse import ArgumentParser
+import numpy
 
 from IMCoalHMM.isolation_model import IsolationModel
-from IMCoalHMM.likelihood import Likelihood, maximum_likelihood_estimate
-from IMCoalHMM.hmm import Forwarder
+from IMCoalHMM.likelihood import GRADIENT_METHODS
+from IMCoalHMM.multistart import multi_start_estimate
+from IMCoalHMM.multi_fidelity import fidelity_levels, multi_fidelity_estimate, subsample_estimate
+from IMCoalHMM.transforms import ParameterTransform
+from IMCoalHMM.hmm import make_forwarders
 
 
 def transform(params):
@@ -63,9 +68,49 @@ and uniform coalescence and recombination rates."""
                             default=default,
                             help="Initial guess at the %s (%g)" % (description, default))
 
-    parser.add_argument('alignments', nargs='+', help='Alignments in ZipHMM format')
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of processes to spread the alignment segments, the starting points "
+                             "or the gradient evaluations over (1)")
+    parser.add_argument("--starts",
+                        type=int,
+                        default=1,
+                        help="Number of starting points to run the optimization from, "
+                             "spread around the initial guess (1)")
+    parser.add_argument("--start-spread",
+                        type=float,
+                        default=10.0,
+                        help="Starting points are spread between the initial guess divided and "
+                             "multiplied by this factor (10)")
+    parser.add_argument("--memo-size",
+                        type=int,
+                        default=None,
+                        help="Number of recent parameter points to remember the likelihood of (none)")
+    parser.add_argument("--fidelity-levels",
+                        type=int,
+                        default=1,
+                        help="Number of levels of time resolution to optimize at, each level starting from the "
+                             "estimate of the previous one with twice the intervals, up to the given number (1)")
+    parser.add_argument("--fidelity-data",
+                        type=float,
+                        default=1.0,
+                        help="Fraction of the alignment segments to use at the coarser levels (1)")
+    parser.add_argument("--warm-start",
+                        type=float,
+                        default=None,
+                        help="Fit a random subset with this fraction of the alignments first, growing it until "
+                             "the estimates agree, and continue on all the alignments from there (none)")
+
+    parser.add_argument('alignments', nargs='+', help='Alignments in ZipHMM format, dataset files or directories of segments')
 
     options = parser.parse_args()
+    if options.fidelity_levels > 1 and options.starts > 1:
+        parser.error("Multi-fidelity estimation is not combined with multiple starts!")
+    if options.warm_start is not None and not 0.0 < options.warm_start < 1.0:
+        parser.error("The warm start fraction must be between 0 and 1!")
+    if options.warm_start is not None and options.fidelity_levels > 1:
+        parser.error("Multi-fidelity estimation is not combined with a warm start!")
     if len(options.alignments) < 1:
         parser.error("Input alignment not provided!")
 
@@ -78,25 +123,86 @@ and uniform coalescence and recombination rates."""
     init_split = split
     init_coal = 1 / (theta / 2)
     init_recomb = rho
-
-    forwarders = [Forwarder(arg, NSYM = 3) for arg in options.alignments]
-    log_likelihood = Likelihood(IsolationModel(no_states), forwarders)
-
-    if options.logfile:
+    initial_parameters = (init_split, init_coal, init_recomb)
+
+    forwarders = make_forwarders(options.alignments, NSYM=3)
+    # The processes run the starts of a multi-start estimation or evaluate the finite-difference
+    # points of a gradient based optimizer, and otherwise split the data between them.
+    parallel_gradient = options.starts <= 1 and options.optimizer in GRADIENT_METHODS
+    likelihood_processes = options.processes if options.starts <= 1 and not parallel_gradient else None
+    gradient_processes = options.processes if parallel_gradient else None
+    # The coarser levels of a multi-fidelity estimation, if any, come before the target model.
+    levels = fidelity_levels(IsolationModel, (no_states,), [0], forwarders,
+                             no_levels=options.fidelity_levels,
+                             data_fractions=[options.fidelity_data] * (options.fidelity_levels - 1),
+                             processes=likelihood_processes, memo_size=options.memo_size)
+
+    # Rates and times are all positive and on very different scales, so they are
+    # optimised on a log scale.
+    parameter_transform = ParameterTransform.log(3)
+
+    if options.warm_start is not None:
+        warm_start = subsample_estimate(IsolationModel(no_states), forwarders, initial_parameters,
+                                        initial_fraction=options.warm_start,
+                                        optimizer_method=options.optimizer,
+                                        transform=parameter_transform,
+                                        processes=gradient_processes,
+                                        likelihood_processes=likelihood_processes,
+                                        memo_size=options.memo_size,
+                                        full_data=False)
+        initial_parameters = warm_start.estimate
+        for level in warm_start.levels:
+            print >> sys.stderr, 'Warm start %s: log-likelihood %g after %d evaluations in %.1f seconds' % \
+                (level.description, level.log_likelihood, level.evaluations, level.elapsed)
+
+    if options.starts > 1:
+        multi_start = multi_start_estimate(levels[-1].log_likelihood, initial_parameters, options.starts,
+                                           spread=numpy.log(options.start_spread),
+                                           optimizer_method=options.optimizer,
+                                           transform=parameter_transform,
+                                           processes=options.processes)
+        mle_parameters = multi_start.estimate
+        for start_no, run in enumerate(multi_start.runs):
+            print >> sys.stderr, 'Start %d: log-likelihood %g after %d evaluations%s' % \
+                (start_no, run.log_likelihood, run.evaluations, ' (stopped, dominated)' if run.dominated else '')
+
+        if options.logfile:
+            with open(options.logfile, 'w') as logfile:
+                if options.header:
+                    print >> logfile, '\t'.join(['start', 'split.time', 'theta', 'rho', 'log.likelihood'])
+                for start_no, run in enumerate(multi_start.runs):
+                    for parameters, value in run.trace:
+                        print >> logfile, '\t'.join(map(str, (start_no,) + tuple(transform(parameters)) + (value,)))
+
+    elif options.logfile:
         with open(options.logfile, 'w') as logfile:
 
             if options.header:
                 print >> logfile, '\t'.join(['split.time', 'theta', 'rho'])
 
-            mle_parameters = maximum_likelihood_estimate(log_likelihood,
-                                                         (init_split, init_coal, init_recomb),
-                                                         optimizer_method=options.optimizer,
-                                                         log_file=logfile,
-                                                         log_param_transform=transform)
+            multi_fidelity = multi_fidelity_estimate(levels,
+                                                     initial_parameters,
+                                                     optimizer_method=options.optimizer,
+                                                     log_file=logfile,
+                                                     log_param_transform=transform,
+                                                     transform=parameter_transform,
+                                                     processes=gradient_processes)
     else:
-        mle_parameters = maximum_likelihood_estimate(log_likelihood, (init_split, init_coal, init_recomb),
-                                                     optimizer_method=options.optimizer)
-
+        multi_fidelity = multi_fidelity_estimate(levels, initial_parameters,
+                                                 optimizer_method=options.optimizer,
+                                                 transform=parameter_transform,
+                                                 processes=gradient_processes)
+
+    if options.starts <= 1:
+        mle_parameters = multi_fidelity.estimate
+        if len(multi_fidelity.levels) > 1:
+            for level in multi_fidelity.levels:
+                print >> sys.stderr, 'Level %s: log-likelihood %g after %d evaluations in %.1f seconds' % \
+                    (level.description, level.log_likelihood, level.evaluations, level.elapsed)
+
+    # The target level is built by the estimation at the latest, never before it, so its worker
+    # processes do not run alongside those of the warm start subsets or the coarser levels.
+    log_likelihood = levels[-1].log_likelihood
     max_log_likelihood = log_likelihood(mle_parameters)
 
     with open(options.outfile, 'w') as outfile:
@@ -104,6 +210,9 @@ and uniform coalescence and recombination rates."""
             print >> outfile, '\t'.join(['split.time', 'theta', 'rho', 'log.likelihood'])
         print >> outfile, '\t'.join(map(str, transform(mle_parameters) + (max_log_likelihood,)))
 
+    if log_likelihood.memo is not None:
+        print >> sys.stderr, log_likelihood.memo_report()
+
 
 if __name__ == '__main__':
     main()
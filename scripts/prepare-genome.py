@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import sys
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from IMCoalHMM.alignments import open_alignment, write_alignment_dataset, unknown_symbols
+from IMCoalHMM.alignments import NO_SYMBOLS, DEFAULT_CHUNK_SIZE
+from IMCoalHMM.dataset import Dataset
+from IMCoalHMM.observations import DEFAULT_MIN_RUN_LENGTH
+
+MANIFEST = 'manifest.txt'
+
+
+def read_inputs(path):
+    """Find the per-chromosome alignments to prepare.
+
+    :param path: Either a directory, where every file is taken to be the
+     alignment of a chromosome named after the file, or a manifest with a
+     chromosome name and an alignment file, separated by whitespace, per line.
+     Relative file names in a manifest are relative to the manifest.
+    :returns: a list of (chromosome, alignment filename) pairs.
+    """
+    if os.path.isdir(path):
+        inputs = []
+        for entry_name in sorted(os.listdir(path)):
+            entry = os.path.join(path, entry_name)
+            if os.path.isfile(entry):
+                chromosome = entry_name[:-3] if entry_name.endswith('.gz') else entry_name
+                inputs.append((os.path.splitext(chromosome)[0], entry))
+        return inputs
+
+    inputs = []
+    with open(path) as manifest:
+        for line in manifest:
+            if line.startswith('#') or not line.strip():
+                continue
+            chromosome, filename = line.split()
+            inputs.append((chromosome, os.path.join(os.path.dirname(path), filename)))
+    return inputs
+
+
+def prepare_chromosome(job):
+    """Prepare the dataset for one chromosome. Runs in a worker process."""
+    chromosome, in_filename, options = job
+    alignment = open_alignment(in_filename, options.in_format)
+    names = options.names.split(',') if options.names else alignment.names
+    if len(names) not in NO_SYMBOLS:
+        raise ValueError('{0} has {1} sequences; CoalHMM needs two, three or four.'.format(in_filename, len(names)))
+
+    out_filename = os.path.join(options.output_dir, chromosome + '.imchmm')
+    symbol_counts = write_alignment_dataset(alignment, names, out_filename, chromosome,
+                                            chunk_size=options.chunk_size,
+                                            segment_size=options.segment_size,
+                                            preprocess=options.preprocess,
+                                            min_run_length=options.min_run_length)
+
+    dataset = Dataset(out_filename)
+    sites = sum(segment['length'] for segment in dataset.segments)
+    missing = sum(segment['missing'] * segment['length'] for segment in dataset.segments)
+    return chromosome, out_filename, len(dataset), sites, missing / max(sites, 1), unknown_symbols(symbol_counts)
+
+
+def main():
+    usage = """%(prog)s [options] <input dir or manifest> <input format> <output dir>
+
+This program prepares the alignments of all chromosomes of a genome for CoalHMM,
+converting several alignments at the same time. The input is either a directory
+with an alignment file per chromosome or a manifest listing a chromosome name and
+an alignment file on each line. Each chromosome is written to a dataset file,
+optionally cut into segments and preprocessed for the forward algorithm, in the
+output directory, together with a manifest of the datasets written.
+
+See prepare-alignments.py for the assumptions made about the alignments.
+"""
+
+    parser = ArgumentParser(usage=usage, version="%(prog)s 1.0")
+
+    parser.add_argument("--names",
+                        type=str,
+                        default=None,
+                        help="A comma-separated list of names to use from the source files")
+    parser.add_argument("--processes",
+                        type=int,
+                        default=None,
+                        help="Number of chromosomes to prepare at the same time (number of CPUs)")
+    parser.add_argument("--segment-size",
+                        type=int,
+                        default=None,
+                        help="Cut the chromosomes into segments of this many columns")
+    parser.add_argument("--preprocess",
+                        action="store_true",
+                        default=False,
+                        help="Store the preprocessing for the forward algorithm with the segments")
+    parser.add_argument("--min-run-length",
+                        type=int,
+                        default=DEFAULT_MIN_RUN_LENGTH,
+                        help="Run-length encode runs of a symbol this long when preprocessing (%d)"
+                             % DEFAULT_MIN_RUN_LENGTH)
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=DEFAULT_CHUNK_SIZE,
+                        help="Number of alignment columns processed at a time (%d)" % DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--verbose",
+                        action="store_true",
+                        default=False,
+                        help="Print status information during processing")
+
+    # positional arguments
+    parser.add_argument("input", type=str, help="Input directory or manifest")
+    parser.add_argument("in_format", type=str, help="The file format for the input")
+    parser.add_argument("output_dir", type=str, help="Where to write the datasets")
+
+    options = parser.parse_args()
+
+    if not os.path.exists(options.input):
+        print 'The input', options.input, 'does not exists.'
+        sys.exit(1)
+
+    if os.path.exists(options.output_dir):
+        print 'The output directory', options.output_dir, 'already exists.'
+        print 'If you want to replace it, please explicitly remove the current'
+        print 'version first.'
+        sys.exit(1)
+
+    inputs = read_inputs(options.input)
+    if len(set(chromosome for chromosome, _ in inputs)) < len(inputs):
+        print 'The input lists the same chromosome more than once.'
+        sys.exit(1)
+    os.makedirs(options.output_dir)
+
+    pool = Pool(options.processes)
+    try:
+        results = []
+        jobs = [(chromosome, in_filename, options) for chromosome, in_filename in inputs]
+        for result in pool.imap_unordered(prepare_chromosome, jobs):
+            results.append(result)
+            if options.verbose:
+                print "Prepared '%s' (%d of %d)" % (result[0], len(results), len(jobs))
+                sys.stdout.flush()
+    finally:
+        pool.terminate()
+
+    order = dict((chromosome, index) for index, (chromosome, _) in enumerate(inputs))
+    results.sort(key=lambda result: order[result[0]])
+    with open(os.path.join(options.output_dir, MANIFEST), 'w') as manifest:
+        print >> manifest, '\t'.join(['#chromosome', 'dataset', 'segments', 'sites', 'missing'])
+        for chromosome, out_filename, no_segments, sites, missing, _ in results:
+            print >> manifest, '\t'.join(map(str, [chromosome, os.path.basename(out_filename),
+                                                   no_segments, sites, missing]))
+
+    for chromosome, _, _, _, _, unknown in results:
+        if unknown:
+            print >> sys.stderr, "I didn't understand the following symbols in '%s': %s" % (chromosome, unknown)
+
+
+if __name__ == "__main__":
+    main()
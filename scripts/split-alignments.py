@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import sys
+from argparse import ArgumentParser
+
+from IMCoalHMM.observations import read_observations, find_segments, write_segment_directory
+from IMCoalHMM.dataset import write_dataset
+
+
+def main():
+    usage = """%(prog)s [options] <output> <input> [<input> ...]
+
+This program splits preprocessed alignments (as written by prepare-alignments.py)
+at long runs of missing data and writes the pieces in between as independent
+segments to a single dataset file that the analysis scripts accept in place of
+an alignment file. Each input file is taken to be one chromosome, named after
+the file unless --chromosome is given.
+"""
+
+    parser = ArgumentParser(usage=usage, version="%(prog)s 1.1")
+
+    parser.add_argument("--min-gap",
+                        type=int,
+                        default=10000,
+                        help="Split at runs of missing data at least this long (10000)")
+    parser.add_argument("--min-segment",
+                        type=int,
+                        default=1,
+                        help="Drop segments shorter than this (1)")
+    parser.add_argument("--chromosome",
+                        type=str,
+                        default=None,
+                        help="Chromosome name to use for a single input file")
+    parser.add_argument("--missing-symbol",
+                        type=int,
+                        default=2,
+                        help="The symbol used for missing data (2)")
+    parser.add_argument("--symbols",
+                        type=int,
+                        default=3,
+                        help="The size of the alphabet in the alignments (3)")
+    parser.add_argument("--segment-directory",
+                        action="store_true",
+                        default=False,
+                        help="Write a directory with a text file per segment instead of a dataset file")
+
+    # positional arguments
+    parser.add_argument("output", type=str, help="Where to write the segments")
+    parser.add_argument("in_filenames", type=str, nargs='+', help="Input files")
+
+    options = parser.parse_args()
+
+    if options.chromosome is not None and len(options.in_filenames) > 1:
+        parser.error("--chromosome can only be used with a single input file")
+
+    if os.path.exists(options.output):
+        print 'The output', options.output, 'already exists.'
+        print 'If you want to replace it, please explicitly remove the current'
+        print 'version first.'
+        sys.exit(1)
+
+    segments = []
+    total_length = 0
+    for in_filename in options.in_filenames:
+        chromosome = options.chromosome or os.path.basename(in_filename)
+        obs = read_observations(in_filename)
+        total_length += len(obs)
+        for start, end in find_segments(obs, options.min_gap, options.missing_symbol):
+            if end - start >= options.min_segment:
+                segments.append((chromosome, start, obs[start:end]))
+
+    if options.segment_directory:
+        write_segment_directory(options.output, segments)
+    else:
+        write_dataset(options.output, segments, options.symbols, options.missing_symbol)
+
+    kept_length = sum(len(obs) for _, _, obs in segments)
+    dropped_length = total_length - kept_length
+    print 'Sites read:    ', total_length
+    print 'Segments:      ', len(segments)
+    print 'Sites kept:    ', kept_length
+    print 'Sites dropped: ', dropped_length, '(%.2f%%)' % (100.0 * dropped_length / max(total_length, 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+import os
+import os.path
+import sys
+from argparse import ArgumentParser
+import numpy as np
+
+from IMCoalHMM.vcf import read_vcf, read_mask, parse_haplotype, compare_haplotypes, pairwise_observations
+from IMCoalHMM.vcf import DEFAULT_CHUNK_SIZE
+from IMCoalHMM.dataset import DatasetWriter
+
+
+def main():
+    usage = """%(prog)s [options] <output> <vcf> [<vcf> ...]
+
+This program builds the pairwise observations CoalHMM needs directly from VCF
+files, comparing two haplotypes, and writes them to a dataset file with a
+segment per chromosome.
+
+Sites inside the callable regions given with --mask (a BED file) that have no
+variant record are taken to match the reference in both haplotypes; sites
+outside them are missing data. Without a mask every site is callable.
+
+The haplotypes are given as SAMPLE:INDEX, where INDEX picks an allele of the
+sample's genotype, so SAMPLE:0,SAMPLE:1 compares the two haplotypes of a
+diploid sample. The samples can be in the same or in different VCF files.
+Comparing haplotypes of different samples only makes sense for haploid or
+phased genotypes.
+"""
+
+    parser = ArgumentParser(usage=usage, version="%(prog)s 1.0")
+
+    parser.add_argument("--haplotypes",
+                        type=str,
+                        required=True,
+                        help="The two haplotypes to compare, as SAMPLE:INDEX,SAMPLE:INDEX")
+    parser.add_argument("--mask",
+                        type=str,
+                        default=None,
+                        help="BED file with the callable regions")
+    parser.add_argument("--chromosomes",
+                        type=str,
+                        default=None,
+                        help="A comma-separated list of chromosomes to include (those in the mask or VCF files)")
+    parser.add_argument("--chunk-size",
+                        type=int,
+                        default=DEFAULT_CHUNK_SIZE,
+                        help="Number of sites processed at a time (%d)" % DEFAULT_CHUNK_SIZE)
+
+    # positional arguments
+    parser.add_argument("output_filename", type=str, help="Where to write the dataset")
+    parser.add_argument("vcf_filenames", type=str, nargs='+', help="VCF files")
+
+    options = parser.parse_args()
+
+    haplotypes = [parse_haplotype(spec) for spec in options.haplotypes.split(',')]
+    if len(haplotypes) != 2:
+        parser.error("--haplotypes must name exactly two haplotypes")
+
+    if os.path.exists(options.output_filename):
+        print 'The output file', options.output_filename, 'already exists.'
+        print 'If you want to replace it, please explicitly remove the current'
+        print 'version first.'
+        sys.exit(1)
+
+    mask = read_mask(options.mask) if options.mask else None
+    vcfs = [read_vcf(filename, haplotypes) for filename in options.vcf_filenames]
+    for haplotype in haplotypes:
+        if not any(haplotype in vcf.haplotypes for vcf in vcfs):
+            print 'None of the VCF files have the sample', haplotype[0]
+            sys.exit(1)
+
+    if options.chromosomes:
+        chromosomes = options.chromosomes.split(',')
+    elif mask is not None:
+        chromosomes = list(mask.keys())
+    else:
+        chromosomes = []
+        for vcf in vcfs:
+            chromosomes.extend(chromosome for chromosome in vcf.calls if chromosome not in chromosomes)
+
+    total_sites = callable_sites = variable_sites = 0
+    with DatasetWriter(options.output_filename, 3) as writer:
+        for chromosome in chromosomes:
+            positions, observations = compare_haplotypes([vcf.chromosome(chromosome) for vcf in vcfs], haplotypes)
+            chromosome_mask = None
+            if mask is not None:
+                no_regions = np.zeros(0, dtype=np.int64)
+                chromosome_mask = mask.get(chromosome, (no_regions, no_regions))
+
+            lengths = [vcf.lengths[chromosome] for vcf in vcfs if chromosome in vcf.lengths]
+            if lengths:
+                length = max(lengths)
+            else:
+                length = positions[-1] + 1 if len(positions) else 0
+                if chromosome_mask is not None and len(chromosome_mask[1]):
+                    length = max(length, chromosome_mask[1].max())
+
+            writer.begin_segment(chromosome, 0)
+            for chunk in pairwise_observations(int(length), chromosome_mask, positions, observations,
+                                               options.chunk_size):
+                writer.extend_segment(chunk)
+                total_sites += len(chunk)
+                callable_sites += (chunk != 2).sum()
+                variable_sites += (chunk == 1).sum()
+            writer.end_segment()
+
+    print 'Sites:         ', total_sites
+    print 'Callable sites:', callable_sites
+    print 'Variable sites:', variable_sites
+
+
+if __name__ == "__main__":
+    main()
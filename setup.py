@@ -22,6 +22,9 @@ setup(
                'scripts/initial-migration-model.py',
                'scripts/initial-migration-model-mcmc.py',
                'scripts/heuristic-optimiser.py',
+               'scripts/split-alignments.py',
+               'scripts/prepare-genome.py',
+               'scripts/vcf-to-observations.py',
               ],
 
     install_requires = ['numpy', 
@@ -1,9 +1,23 @@
 """Code for constructing CTMCs and computing transition probabilities
 in them."""
 
+import numpy
 from numpy import zeros
 from scipy import matrix
-from scipy.linalg import expm
+from scipy.linalg import expm, eig, LinAlgError
+
+# Largest condition number of the eigenvector matrix for which we trust an
+# eigendecomposition of the rate matrix for computing probability matrices.
+MAX_EIGENVECTOR_CONDITION = 1e8
+
+# Time steps shorter than this, relative to the fastest rate of the CTMC, are
+# computed with expm. For them the eigendecomposition cannot keep the relative
+# accuracy of the small off-diagonal probabilities.
+MIN_SCALED_TIME_STEP = 1e-3
+
+# Largest bound on the relative rounding error of a probability computed from the
+# eigendecomposition; matrices with a less accurate probability are computed with expm.
+MAX_RELATIVE_ERROR = 1e-8
 
 
 class CTMC(object):
@@ -35,6 +49,8 @@ class CTMC(object):
             self.rate_matrix[i, i] = - self.rate_matrix[i, :].sum()
 
         self.prob_matrix_cache = dict()
+        self.eigen_decomposition_ = None
+        self.reachable_ = None
 
     def probability_matrix(self, delta_t):
         """Computes the transition probability matrix for a
@@ -50,6 +66,86 @@ class CTMC(object):
             self.prob_matrix_cache[delta_t] = expm(self.rate_matrix * delta_t)
         return self.prob_matrix_cache[delta_t]
 
+    def eigen_decomposition(self):
+        """Diagonalise the rate matrix, Q = V diag(w) V^-1.
+
+        :returns: the eigenvalues w, the eigenvectors V and their inverse, or None
+         if the rate matrix is not (numerically) diagonalisable.
+        """
+        if self.eigen_decomposition_ is None:
+            self.eigen_decomposition_ = False
+            try:
+                values, vectors = eig(self.rate_matrix)
+                if numpy.linalg.cond(vectors) < MAX_EIGENVECTOR_CONDITION:
+                    if not numpy.iscomplexobj(values) or not values.imag.any():
+                        values, vectors = values.real, vectors.real
+                    self.eigen_decomposition_ = values, vectors, numpy.linalg.inv(vectors)
+            except LinAlgError:
+                pass
+        return self.eigen_decomposition_ or None
+
+    def reachable(self):
+        """The pairs of states where the second can be reached from the first, which are
+        the probabilities that are positive for any time period.
+
+        :rtype: numpy.ndarray
+        """
+        if self.reachable_ is None:
+            reachable = (numpy.asarray(self.rate_matrix) != 0.0) | numpy.identity(len(self.rate_matrix), dtype=bool)
+            while True:
+                closure = numpy.dot(reachable, reachable)
+                if (closure == reachable).all():
+                    break
+                reachable = closure
+            self.reachable_ = reachable
+        return self.reachable_
+
+    def probability_matrices(self, deltas):
+        """Computes the transition probability matrices for several time periods.
+
+        All the matrices not already cached are computed from a single
+        eigendecomposition of the rate matrix, falling back to computing
+        each with expm if the decomposition is ill-conditioned, the time
+        period is very short compared to the rates, or rounding could leave
+        a small probability inaccurate relative to its size. Equal time
+        periods are only computed once.
+
+        :param deltas: The time periods the CTMC should run for.
+        :type deltas: list[float]
+
+        :returns: The probability transition matrix for each time period.
+        :rtype: list[matrix]
+        """
+        missing = sorted(set(delta_t for delta_t in deltas if delta_t not in self.prob_matrix_cache))
+        decomposition = self.eigen_decomposition() if len(missing) > 1 else None
+        if decomposition is None:
+            for delta_t in missing:
+                self.probability_matrix(delta_t)
+        else:
+            values, vectors, inverse = decomposition
+            fastest_rate = numpy.abs(values).max()
+            reachable = self.reachable()
+            absolute_vectors, absolute_inverse = numpy.abs(vectors), numpy.abs(inverse)
+            for delta_t in missing:
+                if delta_t * fastest_rate < MIN_SCALED_TIME_STEP:
+                    self.probability_matrix(delta_t)
+                    continue
+                exponentials = numpy.exp(values * delta_t)
+                probabilities = numpy.dot(vectors * exponentials, inverse).real
+                # Each probability is a sum of terms that can be far larger than it, so the
+                # rounding error of the sum, not the probability, sets its accuracy.
+                error = numpy.finfo(float).eps * len(values) * \
+                    numpy.dot(absolute_vectors * numpy.abs(exponentials), absolute_inverse)
+                if (error[reachable] > MAX_RELATIVE_ERROR * probabilities[reachable]).any():
+                    self.probability_matrix(delta_t)
+                    continue
+                # Rounding errors can leave probabilities just outside [0, 1], and the
+                # unreachable states with a little probability.
+                probabilities = numpy.clip(probabilities, 0.0, 1.0)
+                probabilities[~reachable] = 0.0
+                self.prob_matrix_cache[delta_t] = matrix(probabilities)
+        return [self.prob_matrix_cache[delta_t] for delta_t in deltas]
+
 
 # We cache the CTMCs because in the optimisations, especially the models with a large number
 # of parameters, we are creating the same CTMCs again and again and computing the probability
@@ -58,6 +154,32 @@ from cache import Cache
 CTMC_CACHE = Cache()
 
 
+def probability_matrices(ctmcs, deltas):
+    """Computes the transition probability matrices for running each CTMC for
+    the matching time period.
+
+    The time periods are grouped by CTMC so the matrices of each CTMC are computed
+    in one batch. Intervals of different epochs with the same rates share a CTMC,
+    through make_ctmc, so they are also computed together.
+
+    :param ctmcs: The CTMC for each time period.
+    :type ctmcs: list[CTMC]
+    :param deltas: The time periods.
+    :type deltas: list[float]
+
+    :rtype: list[matrix]
+    """
+    groups = dict()
+    for index, ctmc in enumerate(ctmcs):
+        groups.setdefault(id(ctmc), (ctmc, []))[1].append(index)
+
+    matrices = [None] * len(ctmcs)
+    for ctmc, indices in groups.values():
+        for index, probability_matrix in zip(indices, ctmc.probability_matrices([deltas[i] for i in indices])):
+            matrices[index] = probability_matrix
+    return matrices
+
+
 def make_ctmc(state_space, rates_table):
     """Create the CTMC based on a state space and a mapping
     from transition labels to rates.
@@ -1,13 +1,14 @@
-from math import exp
 from IMCoalHMM.statespace_generator import CoalSystem
-from IMCoalHMM.transitions import projection_matrix, compute_between, compute_upto
+from IMCoalHMM.transitions import projection_matrix, compute_between, compute_upto, changed_matrices
 from IMCoalHMM.CTMC import make_ctmc
 from IMCoalHMM.model import Model
 from IMCoalHMM.break_points import exp_break_points, trunc_exp_break_points
+from IMCoalHMM.emissions import truncated_exp_midpoint, exp_midpoint
 
+from itertools import chain, combinations
+import numpy as np
 from numpy import zeros, matrix, ix_
 from numpy.testing import assert_almost_equal
-from pyZipHMM import Matrix
 
 
 # For debugging...
@@ -47,6 +48,23 @@ STATE_23 = frozenset([frozenset([2, 3]), frozenset([1])])
 STATE_E = frozenset([frozenset([1, 2, 3])])
 
 ALL_STATES = [STATE_B, STATE_12, STATE_13, STATE_23, STATE_E]
+
+# Compact codes for the state types: a marginal state is coded by its index in ALL_STATES
+# and a pair of left and right marginal states by left * NO_MARGINAL_TYPES + right.
+STATE_CODES = dict((state, code) for code, state in enumerate(ALL_STATES))
+NO_MARGINAL_TYPES = len(ALL_STATES)
+NO_JOINT_TYPES = NO_MARGINAL_TYPES ** 2
+CODE_B, CODE_E = STATE_CODES[STATE_B], STATE_CODES[STATE_E]
+
+# The leaf outside the cherry for trees whose first coalescence leads to each state type.
+OUTER_LEAF = np.array([0, 3, 2, 1, 0])
+
+
+def joint_code(state_type):
+    """The code of a (left, right) pair of marginal state types."""
+    left, right = state_type
+    return STATE_CODES[left] * NO_MARGINAL_TYPES + STATE_CODES[right]
+
 MARGINAL_PATHS = [
     [STATE_B, STATE_E],
     [STATE_B, STATE_12, STATE_E],
@@ -73,6 +91,19 @@ for _left in MARGINAL_PATHS:
     for _right in MARGINAL_PATHS:
         JOINT_PATHS.extend(path_merger(_left, _right))
 
+# The joint paths as sequences of state type codes.
+JOINT_PATH_CODES = [np.array([joint_code(state_type) for state_type in _path]) for _path in JOINT_PATHS]
+MAX_PATH_STEPS = max(len(_codes) for _codes in JOINT_PATH_CODES) - 1
+
+
+def increasing_intervals(no_intervals, no_steps):
+    """All increasing sequences of no_steps intervals, in lexicographical order, as rows of an array.
+
+    This enumerates the same timings as time_path but without building a path for each.
+    """
+    timings = np.fromiter(chain.from_iterable(combinations(xrange(no_intervals), no_steps)), dtype=np.int32)
+    return timings.reshape(-1, no_steps)
+
 
 def time_path(path, x, y):
     assert len(path) > 1
@@ -98,12 +129,15 @@ class ILSSystem(CoalSystem):
     def __init__(self):
         super(ILSSystem, self).__init__()
         self.state_type = dict()
+        self.type_states = dict()
         self.transitions = [[('R', self.recombination)], [('C', self.coalesce)]]
 
     def sort_states(self):
         for state, index in self.states.items():
             left, right = extract_lineages(state)
             self.state_type.setdefault((left, right), []).append(index)
+        for state_type, indices in self.state_type.items():
+            self.type_states[joint_code(state_type)] = np.array(sorted(indices))
 
 
 class Isolation3(ILSSystem):
@@ -195,14 +229,13 @@ def compute_through(epoch_2, epoch_3, break_points_12, break_points_123):
     projection_21 = projection_matrix(epoch_2.state_space, epoch_3.state_space, state_map_21)
 
     # Through epoch 2
-    for i in range(len(break_points_12) - 1):
-        through_12[i] = epoch_2.probability_matrix(break_points_12[i + 1] - break_points_12[i])
-    through_12[len(break_points_12)-1] = \
-        epoch_2.probability_matrix(break_points_123[0] - break_points_12[-1]) * projection_21
+    deltas_12 = [break_points_12[i + 1] - break_points_12[i] for i in range(len(break_points_12) - 1)]
+    through_12[:] = epoch_2.probability_matrices(deltas_12 + [break_points_123[0] - break_points_12[-1]])
+    through_12[len(break_points_12)-1] = through_12[len(break_points_12)-1] * projection_21
 
     # Through epoch 3
-    for i in range(len(break_points_123) - 1):
-        through_123[i] = epoch_3.probability_matrix(break_points_123[i + 1] - break_points_123[i])
+    through_123[:] = epoch_3.probability_matrices([break_points_123[i + 1] - break_points_123[i]
+                                                   for i in range(len(break_points_123) - 1)])
 
     # As a hack we set up a pseudo through matrix for the last interval that
     # just puts all probability on ending in one of the end states. This
@@ -219,7 +252,8 @@ def compute_through(epoch_2, epoch_3, break_points_12, break_points_123):
 class ILSCTMCSystem(object):
     """Wrapper around CTMC transition matrices for the ILS model."""
 
-    def __init__(self, model, epoch_1_ctmc, epoch_2_ctmc, epoch_3_ctmc, break_points_12, break_points_123):
+    def __init__(self, model, epoch_1_ctmc, epoch_2_ctmc, epoch_3_ctmc, break_points_12, break_points_123,
+                 previous=None):
         self.model = model
         self.epoch_1 = epoch_1_ctmc
         self.epoch_2 = epoch_2_ctmc
@@ -228,8 +262,15 @@ class ILSCTMCSystem(object):
         self.break_points_123 = break_points_123
 
         self.through_ = compute_through(self.epoch_2, self.epoch_3, self.break_points_12, self.break_points_123)
-        self.up_to_ = compute_upto(compute_up_to0(self.epoch_1, self.epoch_2, self.break_points_12[0]), self.through_)
-        self.between_ = compute_between(self.through_)
+        up_to0 = compute_up_to0(self.epoch_1, self.epoch_2, self.break_points_12[0])
+        if previous is None or len(previous.through_) != len(self.through_):
+            self.up_to_ = compute_upto(up_to0, self.through_)
+            self.between_ = compute_between(self.through_)
+        else:
+            # Reuse the products of the matrices that are unchanged since the previous evaluation.
+            changed_through = changed_matrices(self.through_, previous.through_)
+            self.up_to_ = compute_upto(up_to0, self.through_, previous.up_to_, changed_through)
+            self.between_ = compute_between(self.through_, previous.between_, changed_through)
 
     def through(self, i):
         return self.through_[i]
@@ -256,25 +297,50 @@ class ILSCTMCSystem(object):
         return probability.sum()
 
     def make_joint_matrix(self):
-        no_states = len(self.model.tree_map)
-        joint = matrix(zeros((no_states, no_states)))
-        for path in self.model.valid_paths:
-            i, j = self.model.get_path_indices(path)
-            joint[i, j] = self.get_path_probability(path)
-        return joint
+        """Compute the joint probability of all pairs of marginal trees.
+
+        The path probabilities are computed over the prefix trie of the valid paths,
+        so the vector for each distinct prefix is computed once and shared by all the
+        paths that extend it. Prefixes with the same last step are extended together
+        as the rows of a matrix."""
+        model = self.model
+        through = [np.asarray(m) for m in self.through_]
+        up_to = [np.asarray(m)[model.initial] for m in self.up_to_]
+
+        sums = np.empty(len(model.prefix_parent))
+        previous = None
+        for level_size, groups in model.prefix_levels:
+            vectors_buffer = np.empty(level_size)
+            for first, last, i, j, x, y, offset in groups:
+                states_x = model.get_state_indices(j, x)
+                states_y = model.get_state_indices(j + 1, y)
+                if i < 0:
+                    vectors = np.tile(up_to[j][states_x], (last - first, 1))
+                else:
+                    parent_states = np.arange(len(model.get_state_indices(i + 1, x)))
+                    parent_offsets = model.prefix_offset[model.prefix_parent[first:last]]
+                    vectors = previous[parent_offsets[:, np.newaxis] + parent_states]
+                    if j > i + 1:
+                        # Moving from the end of interval i to the start of interval j is
+                        # the identity when j = i + 1.
+                        between = np.asarray(self.between(i, j))
+                        vectors = vectors.dot(between[ix_(model.get_state_indices(i + 1, x), states_x)])
+                vectors = vectors.dot(through[j][ix_(states_x, states_y)])
+                vectors_buffer[offset:offset + vectors.size] = vectors.ravel()
+                sums[first:last] = vectors.sum(axis=1)
+            previous = vectors_buffer
+
+        no_states = model.no_trees
+        joint = np.zeros((no_states, no_states))
+        joint[model.path_trees[:, 0], model.path_trees[:, 1]] = sums[model.path_prefix]
+        return matrix(joint)
 
     def compute_transition_probabilities(self):
-        no_states = len(self.model.tree_map)
-        joint = self.make_joint_matrix()
+        joint = np.asarray(self.make_joint_matrix())
         assert_almost_equal(joint.sum(), 1.0)
 
-        initial_prob_vector = Matrix(no_states, 1)
-        transition_matrix = Matrix(no_states, no_states)
-        for i in xrange(no_states):
-            initial_prob_vector[i, 0] = joint[i, ].sum()
-            for j in xrange(no_states):
-                transition_matrix[i, j] = joint[i, j] / initial_prob_vector[i, 0]
-
+        initial_prob_vector = joint.sum(axis=1)
+        transition_matrix = joint / initial_prob_vector[:, np.newaxis]
         return initial_prob_vector, transition_matrix
 
 
@@ -298,12 +364,10 @@ class ILSModel(Model):
 
         self.init_index = self.epoch_1.init_index
 
-        self.valid_paths_ = None
-        self.tree_map = None
-        self.reverse_tree_map = None
-
         self.make_valid_paths()
         self.index_marginal_trees()
+        self.index_tree_topologies()
+        self.make_prefix_trie()
 
     def get_state_space(self, i):
         if i < self.no_12_intervals:
@@ -329,29 +393,62 @@ class ILSModel(Model):
         else:
             return None
 
-    def valid_system_path(self, timed_path):
-        for x, i, y in timed_path:
-            if self.get_states(i, x) is None:
-                # This should always be an obtainable state since we start in it.
-                return False
-            if self.get_states(i+1, y) is None or self.get_states(i, y) is None:
-                # Although we only need to index these states at point i+1 we need to know
-                # that they are also at the end of interval i since otherwise they would
-                # have zero probability anyway
-                return False
-        return True
+    def get_state_indices(self, i, code):
+        """The indices of the states with the given state type code at the start of interval i,
+        as an array, or None if there are no such states."""
+        return self.get_state_space(i).type_states.get(code)
 
     def make_valid_paths(self):
+        """Enumerate the timed joint paths that are possible in the state spaces.
+
+        A timed path is stored compactly as the index of its joint path in JOINT_PATHS,
+        kept in path_kinds, and the intervals of its steps, kept in the rows of
+        path_intervals padded with -1. The timings of each joint path are generated and
+        filtered as arrays, in the order time_path would produce them.
+        """
         no_intervals = self.no_intervals
-        self.valid_paths_ = []
-        for path in JOINT_PATHS:
-            for timed_path in time_path(path, 0, no_intervals):
-                if self.valid_system_path(timed_path):
-                    self.valid_paths_.append(timed_path)
+
+        # present[i, c] tells if there are states of type c at the start of interval i.
+        present = np.zeros((no_intervals + 1, NO_JOINT_TYPES), dtype=bool)
+        for i in xrange(no_intervals + 1):
+            for code in xrange(NO_JOINT_TYPES):
+                present[i, code] = self.get_state_indices(i, code) is not None
+
+        kinds, intervals = [], []
+        for kind, codes in enumerate(JOINT_PATH_CODES):
+            no_steps = len(codes) - 1
+            timings = increasing_intervals(no_intervals, no_steps)
+            valid = np.ones(len(timings), dtype=bool)
+            for step in xrange(no_steps):
+                x, y, i = codes[step], codes[step + 1], timings[:, step]
+                # Although we only need to index y at point i+1 we need to know that they are
+                # also at the end of interval i since otherwise they would have zero probability.
+                valid &= present[i, x] & present[i + 1, y] & present[i, y]
+            timings = timings[valid]
+            padded = np.empty((len(timings), MAX_PATH_STEPS), dtype=np.int32)
+            padded.fill(-1)
+            padded[:, :no_steps] = timings
+            kinds.append(np.empty(len(timings), dtype=np.int32))
+            kinds[-1].fill(kind)
+            intervals.append(padded)
+
+        self.path_kinds = np.concatenate(kinds)
+        self.path_intervals = np.concatenate(intervals)
+
+    @property
+    def no_paths(self):
+        return len(self.path_kinds)
+
+    def decode_path(self, path_no):
+        """The timed path path_no as a list of (state type, interval, state type) steps."""
+        path = JOINT_PATHS[self.path_kinds[path_no]]
+        return [(path[step], int(self.path_intervals[path_no, step]), path[step + 1])
+                for step in xrange(len(path) - 1)]
 
     @property
     def valid_paths(self):
-        return self.valid_paths_
+        """The valid timed paths, decoded. Only meant for debugging and testing."""
+        return [self.decode_path(path_no) for path_no in xrange(self.no_paths)]
 
     @staticmethod
     def get_marginal_time_path(timed_path, margin):
@@ -362,23 +459,71 @@ class ILSModel(Model):
                 marginal_path.append((xx, i, yy))
         return tuple(marginal_path)
 
+    def marginal_tree_keys(self, kinds, intervals, margin):
+        """Code the marginal trees of timed paths as integers.
+
+        A marginal tree is given by the state type reached by its first coalescence
+        (CODE_E for a star tree) and the intervals of its first and last coalescence, and
+        coded as (first_type * no_intervals + first_interval) * no_intervals + last_interval.
+        """
+        no_intervals = self.no_intervals
+        keys = np.empty(len(kinds), dtype=np.int64)
+        for kind, codes in enumerate(JOINT_PATH_CODES):
+            selected = kinds == kind
+            marginal_codes = codes // NO_MARGINAL_TYPES if margin == 0 else codes % NO_MARGINAL_TYPES
+            changes = np.nonzero(marginal_codes[1:] != marginal_codes[:-1])[0]
+            first_type = marginal_codes[changes[0] + 1]
+            keys[selected] = ((first_type * no_intervals + intervals[selected, changes[0]]) * no_intervals
+                              + intervals[selected, changes[-1]])
+        return keys
+
     def index_marginal_trees(self):
-        self.tree_map = {}
-        index = 0
-        for path in self.valid_paths:
-            tree = self.get_marginal_time_path(path, 0)
-            if tree not in self.tree_map:
-                self.tree_map[tree] = index
-                index += 1
-
-        self.reverse_tree_map = [None] * len(self.tree_map)
-        for tree, i in self.tree_map.items():
-            self.reverse_tree_map[i] = tree
+        """Number the marginal trees, the states of the HMM, in the order they first appear as
+        the left tree of a valid path, and find the left and right tree of each valid path.
+        """
+        left_keys = self.marginal_tree_keys(self.path_kinds, self.path_intervals, 0)
+        right_keys = self.marginal_tree_keys(self.path_kinds, self.path_intervals, 1)
+
+        tree_keys, first_paths = np.unique(left_keys, return_index=True)
+        self.tree_keys = tree_keys[np.argsort(first_paths)]
+        self.tree_lookup = np.empty(NO_MARGINAL_TYPES * self.no_intervals ** 2, dtype=np.int32)
+        self.tree_lookup.fill(-1)
+        self.tree_lookup[self.tree_keys] = np.arange(len(self.tree_keys))
+
+        self.path_trees = np.column_stack((self.tree_lookup[left_keys], self.tree_lookup[right_keys]))
+        assert (self.path_trees >= 0).all(), "right tree that is never a left tree"
+
+    @property
+    def no_trees(self):
+        return len(self.tree_keys)
+
+    def decode_tree(self, tree):
+        """The marginal tree with index tree as a tuple of (state, interval, state) steps."""
+        key = int(self.tree_keys[tree])
+        first_type, first_interval = divmod(key // self.no_intervals, self.no_intervals)
+        last_interval = key % self.no_intervals
+        if first_type == CODE_E:
+            return (STATE_B, first_interval, STATE_E),
+        first_state = ALL_STATES[first_type]
+        return (STATE_B, first_interval, first_state), (first_state, last_interval, STATE_E)
+
+    @property
+    def reverse_tree_map(self):
+        """The marginal trees, decoded. Only meant for debugging."""
+        return [self.decode_tree(tree) for tree in xrange(self.no_trees)]
+
+    @property
+    def tree_map(self):
+        """The index of each decoded marginal tree. Only meant for debugging."""
+        return dict((tree, index) for index, tree in enumerate(self.reverse_tree_map))
 
     def get_path_indices(self, path):
-        left_tree = self.get_marginal_time_path(path, 0)
-        right_tree = self.get_marginal_time_path(path, 1)
-        return self.tree_map[left_tree], self.tree_map[right_tree]
+        """The indices of the left and right marginal trees of a decoded timed path."""
+        kind = JOINT_PATHS.index([x for x, _, _ in path] + [path[-1][2]])
+        kinds = np.array([kind])
+        intervals = np.array([[i for _, i, _ in path] + [-1] * (MAX_PATH_STEPS - len(path))])
+        return (self.tree_lookup[self.marginal_tree_keys(kinds, intervals, 0)[0]],
+                self.tree_lookup[self.marginal_tree_keys(kinds, intervals, 1)[0]])
 
     def build_ctmc_system(self, tau1, tau2, coal1, coal2, coal3, coal12, coal123, recombination_rate):
         """Construct CTMC system."""
@@ -389,7 +534,99 @@ class ILSModel(Model):
         self.break_points_12 = trunc_exp_break_points(self.no_12_intervals, coal12, tau1 + tau2, tau1)
         self.break_points_123 = exp_break_points(self.no_123_intervals, coal123, tau1 + tau2)
 
-        return ILSCTMCSystem(self, epoch_1_ctmc, epoch_2_ctmc, epoch_3_ctmc, self.break_points_12, self.break_points_123)
+        return ILSCTMCSystem(self, epoch_1_ctmc, epoch_2_ctmc, epoch_3_ctmc, self.break_points_12, self.break_points_123,
+                             previous=self.previous_ctmc_system)
+
+    def make_prefix_trie(self):
+        """Organise the valid paths in a trie over their prefixes.
+
+        Prefix n ends with a step from state type prefix_x[n] through interval prefix_end[n]
+        to prefix_y[n] and extends prefix prefix_parent[n], which ends in interval
+        prefix_start[n], or starts a path if the parent is -1. Parents come before their
+        children, and path_prefix gives the prefix that is the complete path.
+
+        The prefixes of each length are numbered so those with the same last step,
+        (start, end, x, y), are consecutive. prefix_levels lists for each length the size
+        of the buffer holding the probability vectors of its prefixes and the groups of
+        prefixes with the same last step, as (first, last, start, end, x, y, offset) where
+        offset is where the vectors of the group start in the buffer; prefix_offset is
+        where the vector of each prefix starts.
+        """
+        no_intervals = self.no_intervals
+        codes = np.array([np.append(codes, [-1] * (MAX_PATH_STEPS + 1 - len(codes))) for codes in JOINT_PATH_CODES])
+        path_codes = codes[self.path_kinds]
+
+        parents, starts, ends, xs, ys, offsets = [], [], [], [], [], []
+        self.prefix_levels = []
+        no_prefixes = 0
+        path_prefix = np.empty(self.no_paths, dtype=np.int64)
+        path_prefix.fill(-1)
+        for step in xrange(MAX_PATH_STEPS):
+            paths = np.nonzero(self.path_intervals[:, step] >= 0)[0]
+            if len(paths) == 0:
+                break
+            parent = path_prefix[paths]
+            j = self.path_intervals[paths, step]
+            y = path_codes[paths, step + 1]
+            # A prefix is identified by its parent and its last step.
+            keys = ((parent + 1) * no_intervals + j) * NO_JOINT_TYPES + y
+            _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+            level_paths = paths[first]
+            level_parent = parent[first]
+            level_start = self.path_intervals[level_paths, step - 1] if step > 0 else -np.ones_like(first)
+            level_end = j[first]
+            level_x = path_codes[level_paths, step]
+            level_y = y[first]
+
+            group_keys = ((((level_start + 1) * no_intervals + level_end) * NO_JOINT_TYPES + level_x)
+                          * NO_JOINT_TYPES + level_y)
+            order = np.argsort(group_keys, kind='mergesort')
+            rank = np.empty_like(order)
+            rank[order] = np.arange(len(order))
+            path_prefix[paths] = no_prefixes + rank[inverse]
+
+            level_offset = np.empty(len(order), dtype=np.int64)
+            groups = []
+            offset = 0
+            _, group_firsts = np.unique(group_keys[order], return_index=True)
+            group_lasts = np.append(group_firsts[1:], len(order))
+            for group_first, group_last in zip(group_firsts, group_lasts):
+                prefix = order[group_first]
+                i, j, x, y = level_start[prefix], level_end[prefix], level_x[prefix], level_y[prefix]
+                size = len(self.get_state_indices(j + 1, y))
+                level_offset[group_first:group_last] = offset + size * np.arange(group_last - group_first)
+                groups.append((no_prefixes + group_first, no_prefixes + group_last, i, j, x, y, offset))
+                offset += size * (group_last - group_first)
+            self.prefix_levels.append((offset, groups))
+
+            parents.append(level_parent[order])
+            starts.append(level_start[order])
+            ends.append(level_end[order])
+            xs.append(level_x[order])
+            ys.append(level_y[order])
+            offsets.append(level_offset)
+            no_prefixes += len(order)
+
+        self.prefix_parent = np.concatenate(parents)
+        self.prefix_start = np.concatenate(starts)
+        self.prefix_end = np.concatenate(ends)
+        self.prefix_x = np.concatenate(xs)
+        self.prefix_y = np.concatenate(ys)
+        self.prefix_offset = np.concatenate(offsets)
+        self.path_prefix = path_prefix
+
+    def index_tree_topologies(self):
+        """Tabulate the topology of the marginal tree of each HMM state, for computing
+        the emission probabilities of all states at once.
+
+        A tree where both coalescences happen in the same interval is a star tree.
+        Otherwise two of the leaves form a cherry, coalescing in short_interval, and
+        the outer leaf joins them in long_interval.
+        """
+        first_type, self.short_interval = divmod(self.tree_keys // self.no_intervals, self.no_intervals)
+        self.long_interval = self.tree_keys % self.no_intervals
+        self.is_star = first_type == CODE_E
+        self.outer_leaf = OUTER_LEAF[first_type]
 
     def emission_points(self, *parameters):
         """Expected coalescence times between between tau1 and tau2"""
@@ -399,125 +636,78 @@ class ILSModel(Model):
         except ValueError:
             tau1, tau2, coal1, coal2, coal3, coal12, coal123, _, outgroup = parameters
 
-        breaks_12 = list(self.break_points_12) + [float(tau1 + tau2)] # turn back into regular python...
-        epoch_1_time_spans = [e-s for s, e in zip(breaks_12[0:-1], breaks_12[1:])]
-        epoch_1_emission_points = [(1/coal12)-dt/(-1+exp(dt*coal12)) for dt in epoch_1_time_spans]
-
-        epoch_2_time_spans = [e-s for s, e in zip(self.break_points_123[0:-1], self.break_points_123[1:])]
-        epoch_2_emission_points = [(1/coal123)-dt/(-1+exp(dt*coal123)) for dt in epoch_2_time_spans]
-        epoch_2_emission_points.append(self.break_points_123[-1] + 1/coal123)
-
-        return epoch_1_emission_points + epoch_2_emission_points, outgroup
-
-    def get_tree(self, path, column_representation, coalescence_time_points, outgroup, branch_shortening):
-
-        def get_alignment_col(n, symbols = "ACGT", length=3): # FIXME: Hard coded sequence of nucleotides
-            """Convert a number n that represent an alignment column to a list of indexes in
-            the symbols string. E.g. A, C, G, T -> 0, 1, 2, 3
-
-            E.g. the triplet ATG must be encoded like this:
-            nuc_map = {'A': 0, 'C': 1, 'G': 2, 'T': 3}
-            nuc_map['A'] + 4*nuc_map['T'], 16*nuc_map['G']
-            """
-            power = length - 1
-            base = len(symbols)
-            if power == 0:
-                return [n]
-            else:
-                return get_alignment_col(n%base**power, symbols=symbols, length=power) + [n//base**power]
-
-        # get bases of alignment column
-        if outgroup:
-            b1, b2, b3, b4 = get_alignment_col(column_representation, length=4)
-        else:
-            b1, b2, b3 = get_alignment_col(column_representation, length=3)
-
-        s1, s2, s3 = branch_shortening
-
-        # get topology and branch lengths
-        assert 1 <= len(path) <= 2, "tree with more than two coalescence events"
+        breaks_12 = np.append(self.break_points_12, tau1 + tau2)
+        epoch_1_emission_points = truncated_exp_midpoint(breaks_12[:-1], breaks_12[1:], coal12)
+        epoch_2_emission_points = truncated_exp_midpoint(self.break_points_123[:-1], self.break_points_123[1:],
+                                                         coal123)
+        last_emission_point = exp_midpoint(self.break_points_123[-1], coal123)
 
-        if len(path) == 1:
-            # two coalescence events in the same interval is represented as a star-shape topology
-            star = coalescence_time_points[path[0][1]]
-            tree =  {'len': [star-s1, star-s2, star-s3], 'chld' : [{'leaf': b1}, {'leaf': b2}, {'leaf': b3}]}
-            if outgroup:
-                tree = {'len': [star + outgroup, outgroup], 'chld': [tree, {'leaf': b4}]}
-        else:
-            tree = list(sorted(path[0][2], key=len)[0])[0]
-            short_external = coalescence_time_points[path[0][1]]
-            long_external = coalescence_time_points[path[1][1]]
-            internal = long_external - short_external
-            if tree == 2:
-                b1, b2, b3 = b1, b3, b2
-                s1, s2, s3 = s1, s3, s2
-            elif tree == 3:
-                b1, b2, b3 = b2, b3, b1
-                s1, s2, s3 = s2, s3, s1
-            tree = {'len': [internal, long_external-s3],
-                    'chld': [{'len': [short_external-s1, short_external-s2],
-                              'chld' : [{'leaf': b1},
-                                        {'leaf': b2}]},
-                             {'leaf': b3}]}
-            if outgroup:
-                tree = {'len': [long_external + outgroup, outgroup], 'chld': [tree, {'leaf': b4}]}
-
-        return tree
+        return np.concatenate((epoch_1_emission_points, epoch_2_emission_points, [last_emission_point])), outgroup
 
     def emission_matrix(self, *parameters):
-        """Compute emission matrix for zipHMM"""
+        """Compute emission matrix for zipHMM.
+
+        The likelihood of every alignment column is computed for all states at once by
+        pruning over arrays indexed by state, root base and leaf bases. Columns are
+        numbered b1 + 4*b2 + 16*b3 (+ 64*b4 for the outgroup) with an extra column
+        for missing data."""
 
         def subst_model(s):
-            """Jukes-Cantor-69 substitution model
+            """Jukes-Cantor-69 substitution model for an array of branch lengths
             s = substitutions = m*t (mutation rate times time)"""
-            x = 1/4.0 + 3/4.0 * exp(-4*s)
-            y = 1/4.0 - 1/4.0 * exp(-4*s)
-            a = x
-            b = y
-            matrixq = [[a,b,b,b],[b,a,b,b],[b,b,a,b],[b,b,b,a]]
-            return matrixq
-
-        def prob_tree(node, i, trans_mat):
-            """Computes the probability of a tree assuming base i at the root"""
-            if 'chld' in node:
-                p = None
-                for child, brlen in zip(node['chld'], node['len']):
-                    mat = trans_mat(brlen)
-                    x = sum(mat[i][j] * prob_tree(child, j, trans_mat) for j in range(4))
-                    p = p * x if p is not None else x
-                return p
-            else:
-                return 1 if node['leaf'] == i else 0
+            change = 1/4.0 - 1/4.0 * np.exp(-4 * np.asarray(s, dtype=np.float64))
+            matrices = np.empty(np.shape(s) + (4, 4))
+            matrices[...] = change[..., np.newaxis, np.newaxis]
+            diagonal = np.arange(4)
+            matrices[..., diagonal, diagonal] = 1.0 - 3 * change[..., np.newaxis]
+            return matrices
 
         coalescence_times, outgroup = self.emission_points(*parameters)
+        prior = np.array([0.25]*4)  # uniform prior assumed by Jukes-Cantor
+
+        branch_shortening = [0, 0, 0]  # FIXME: not sure how to pass in this information from the script...
+        s1, s2, s3 = branch_shortening
 
-        prior = [0.25]*4 # uniform prior assumed by Jukes-Cantor
+        short_external = coalescence_times[self.short_interval]
+        long_external = coalescence_times[self.long_interval]
+        no_states = len(short_external)
+
+        # conditional[n, r, b1, b2, b3] is the probability of the leaves given root base r in state n.
+        conditional = np.empty((no_states, 4, 4, 4, 4))
+
+        star = self.is_star
+        conditional[star] = np.einsum('nra,nrb,nrc->nrabc',
+                                      subst_model(long_external[star] - s1),
+                                      subst_model(long_external[star] - s2),
+                                      subst_model(long_external[star] - s3))
+
+        # For each choice of outer leaf, the cherry is the other two leaves.
+        leaf_names = 'abc'
+        for outer in (1, 2, 3):
+            states = ~star & (self.outer_leaf == outer)
+            if not states.any():
+                continue
+            first, second = [leaf for leaf in (1, 2, 3) if leaf != outer]
+            shortening = dict(zip((1, 2, 3), branch_shortening))
+            subscripts = 'nru,nu{0},nu{1},nr{2}->nrabc'.format(leaf_names[first - 1], leaf_names[second - 1],
+                                                             leaf_names[outer - 1])
+            conditional[states] = np.einsum(subscripts,
+                                            subst_model(long_external[states] - short_external[states]),
+                                            subst_model(short_external[states] - shortening[first]),
+                                            subst_model(short_external[states] - shortening[second]),
+                                            subst_model(long_external[states] - shortening[outer]))
 
         if outgroup:
-            no_alignment_columns = 4**4 + 1
+            likelihoods = np.einsum('R,nRr,nrabc,Rd->nabcd', prior,
+                                    subst_model(long_external + outgroup), conditional, subst_model(outgroup))
+            likelihoods = likelihoods.transpose(0, 4, 3, 2, 1).reshape(no_states, 4**4)
         else:
-            no_alignment_columns = 4**3 + 1
-
-        no_states = len(self.tree_map)
-        emission_probabilities = Matrix(no_states, no_alignment_columns, )
-
-        branch_shortening = [0, 0, 0] # FIXME: not sure how to pass in this information from the script...
-
-        for state in xrange(no_states):
-            path = self.reverse_tree_map[state]
-            likelihoods = list()
-            for align_column in range(no_alignment_columns):
-                if align_column == no_alignment_columns - 1:
-                    likelihoods.append(1)
-                else:
-                    tree = self.get_tree(path, align_column, coalescence_times, outgroup, branch_shortening)
-                    print tree
-                    likelihoods.append(sum(prior[i] * prob_tree(tree, i, subst_model) for i in range(4)))
-            print sum(likelihoods)
-            for align_column, emission_prob in enumerate(x/sum(likelihoods) for x in likelihoods):
-                emission_probabilities[state, align_column] = emission_prob
+            likelihoods = np.einsum('r,nrabc->nabc', prior, conditional)
+            likelihoods = likelihoods.transpose(0, 3, 2, 1).reshape(no_states, 4**3)
 
-        return emission_probabilities
+        # The last column is missing data, with a pseudo likelihood of 1.
+        likelihoods = np.hstack((likelihoods, np.ones((no_states, 1))))
+        return likelihoods / likelihoods.sum(axis=1)[:, np.newaxis]
 
     # We override this one from the Model class because we cannot directly reuse the 2-sample code.
     def build_hidden_markov_model(self, parameters):
@@ -530,6 +720,7 @@ class ILSModel(Model):
             ctmc_system = self.build_ctmc_system(*parameters)
 
         initial_probabilities, transition_probabilities = ctmc_system.compute_transition_probabilities()
+        self.previous_ctmc_system = ctmc_system
         emission_probabilities = self.emission_matrix(*parameters)
         return initial_probabilities, transition_probabilities, emission_probabilities
 
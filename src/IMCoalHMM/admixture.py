@@ -1,15 +1,14 @@
 
-from numpy import matrix, identity, zeros
+from numpy import matrix, identity, zeros, concatenate
 from itertools import chain, combinations
 
 from IMCoalHMM.model import Model
 from IMCoalHMM.state_spaces import CoalSystem
 from IMCoalHMM.state_spaces import Isolation, make_rates_table_isolation
 from IMCoalHMM.state_spaces import Single, make_rates_table_single
-from IMCoalHMM.transitions import CTMCSystem, projection_matrix, compute_upto, compute_between
+from IMCoalHMM.demography import Epoch, Demography, merge_populations, uniform_spacing, exponential_spacing
 from IMCoalHMM.CTMC import make_ctmc
 from IMCoalHMM.emissions import coalescence_points
-from IMCoalHMM.break_points import uniform_break_points, exp_break_points
 
 
 class Admixture(CoalSystem):
@@ -132,55 +131,6 @@ def admixture_state_space_map(from_space, to_space, p, q):
 
 
 
-# FIXME: add initial state as an option to have three configurations: 11, 12, and 22
-class AdmixtureCTMCSystem12(CTMCSystem):
-    """Wrapper around CTMC transition matrices for the isolation model."""
-
-    def __init__(self, isolation_ctmc, middle_ctmc, ancestral_ctmc,
-                 p, q, middle_break_points, ancestral_break_points):
-        """Construct all the matrices and cache them for the
-        method calls.
-        """
-
-        super(AdmixtureCTMCSystem12, self).__init__(no_hmm_states=len(middle_break_points) + len(ancestral_break_points),
-                                                    initial_ctmc_state=isolation_ctmc.state_space.i12_index)
-
-        self.no_middle_states = len(middle_break_points)
-        self.middle = middle_ctmc
-        self.no_ancestral_states = len(ancestral_break_points)
-        self.ancestral = ancestral_ctmc
-
-        self.through_ = [None] * (self.no_middle_states + self.no_ancestral_states - 1)
-
-        for i in xrange(self.no_middle_states - 1):
-            self.through_[i] = middle_ctmc.probability_matrix(middle_break_points[i+1] - middle_break_points[i])
-
-        xx = middle_ctmc.probability_matrix(ancestral_break_points[0] - middle_break_points[-1])
-        projection = projection_matrix(middle_ctmc.state_space, ancestral_ctmc.state_space,
-                                       lambda state: frozenset([(0, nucs) for (_, nucs) in state]))
-        self.through_[self.no_middle_states - 1] = xx * projection
-
-        for i in xrange(self.no_middle_states, self.no_middle_states + self.no_ancestral_states - 1):
-            ii = i - self.no_middle_states
-            self.through_[i] = ancestral_ctmc.probability_matrix(ancestral_break_points[ii+1] - ancestral_break_points[ii])
-
-        pseudo_through = matrix(zeros((len(ancestral_ctmc.state_space.states), len(ancestral_ctmc.state_space.states))))
-        pseudo_through[:, ancestral_ctmc.state_space.end_states[0]] = 1.0
-        self.through_.append(pseudo_through)
-
-        projection = admixture_state_space_map(isolation_ctmc.state_space, middle_ctmc.state_space, p, q)
-        self.upto_ = compute_upto(isolation_ctmc.probability_matrix(middle_break_points[0]) * projection, self.through_)
-
-        self.between_ = compute_between(self.through_)
-
-    def get_state_space(self, i):
-        """Return the state space for interval i."""
-        if i < self.no_middle_states:
-            return self.middle.state_space
-        else:
-            return self.ancestral.state_space
-
-
 ## Class that can construct HMMs ######################################
 class AdmixtureModel(Model):
     """Class wrapping the code that generates an isolation model HMM
@@ -210,21 +160,28 @@ class AdmixtureModel(Model):
         self.no_ancestral_states = no_ancestral_intervals
         self.no_states = no_isolation_intervals + no_middle_intervals + no_ancestral_intervals
 
-    def get_middle_break_points(self, tau_1, tau_2, coal_21, coal_22):
-        # FIXME: this should take into account the coalescence rate in each epoch and use a truncated exponential
-        #mean_coal = (coal_21 + coal_22) / 2.0
-        return uniform_break_points(self.no_middle_states, tau_1, tau_1 + tau_2)
-
-    def get_ancestral_break_points(self, tau_1, tau_2, coal_a):
-        return exp_break_points(self.no_ancestral_states, coal_a, tau_1 + tau_2)
+        # The admixture projection into the middle epoch depends on the proportions p and q,
+        # so it is given for each evaluation.
+        # FIXME: depends on initial configuration option to the model...
+        self.demography = Demography([Epoch(self.isolation_state_space, 0),
+                                      Epoch(self.middle_state_space, no_middle_intervals, merge_populations,
+                                            spacing=uniform_spacing),
+                                      Epoch(self.ancestral_state_space, no_ancestral_intervals,
+                                            spacing=exponential_spacing)],
+                                     initial_state=self.isolation_state_space.i12_index)
+
+    def get_break_points(self, tau_1, tau_2, coal_a):
+        # FIXME: the middle break points should take into account the coalescence rate in each epoch and use a
+        # truncated exponential
+        return self.demography.break_points([(tau_1, tau_1 + tau_2, None), (tau_1 + tau_2, None, coal_a)])
 
     def emission_points_12(self, *parameters):
         """Time points to emit from."""
         tau_1, tau_2, coal_11, coal_12, coal_21, coal_22, coal_a, _, _, _ = parameters
-        middle_points = coalescence_points(self.get_middle_break_points(tau_1, tau_2, coal_21, coal_22),
-                                           (coal_21+coal_22)/2.0)
-        ancestral_points = coalescence_points(self.get_ancestral_break_points(tau_1, tau_2, coal_a), coal_a)
-        return middle_points + ancestral_points
+        break_points = self.get_break_points(tau_1, tau_2, coal_a)
+        middle_points = coalescence_points(break_points[:self.no_middle_states], (coal_21+coal_22)/2.0)
+        ancestral_points = coalescence_points(break_points[self.no_middle_states:], coal_a)
+        return concatenate((middle_points, ancestral_points))
 
     def emission_points(self, *parameters):
         """Time points to emit from."""
@@ -245,13 +202,13 @@ class AdmixtureModel(Model):
         middle_ctmc = make_ctmc(self.middle_state_space, middle_rates)
         ancestral_ctmc = make_ctmc(self.ancestral_state_space, ancestral_rates)
 
-        middle_break_points = self.get_middle_break_points(tau_1, tau_2, coal_21, coal_22)
-        ancestral_break_points = self.get_ancestral_break_points(tau_1, tau_2, coal_a)
+        break_points = self.get_break_points(tau_1, tau_2, coal_a)
 
-        # FIXME: depends on initial configuration option to the model...
-        return AdmixtureCTMCSystem12(isolation_ctmc, middle_ctmc, ancestral_ctmc, p=p, q=q,
-                                     middle_break_points=middle_break_points,
-                                     ancestral_break_points=ancestral_break_points)
+        admixture_projection = admixture_state_space_map(self.isolation_state_space, self.middle_state_space, p, q)
+        return self.demography.ctmc_system([isolation_ctmc, middle_ctmc, ancestral_ctmc],
+                                           break_points,
+                                           projections={0: admixture_projection},
+                                           previous=self.previous_ctmc_system)
 
 
 
@@ -0,0 +1,357 @@
+"""Code for reading multiple alignments and encoding their columns as observations.
+
+FASTA and PHYLIP alignments are read a chunk of columns at a time, so memory use
+is bounded by the chunk size rather than the length of the alignment. Other
+formats are read through BioPython, which loads the whole alignment.
+
+Columns are encoded with lookup tables over the raw bytes of the sequences:
+
+ * pairwise: 0 if the two nucleotides are equal, 1 if they differ and 2 if either is missing.
+ * triplet: i1 + 4*i2 + 16*i3 with A, C, G, T as 0-3, and 64 if any is missing.
+ * quartet: i1 + 4*i2 + 16*i3 + 64*i4, and 256 if any is missing.
+"""
+
+import gzip
+import numpy as np
+
+from IMCoalHMM.dataset import DatasetWriter
+from IMCoalHMM.observations import DEFAULT_MIN_RUN_LENGTH
+
+# Number of columns encoded at a time.
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# Number of bytes read from an input file at a time.
+_BLOCK_SIZE = 1 << 20
+
+# Maps bytes to nucleotide codes 0-3 and everything else to -1.
+_NUCLEOTIDE_CODES = np.empty(256, dtype=np.int16)
+_NUCLEOTIDE_CODES.fill(-1)
+for _code, _nucleotides in enumerate(['Aa', 'Cc', 'Gg', 'Tt']):
+    for _nucleotide in _nucleotides:
+        _NUCLEOTIDE_CODES[ord(_nucleotide)] = _code
+
+# Bytes that are not part of a sequence.
+_IS_RESIDUE = np.ones(256, dtype=bool)
+for _whitespace in ' \t\r\n\v\f':
+    _IS_RESIDUE[ord(_whitespace)] = False
+
+# Symbols that are understood, either as nucleotides or as missing data.
+KNOWN_SYMBOLS = 'ACGTN-'
+
+# Size of the alphabet of the encoded columns for each number of sequences.
+NO_SYMBOLS = {2: 3, 3: 65, 4: 257}
+
+
+def encode_columns(sequences):
+    """Encode the columns of aligned sequences.
+
+    :param sequences: The sequences as arrays of bytes, all of the same length.
+    :type sequences: list[numpy.ndarray]
+
+    :returns: the observation of each column.
+    :rtype: numpy.ndarray
+    """
+    codes = [_NUCLEOTIDE_CODES[np.asarray(sequence, dtype=np.uint8)] for sequence in sequences]
+    missing = np.zeros(len(codes[0]), dtype=bool)
+    for code in codes:
+        missing |= code < 0
+
+    if len(codes) == 2:
+        obs = (codes[0] != codes[1]).astype(np.int32)
+        obs[missing] = 2
+        return obs
+
+    if len(codes) not in NO_SYMBOLS:
+        raise ValueError('Cannot encode alignments of {0} sequences.'.format(len(codes)))
+    obs = np.zeros(len(codes[0]), dtype=np.int32)
+    for position, code in enumerate(codes):
+        obs += code.astype(np.int32) << (2 * position)
+    obs[missing] = NO_SYMBOLS[len(codes)] - 1
+    return obs
+
+
+def unknown_symbols(symbol_counts):
+    """The symbols, from a table of byte counts, that are neither nucleotides nor missing data.
+
+    :param symbol_counts: Counts of each byte value, e.g. from numpy.bincount(sequence, minlength=256).
+    :type symbol_counts: numpy.ndarray
+    :rtype: str
+    """
+    return ''.join(sorted(set(chr(byte).upper() for byte in np.flatnonzero(symbol_counts))
+                          - set(KNOWN_SYMBOLS)))
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def _residues(block):
+    block = np.frombuffer(block, dtype=np.uint8)
+    return block[_IS_RESIDUE[block]]
+
+
+def _aligned_chunks(read, no_sequences, chunk_size):
+    """Cut sequences into chunks of the same length.
+
+    :param read: A function that, given a sequence number and a length, returns
+     the next residues of that sequence, as an array of bytes, or fewer at the end.
+    """
+    while True:
+        chunks = [read(sequence_no, chunk_size) for sequence_no in xrange(no_sequences)]
+        lengths = set(len(chunk) for chunk in chunks)
+        if len(lengths) > 1:
+            raise ValueError('The sequences in the alignment have different lengths.')
+        if lengths == {0}:
+            return
+        yield chunks
+
+
+class _FastaRecord(object):
+    """Reads the sequence of one FASTA record through its own file handle."""
+
+    def __init__(self, filename, offset):
+        self.handle = _open(filename)
+        self.handle.seek(offset)
+        self.buffer = np.zeros(0, dtype=np.uint8)
+        self.done = False
+
+    def read(self, length):
+        blocks = [self.buffer]
+        buffered = len(self.buffer)
+        while buffered < length and not self.done:
+            block = self.handle.read(_BLOCK_SIZE)
+            next_record = block.find('>')
+            if next_record >= 0:
+                block = block[:next_record]
+            if next_record >= 0 or not block:
+                self.done = True
+                self.handle.close()
+            block = _residues(block)
+            blocks.append(block)
+            buffered += len(block)
+        buffer = np.concatenate(blocks)
+        self.buffer = buffer[length:]
+        return buffer[:length]
+
+
+class FastaAlignment(object):
+    """An alignment in FASTA format.
+
+    The file is scanned once for the start of each record; the records used are
+    then read in parallel, each through its own file handle.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.offsets = {}
+        self.names = []
+        offset = 0
+        with _open(filename) as infile:
+            for line in infile:
+                offset += len(line)
+                if line.startswith('>'):
+                    name = line[1:].split()[0]
+                    self.names.append(name)
+                    self.offsets[name] = offset
+
+    def chunks(self, names, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over the sequences of the named records, chunk_size columns at a time.
+
+        :rtype: collections.Iterable[list[numpy.ndarray]]
+        """
+        records = [_FastaRecord(self.filename, self.offsets[name]) for name in names]
+        return _aligned_chunks(lambda sequence_no, length: records[sequence_no].read(length),
+                               len(records), chunk_size)
+
+
+class PhylipAlignment(object):
+    """An alignment in interleaved (or single line per sequence) PHYLIP format.
+
+    Names are the first ten characters of the lines of the first block or, for
+    relaxed PHYLIP, everything up to the first whitespace.
+    """
+
+    def __init__(self, filename, relaxed=False):
+        self.filename = filename
+        self.relaxed = relaxed
+        with _open(filename) as infile:
+            self.no_sequences = int(infile.readline().split()[0])
+            self.names = [name for name, _ in self._first_block(infile)]
+
+    def _first_block(self, infile):
+        block = []
+        while len(block) < self.no_sequences:
+            line = infile.readline()
+            if not line:
+                raise ValueError('The PHYLIP file ends before the names of all sequences.')
+            line = line.strip()
+            if not line:
+                continue
+            if self.relaxed:
+                name, sequence = (line.split(None, 1) + [''])[:2]
+            else:
+                name, sequence = line[:10].strip(), line[10:]
+            block.append((name, sequence))
+        return block
+
+    def chunks(self, names, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over the sequences of the named records, chunk_size columns at a time.
+
+        :rtype: collections.Iterable[list[numpy.ndarray]]
+        """
+        infile = _open(self.filename)
+        infile.readline()
+        indices = [self.names.index(name) for name in names]
+        buffers = [[_residues(sequence)] for _, sequence in self._first_block(infile)]
+        buffered = [len(buffer[0]) for buffer in buffers]
+        lines = self._lines(infile)
+
+        def read(sequence_no, length):
+            index = indices[sequence_no]
+            # Blocks hold a line per sequence, so reading ahead for one sequence
+            # reads ahead for the others as well.
+            while buffered[index] < length:
+                block = [next(lines, None) for _ in xrange(self.no_sequences)]
+                if block[0] is None:
+                    break
+                for i, line in enumerate(block):
+                    if line is None:
+                        raise ValueError('The last block of the PHYLIP file is incomplete.')
+                    buffers[i].append(_residues(line))
+                    buffered[i] += len(buffers[i][-1])
+            sequence = np.concatenate(buffers[index])
+            buffers[index] = [sequence[length:]]
+            buffered[index] = len(buffers[index][0])
+            return sequence[:length]
+
+        return _aligned_chunks(read, len(indices), chunk_size)
+
+    @staticmethod
+    def _lines(infile):
+        with infile:
+            for line in infile:
+                if line.strip():
+                    yield line
+
+
+class SeqIOAlignment(object):
+    """An alignment in any format BioPython can read. The whole alignment is kept in memory."""
+
+    def __init__(self, filename, in_format):
+        from Bio import SeqIO
+        with _open(filename) as infile:
+            self.sequences = dict((record.id, str(record.seq))
+                                  for record in SeqIO.parse(infile, in_format))
+        self.names = list(self.sequences.keys())
+
+    def chunks(self, names, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Iterate over the sequences of the named records, chunk_size columns at a time.
+
+        :rtype: collections.Iterable[list[numpy.ndarray]]
+        """
+        sequences = [np.frombuffer(self.sequences[name], dtype=np.uint8) for name in names]
+        return _aligned_chunks(lambda sequence_no, length: _take(sequences, sequence_no, length),
+                               len(sequences), chunk_size)
+
+
+def _take(sequences, sequence_no, length):
+    sequence = sequences[sequence_no]
+    sequences[sequence_no] = sequence[length:]
+    return sequence[:length]
+
+
+def open_alignment(filename, in_format):
+    """Open an alignment for reading in chunks.
+
+    :param filename: The alignment file, gzipped if the name ends with .gz.
+    :type filename: str
+    :param in_format: The format of the file, as a BioPython format name.
+    :type in_format: str
+
+    :rtype: FastaAlignment | PhylipAlignment | SeqIOAlignment
+    """
+    if in_format == 'fasta':
+        return FastaAlignment(filename)
+    if in_format in ('phylip', 'phylip-relaxed'):
+        return PhylipAlignment(filename, relaxed=in_format == 'phylip-relaxed')
+    return SeqIOAlignment(filename, in_format)
+
+
+def encode_alignment(alignment, names, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Encode the columns of an alignment a chunk at a time.
+
+    :param alignment: An alignment from open_alignment.
+    :param names: The names of the two, three or four sequences to use.
+    :type names: list[str]
+    :param chunk_size: The number of columns encoded at a time.
+    :type chunk_size: int
+
+    :returns: an iterator over the encoded chunks. Each chunk comes with the
+     running count of each byte value seen in the sequences so far.
+    :rtype: collections.Iterable[(numpy.ndarray, numpy.ndarray)]
+    """
+    symbol_counts = np.zeros(256, dtype=np.int64)
+    for sequences in alignment.chunks(names, chunk_size):
+        for sequence in sequences:
+            symbol_counts += np.bincount(sequence, minlength=256)
+        yield encode_columns(sequences), symbol_counts
+
+
+def write_alignment_dataset(alignment, names, filename, chromosome,
+                            chunk_size=DEFAULT_CHUNK_SIZE, segment_size=None,
+                            preprocess=False, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+    """Encode an alignment and write it to a dataset file.
+
+    :param alignment: An alignment from open_alignment.
+    :param names: The names of the two, three or four sequences to use.
+    :type names: list[str]
+    :param filename: The dataset file to write.
+    :type filename: str
+    :param chromosome: The chromosome name to record for the segments.
+    :type chromosome: str
+    :param chunk_size: The number of columns encoded at a time.
+    :type chunk_size: int
+    :param segment_size: If given, the alignment is cut into segments of this
+     many columns; otherwise it is written as one segment.
+    :type segment_size: int | None
+    :param preprocess: Whether to run the forwarder preprocessing and store the
+     result with each segment. This requires a segment in memory at a time.
+    :type preprocess: bool
+    :param min_run_length: The run-length encoding threshold used for preprocessing.
+    :type min_run_length: int | None
+
+    :returns: the count of each byte value in the sequences.
+    :rtype: numpy.ndarray
+    """
+    from IMCoalHMM.hmm import Forwarder, store_preprocessed
+
+    no_symbols = NO_SYMBOLS[len(names)]
+    symbol_counts = np.zeros(256, dtype=np.int64)
+    with DatasetWriter(filename, no_symbols, no_symbols - 1) as writer:
+        segment = []
+
+        def end_segment():
+            writer.end_segment()
+            if preprocess:
+                obs = np.concatenate(segment) if segment else np.zeros(0, dtype=np.int32)
+                store_preprocessed(writer, Forwarder.from_observations(obs, no_symbols, min_run_length))
+            del segment[:]
+
+        position = 0
+        writer.begin_segment(chromosome, position)
+        for obs, symbol_counts in encode_alignment(alignment, names, chunk_size):
+            while len(obs) > 0:
+                if segment_size is not None and writer.current['length'] == segment_size:
+                    end_segment()
+                    writer.begin_segment(chromosome, position)
+                take = len(obs) if segment_size is None else segment_size - writer.current['length']
+                piece, obs = obs[:take], obs[take:]
+                writer.extend_segment(piece)
+                if preprocess:
+                    segment.append(piece)
+                position += len(piece)
+        end_segment()
+
+    return symbol_counts
@@ -34,10 +34,11 @@ class Cache(object):
     def cleanup(self):
         items = self.table.items()
         reordered = [(access, key, value) for key, (value, access) in items]
-        reordered.sort(reverse=True)
+        reordered.sort(key=lambda entry: entry[0], reverse=True)
         last_accessed = reordered[:self.cleanup_size]
         self.last_access = 0
         self.table = {}
-        for access, key, value in last_accessed:
+        # Renumber the kept entries oldest first, so the most recently used keep the highest access counts.
+        for access, key, value in reversed(last_accessed):
             self.table[key] = (value, self.last_access)
             self.last_access += 1
\ No newline at end of file
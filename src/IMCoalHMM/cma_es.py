@@ -0,0 +1,237 @@
+"""
+Implementation of the Covariance Matrix Adaptation Evolution Strategy (CMA-ES).
+
+Each generation samples its candidates from a multivariate normal distribution and evaluates them together, so the
+evaluations can be spread over worker processes.  The mean of the distribution moves towards the fittest candidates,
+and the covariance matrix and step size adapt to the shape of the fitness landscape, which typically needs far fewer
+evaluations than the particle swarm or the genetic algorithm on smooth problems in tens of dimensions.
+"""
+
+import datetime
+import math
+
+import numpy
+
+from IMCoalHMM.parallel import EvaluationPool
+
+
+class Solution(object):
+    """
+    Encapsulation of a vector of positions and their corresponding fitness.
+    """
+
+    def __init__(self, positions=(), fitness=0.0):
+        """
+        Initialise a new instance of the class.
+        :param positions: The positions.
+        :param fitness: The fitness of the positions.
+        :return: A new instance of the class.
+        """
+        self.positions = tuple(positions)
+        self.fitness = fitness
+
+    def __str__(self):
+        """
+        Return a string representation of this instance.
+        :return: A string representation of this instance.
+        """
+        token = ' '.join(map(str, self.positions))
+        return 'fitness:{0} positions:[{1}]'.format(self.fitness, token)
+
+
+class ExitCondition(object):
+    """
+    A class providing descriptions for the reason the evolution strategy terminates.
+    """
+
+    ABORT = 'ABORT'
+    ITERATIONS = 'ITERATIONS'
+    TIMEOUT = 'TIMEOUT'
+
+
+class Context(object):
+    """
+    Context information for the CMA-ES optimiser; this instance is passed to the optional log method and eventually
+    returned as a result of the optimisation.
+    """
+
+    def __init__(self, optimiser):
+        """
+        Initialise a new instance of the class for the specified optimiser.
+        :param optimiser: The optimiser for this instance.
+        :return: A new instance of the class.
+        """
+        assert isinstance(optimiser, Optimiser)
+
+        self.aborted = False
+        self.best = Solution(fitness=float('-inf'))
+        self.candidates = []
+        self.elapsed = datetime.timedelta(seconds=0)
+        self.evaluations = 0
+        self.exit_condition = None
+        self.iteration = 0
+        self.mean = None
+        self.optimiser = optimiser
+        self.sigma = None
+        self.start = datetime.datetime.now()
+
+
+class Optimiser(object):
+    """
+    A CMA-ES optimiser searching the unit hypercube; candidates sampled outside it are reflected back inside.
+    """
+
+    def __init__(self):
+        """
+        Initialise a new instance of the class, setting the maximum number of iterations to 500, no maximum execution
+        time, the population size to the default of 4 + 3 ln(n) candidates for n dimensions, the initial mean to the
+        centre of the hypercube, the initial step size to 0.3, and evaluation in the optimiser's own process.
+        :return: A new instance of the class.
+        """
+        self.initial_mean = None
+        self.initial_sigma = 0.3
+        self.log = None
+        self.max_iterations = 500
+        self.population_size = None
+        self.processes = None
+        self.random_state = numpy.random
+        self.timeout = None
+
+    def maximise(self, fitness_function, parameter_count, batch_fitness_function=None):
+        """
+        Attempt to find a maximum set of values for a specified fitness function; the number of dimensions in the
+        problem domain is represented by the specified parameter count.
+
+        The candidates of each generation are evaluated together, in a pool of the configured number of worker
+        processes, forked when the optimisation starts, or by a batch fitness function if one is specified.
+        :param fitness_function: The fitness function to maximise.
+        :param parameter_count: the number of dimensions in the problem domain.
+        :param batch_fitness_function: An optional function returning the fitness of each of a list of positions.
+        :return: An instance of type Context that encapsulates the final state of the algorithm.
+        """
+        assert hasattr(fitness_function, '__call__')
+        assert parameter_count > 0
+        assert self.initial_sigma > 0.0
+
+        def fitness_function_wrapper(parameters):
+            fitness = fitness_function(parameters)
+            if math.isnan(fitness):
+                fitness = float('-inf')
+            return fitness
+
+        pool = None
+        if batch_fitness_function is not None:
+            def evaluate(positions):
+                return [float('-inf') if math.isnan(fitness) else fitness
+                        for fitness in batch_fitness_function(positions)]
+        else:
+            pool = EvaluationPool(fitness_function_wrapper, self.processes)
+            evaluate = pool.map
+
+        try:
+            return self.__maximise(Context(self), evaluate, parameter_count)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def __maximise(self, context, evaluate, n):
+        # The strategy parameters, following Hansen's tutorial on the CMA evolution strategy.
+        population_size = self.population_size
+        if population_size is None:
+            population_size = 4 + int(3 * math.log(n))
+        assert population_size >= 2
+        mu = population_size // 2
+        weights = math.log(mu + 0.5) - numpy.log(numpy.arange(1, mu + 1))
+        weights /= numpy.sum(weights)
+        mu_eff = 1.0 / numpy.sum(weights ** 2)
+
+        c_c = (4.0 + mu_eff / n) / (n + 4.0 + 2.0 * mu_eff / n)
+        c_s = (mu_eff + 2.0) / (n + mu_eff + 5.0)
+        c_1 = 2.0 / ((n + 1.3) ** 2 + mu_eff)
+        c_mu = min(1.0 - c_1, 2.0 * (mu_eff - 2.0 + 1.0 / mu_eff) / ((n + 2.0) ** 2 + mu_eff))
+        damping = 1.0 + 2.0 * max(0.0, math.sqrt((mu_eff - 1.0) / (n + 1.0)) - 1.0) + c_s
+        expected_norm = math.sqrt(n) * (1.0 - 1.0 / (4.0 * n) + 1.0 / (21.0 * n ** 2))
+
+        # The state of the search distribution.
+        mean = numpy.full(n, 0.5) if self.initial_mean is None else numpy.array(self.initial_mean, dtype=float)
+        assert mean.shape == (n,)
+        sigma = self.initial_sigma
+        covariance = numpy.eye(n)
+        axes = numpy.eye(n)
+        scales = numpy.ones(n)
+        path_c = numpy.zeros(n)
+        path_s = numpy.zeros(n)
+
+        while True:
+            # Sample the candidates, reflect them into the unit hypercube, and evaluate them together.
+            steps = self.random_state.standard_normal((population_size, n)).dot(numpy.diag(scales)).dot(axes.T)
+            positions = _reflect(mean + sigma * steps)
+            steps = (positions - mean) / sigma
+            fitness = numpy.array(evaluate([tuple(p) for p in positions.tolist()]), dtype=float)
+            context.evaluations += population_size
+
+            order = numpy.argsort(-fitness, kind='mergesort')
+            context.candidates = [Solution(positions[i].tolist(), float(fitness[i])) for i in order]
+            if fitness[order[0]] > context.best.fitness:
+                context.best = Solution(positions[order[0]].tolist(), float(fitness[order[0]]))
+
+            # Move the mean towards the fittest candidates.
+            selected = steps[order[:mu]]
+            step = weights.dot(selected)
+            mean = mean + sigma * step
+
+            # Update the evolution paths.
+            inverse_root = axes.dot(numpy.diag(1.0 / scales)).dot(axes.T)
+            path_s = (1.0 - c_s) * path_s + math.sqrt(c_s * (2.0 - c_s) * mu_eff) * inverse_root.dot(step)
+            norm_s = numpy.linalg.norm(path_s)
+            path_ratio = norm_s / math.sqrt(1.0 - (1.0 - c_s) ** (2 * (context.iteration + 1))) / expected_norm
+            h_s = 1.0 if path_ratio < 1.4 + 2.0 / (n + 1.0) else 0.0
+            path_c = (1.0 - c_c) * path_c + h_s * math.sqrt(c_c * (2.0 - c_c) * mu_eff) * step
+
+            # Adapt the covariance matrix and the step size.
+            covariance = ((1.0 - c_1 - c_mu) * covariance +
+                          c_1 * (numpy.outer(path_c, path_c) + (1.0 - h_s) * c_c * (2.0 - c_c) * covariance) +
+                          c_mu * selected.T.dot(weights[:, numpy.newaxis] * selected))
+            sigma *= math.exp((c_s / damping) * (norm_s / expected_norm - 1.0))
+
+            covariance = (covariance + covariance.T) / 2.0
+            eigenvalues, axes = numpy.linalg.eigh(covariance)
+            scales = numpy.sqrt(numpy.maximum(eigenvalues, 1e-20))
+
+            context.mean = tuple(mean.tolist())
+            context.sigma = sigma
+            if self.__iteration_done(context):
+                return context
+
+    def __iteration_done(self, context):
+        """
+        Log the finished iteration and check for exit conditions.
+        :return: True if the optimisation should stop, with the exit condition set in the context.
+        """
+        # Log the iteration before it's lost forever.
+        context.elapsed = datetime.datetime.now() - context.start
+        context.iteration += 1
+        self.__log(context)
+
+        # Check for exit conditions.
+        if context.aborted:
+            context.exit_condition = ExitCondition.ABORT
+        elif self.max_iterations is not None and context.iteration >= self.max_iterations:
+            context.exit_condition = ExitCondition.ITERATIONS
+        elif self.timeout is not None and context.elapsed > self.timeout:
+            context.exit_condition = ExitCondition.TIMEOUT
+        return context.exit_condition is not None
+
+    def __log(self, context):
+        if self.log is not None:
+            self.log(context)
+
+
+def _reflect(positions):
+    """
+    Reflect positions at the boundaries of the unit hypercube until they are inside it.
+    :param positions: An array of positions.
+    :return: The reflected positions.
+    """
+    periodic = numpy.mod(positions, 2.0)
+    return numpy.where(periodic > 1.0, 2.0 - periodic, periodic)
@@ -0,0 +1,200 @@
+"""A single-file container for the observation sequences of many segments.
+
+The file starts with an eight byte magic string and the offset of the index,
+followed by the symbols of all segments as one concatenated binary array and
+finally a JSON index with the offset, length and metadata of each segment.
+Segments are read through a memory map, so opening a dataset only reads the
+index and each process only touches the segments it actually uses.
+"""
+
+import json
+import os
+import struct
+import numpy as np
+
+from IMCoalHMM.observations import MISSING_SYMBOL
+
+MAGIC = 'IMCHMMD1'
+_HEADER = struct.Struct('<8sQ')
+
+# Arrays added with DatasetWriter.add_array start at multiples of this many bytes.
+_ALIGNMENT = 8
+
+
+def _symbol_dtype(no_symbols):
+    if no_symbols <= 2 ** 8:
+        return np.dtype(np.uint8)
+    if no_symbols <= 2 ** 16:
+        return np.dtype(np.uint16)
+    return np.dtype(np.int32)
+
+
+def is_dataset(path):
+    """Check if path is a dataset file."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as infile:
+        return infile.read(len(MAGIC)) == MAGIC
+
+
+class DatasetWriter(object):
+    """Writes segments to a dataset file one at a time.
+
+    Use it as a context manager or call close() when all segments are added;
+    the index is only written then.
+    """
+
+    def __init__(self, filename, no_symbols, missing_symbol=MISSING_SYMBOL):
+        """
+        :param filename: The dataset file to write.
+        :type filename: str
+        :param no_symbols: The size of the alphabet of the segments.
+        :type no_symbols: int
+        :param missing_symbol: The symbol used for missing data, for computing
+         the missing fraction of each segment.
+        :type missing_symbol: int | None
+        """
+        self.no_symbols = no_symbols
+        self.missing_symbol = missing_symbol
+        self.dtype = _symbol_dtype(no_symbols)
+        self.segments = []
+        self.current = None
+        self.outfile = open(filename, 'wb')
+        self.outfile.write(_HEADER.pack(MAGIC, 0))
+        self.offset = 0
+
+    def add_segment(self, chromosome, start, obs, **metadata):
+        """Append a segment.
+
+        :param chromosome: The chromosome the segment is from.
+        :type chromosome: str
+        :param start: The position of the segment on the chromosome.
+        :type start: int
+        :param obs: The observation sequence of the segment.
+        :type obs: numpy.ndarray
+        :param metadata: Any other metadata to keep in the index.
+        """
+        self.begin_segment(chromosome, start, **metadata)
+        self.extend_segment(obs)
+        self.end_segment()
+
+    def begin_segment(self, chromosome, start, **metadata):
+        """Start a segment whose observations are added in pieces with extend_segment."""
+        if self.current is not None:
+            raise ValueError('The previous segment was not ended.')
+        self.current = dict(metadata)
+        self.current.update(chromosome=chromosome, start=int(start), length=0, offset=self.offset)
+        self.current_missing = 0
+
+    def extend_segment(self, obs):
+        """Append observations to the current segment."""
+        obs = np.asarray(obs)
+        if len(obs) == 0:
+            return
+        if obs.min() < 0 or obs.max() >= self.no_symbols:
+            raise ValueError('Segment contains symbols outside the alphabet.')
+        if self.missing_symbol is not None:
+            self.current_missing += np.count_nonzero(obs == self.missing_symbol)
+        self.outfile.write(obs.astype(self.dtype).tostring())
+        self.current['length'] += len(obs)
+        self.offset += len(obs) * self.dtype.itemsize
+
+    def end_segment(self):
+        """End the current segment."""
+        length = self.current['length']
+        self.current['missing'] = float(self.current_missing) / length if length else 0.0
+        self.segments.append(self.current)
+        self.current = None
+
+    def add_array(self, array):
+        """Store an array outside any segment, e.g. for data derived from a segment.
+
+        :returns: a reference to the array, for the index, that Dataset.array can read it back from.
+        :rtype: dict
+        """
+        if self.current is not None:
+            raise ValueError('Arrays cannot be added inside a segment.')
+        array = np.ascontiguousarray(array)
+        padding = -self.offset % _ALIGNMENT
+        self.outfile.write('\0' * padding)
+        self.offset += padding
+        self.outfile.write(array.tostring())
+        reference = {'offset': self.offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        self.offset += array.nbytes
+        return reference
+
+    def close(self):
+        """Write the index and close the file."""
+        if self.outfile is None:
+            return
+        if self.current is not None:
+            self.end_segment()
+        index_offset = _HEADER.size + self.offset
+        json.dump({'no_symbols': self.no_symbols,
+                   'dtype': self.dtype.name,
+                   'segments': self.segments}, self.outfile)
+        self.outfile.seek(0)
+        self.outfile.write(_HEADER.pack(MAGIC, index_offset))
+        self.outfile.close()
+        self.outfile = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_dataset(filename, segments, no_symbols, missing_symbol=MISSING_SYMBOL):
+    """Write segments, given as (chromosome, start, observations) triples, to a dataset file."""
+    with DatasetWriter(filename, no_symbols, missing_symbol) as writer:
+        for chromosome, start, obs in segments:
+            writer.add_segment(chromosome, start, obs)
+
+
+class Dataset(object):
+    """A dataset file opened for reading.
+
+    Only the index is read when the dataset is opened. The symbols of a
+    segment are mapped into memory when they are asked for.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as infile:
+            magic, index_offset = _HEADER.unpack(infile.read(_HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('{0} is not a dataset file.'.format(filename))
+            infile.seek(index_offset)
+            index = json.load(infile)
+        self.no_symbols = index['no_symbols']
+        self.dtype = np.dtype(str(index['dtype']))
+        self.segments = index['segments']
+        self._data = None
+
+    def __len__(self):
+        return len(self.segments)
+
+    def observations(self, segment_no):
+        """The observation sequence of a segment as a read-only array.
+
+        :rtype: numpy.ndarray
+        """
+        segment = self.segments[segment_no]
+        return self._view(segment['offset'], self.dtype, (segment['length'],))
+
+    def array(self, reference):
+        """Read back an array stored with DatasetWriter.add_array.
+
+        :rtype: numpy.ndarray
+        """
+        return self._view(reference['offset'], np.dtype(str(reference['dtype'])), tuple(reference['shape']))
+
+    def _view(self, offset, dtype, shape):
+        size = int(np.prod(shape)) * dtype.itemsize
+        if size == 0:
+            return np.zeros(shape, dtype=dtype)
+        if self._data is None:
+            self._data = np.memmap(self.filename, dtype=np.uint8, mode='r')
+        start = _HEADER.size + offset
+        return self._data[start:start + size].view(dtype).reshape(shape)
@@ -0,0 +1,230 @@
+"""Declarative descriptions of demographies, compiled into CTMC systems.
+
+A demography is a sequence of epochs going back in time. Each epoch has a
+state space, a number of HMM intervals, a map that moves the lineages into
+the state space of the next epoch and a scheme spacing the break points of its
+intervals. The first epoch can be without intervals; it is then a period,
+usually of isolation, where the samples cannot coalesce, running from time zero
+up to the first break point.
+
+Compiling a demography does all the work that does not depend on the rates
+once: the projection matrices between epochs, the state space of each interval
+and the pseudo through matrix of the last interval. A model compiles its
+demography when it is constructed and then only has to build the CTMCs and give
+the time spans the break points are spaced over for each evaluation, and the
+probability matrices of each CTMC are computed together in one batch.
+"""
+
+import numpy
+from numpy import zeros, identity, matrix
+
+from IMCoalHMM.break_points import exp_break_points, psmc_break_points, uniform_break_points
+from IMCoalHMM.CTMC import probability_matrices
+from IMCoalHMM.transitions import CTMCSystem, projection_matrix
+
+
+def same_states(state):
+    """State map between two state spaces over the same states."""
+    return state
+
+
+def merge_populations(state):
+    """State map for moving all lineages into a single ancestral population."""
+    return frozenset([(0, nucs) for (_, nucs) in state])
+
+
+def uniform_spacing(no_intervals, start, end, coal_rate):
+    """Break-point scheme with the intervals of equal length from start to end."""
+    return uniform_break_points(no_intervals, start, end)
+
+
+def exponential_spacing(no_intervals, start, end, coal_rate):
+    """Break-point scheme with equally probable intervals for the coalescence time
+    after start, which is exponential with the coalescence rate."""
+    return exp_break_points(no_intervals, coal_rate, start)
+
+
+def psmc_spacing(no_intervals, start, end, coal_rate):
+    """Break-point scheme of Li & Durbin (2011), starting at start."""
+    return psmc_break_points(no_intervals, offset=start)
+
+
+class Epoch(object):
+    """An epoch of a demography."""
+
+    def __init__(self, state_space, no_intervals, state_map=None, spacing=None):
+        """
+        :param state_space: The state space of the CTMC in the epoch.
+        :type state_space: IMCoalHMM.CoalSystem
+        :param no_intervals: The number of HMM intervals in the epoch.
+        :type no_intervals: int
+        :param state_map: A function mapping the states of this epoch to those of the
+         next. If it is None and the next epoch has the same state space the lineages
+         stay where they are; if the state spaces differ the projection must be given
+         when the CTMC system is built, e.g. because it depends on the parameters.
+        :param spacing: The break-point scheme of the epoch, a function of the number of
+         intervals, the start and end of the time span they divide and a coalescence rate,
+         such as exponential_spacing. If it is None the epoch continues the scheme of the
+         epoch before, which then spaces the intervals of both over one time span.
+        """
+        self.state_space = state_space
+        self.no_intervals = no_intervals
+        self.state_map = state_map
+        self.spacing = spacing
+
+
+class Demography(object):
+    """A sequence of epochs compiled for building CTMC systems."""
+
+    def __init__(self, epochs, initial_state):
+        """
+        :param epochs: The epochs, going back in time.
+        :type epochs: list[Epoch]
+        :param initial_state: The index of the initial state in the first epoch's state space.
+        :type initial_state: int
+        """
+        if not epochs or epochs[-1].no_intervals <= 0:
+            raise ValueError('The last epoch must have intervals.')
+        if any(epoch.no_intervals <= 0 for epoch in epochs[1:]):
+            raise ValueError('Only the first epoch can be without intervals.')
+
+        self.epochs = epochs
+        self.initial_state = initial_state
+        self.has_initial_epoch = epochs[0].no_intervals == 0
+
+        # The epoch of each interval and the intervals where epochs end.
+        self.interval_epochs = numpy.repeat(numpy.arange(len(epochs)),
+                                            [epoch.no_intervals for epoch in epochs])
+        self.no_states = len(self.interval_epochs)
+        epoch_ends = numpy.cumsum([epoch.no_intervals for epoch in epochs]) - 1
+
+        # The break-point schemes and the number of intervals each of them spaces.
+        self.spacings = []
+        for epoch in epochs:
+            if epoch.no_intervals == 0:
+                continue
+            if epoch.spacing is not None:
+                self.spacings.append([epoch.spacing, epoch.no_intervals])
+            elif self.spacings:
+                self.spacings[-1][1] += epoch.no_intervals
+        if self.spacings and sum(no_intervals for _, no_intervals in self.spacings) != self.no_states:
+            raise ValueError('The first epoch with intervals must have a break-point scheme.')
+
+        self.projections = [None] * (len(epochs) - 1)
+        self.parametric_projections = []
+        for k, (epoch, next_epoch) in enumerate(zip(epochs[:-1], epochs[1:])):
+            if epoch.state_map is not None:
+                self.projections[k] = projection_matrix(epoch.state_space, next_epoch.state_space, epoch.state_map)
+            elif epoch.state_space is not next_epoch.state_space:
+                self.parametric_projections.append(k)
+
+        # Projections into the next epoch are multiplied onto the through matrix of the
+        # epoch's last interval, except the one out of the initial epoch that goes on the
+        # up-to matrix of the first interval.
+        self.boundaries = [(int(epoch_ends[k]), k) for k in xrange(len(epochs) - 1)
+                           if not (k == 0 and self.has_initial_epoch) and
+                           (self.projections[k] is not None or k in self.parametric_projections)]
+
+        # The state space past the last interval is needed for the pseudo through matrix.
+        self.state_spaces = [epochs[k].state_space for k in self.interval_epochs] + [epochs[-1].state_space]
+
+        # As a hack we set up a pseudo through matrix for the last interval that
+        # just puts all probability on ending in one of the end states. This
+        # simplifies the HMM transition probability code as it avoids a special case
+        # for the last interval.
+        last_state_space = epochs[-1].state_space
+        # noinspection PyCallingNonCallable
+        self.pseudo_through = matrix(zeros((len(last_state_space.states), len(last_state_space.states))))
+        self.pseudo_through[:, last_state_space.end_states[0]] = 1.0
+
+        # noinspection PyCallingNonCallable
+        self.identity = matrix(identity(len(epochs[0].state_space.states)))
+
+    def break_points(self, spans):
+        """Compute the break points of all intervals from their break-point schemes.
+
+        :param spans: For each break-point scheme, in the order of the epochs, the start and
+         end of the time span it divides and the coalescence rate it spaces by, as a tuple.
+         The end and the rate are only needed by the schemes that use them, and can be None.
+        :type spans: list[(float, float | None, float | None)]
+
+        :returns: the break point starting each interval.
+        :rtype: list[float]
+        """
+        no_spacings = len(self.spacings)
+        if len(spans) != no_spacings:
+            raise ValueError('Expected a time span for each of the {0} break-point schemes.'.format(no_spacings))
+        break_points = []
+        for (spacing, no_intervals), (start, end, coal_rate) in zip(self.spacings, spans):
+            break_points.extend(spacing(no_intervals, start, end, coal_rate))
+        return break_points
+
+    def ctmc_system(self, ctmcs, break_points, projections=None, previous=None):
+        """Build the CTMC system for an evaluation of the model.
+
+        :param ctmcs: The CTMC for each epoch.
+        :type ctmcs: list[IMCoalHMM.CTMC.CTMC]
+        :param break_points: The break point starting each interval.
+        :type break_points: list[float]
+        :param projections: The projection matrices that depend on the parameters,
+         by the index of the epoch they move out of.
+        :type projections: dict[int, matrix] | None
+        :param previous: The CTMC system from the previous evaluation of the model,
+         for reusing the matrices that are unchanged.
+        :type previous: IMCoalHMM.transitions.CTMCSystem | None
+
+        :rtype: DemographyCTMCSystem
+        """
+        return DemographyCTMCSystem(self, ctmcs, break_points, projections, previous)
+
+
+class DemographyCTMCSystem(CTMCSystem):
+    """CTMC system built from a compiled demography."""
+
+    def __init__(self, demography, ctmcs, break_points, projections=None, previous=None):
+        """Construct all the matrices and cache them for the method calls.
+
+        See Demography.ctmc_system for the parameters.
+        """
+        super(DemographyCTMCSystem, self).__init__(no_hmm_states=demography.no_states,
+                                                   initial_ctmc_state=demography.initial_state)
+        self.demography = demography
+
+        if len(ctmcs) != len(demography.epochs):
+            raise ValueError('Expected a CTMC for each of the {0} epochs.'.format(len(demography.epochs)))
+        if len(break_points) != demography.no_states:
+            raise ValueError('Expected a break point for each of the {0} intervals.'.format(demography.no_states))
+
+        epoch_projections = list(demography.projections)
+        for k in demography.parametric_projections:
+            if projections is None or k not in projections:
+                raise ValueError('The projection out of epoch {0} must be given.'.format(k))
+            epoch_projections[k] = projections[k]
+
+        # Construct the transition matrices for going through each interval, and from
+        # time zero to the first break point, with all the time steps of each CTMC
+        # computed together. Epochs with the same rates share their CTMC.
+        interval_ctmcs = [ctmcs[k] for k in demography.interval_epochs[:-1]]
+        deltas = list(numpy.diff(break_points))
+        if demography.has_initial_epoch:
+            interval_ctmcs.insert(0, ctmcs[0])
+            deltas.insert(0, break_points[0])
+        matrices = probability_matrices(interval_ctmcs, deltas)
+
+        if demography.has_initial_epoch:
+            upto0 = matrices.pop(0)
+            if epoch_projections[0] is not None:
+                upto0 = upto0 * epoch_projections[0]
+        else:
+            upto0 = demography.identity
+
+        for i, k in demography.boundaries:
+            matrices[i] = matrices[i] * epoch_projections[k]
+        matrices.append(demography.pseudo_through)
+
+        self.through_ = matrices
+        self.compute_products(upto0, previous)
+
+    def get_state_space(self, i):
+        """Return the state space for interval i."""
+        return self.demography.state_spaces[i]
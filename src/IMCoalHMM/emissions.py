@@ -5,24 +5,41 @@ and a Jukes-Cantor for emission probabilities, with a pseudo emission
 probability of 1 for missing data.
 """
 
-from math import exp
 import numpy as np
 
+# Below this value of rate * interval width, the mean of the truncated exponential
+# is computed from a series expansion, since 1 - exp(-x) loses all precision.
+_SERIES_THRESHOLD = 1e-4
+
+
+def _truncated_exp_fraction(x):
+    """Computes 1/x - 1/(exp(x) - 1), the mean of an exponential with rate x truncated
+    to [0, 1], using the series 1/2 - x/12 + x**3/720 for small x."""
+    x = np.asarray(x, dtype=np.float64)
+    small = np.abs(x) < _SERIES_THRESHOLD
+    safe_x = np.where(small, 1.0, x)
+    with np.errstate(over='ignore'):
+        fraction = 1.0 / safe_x - 1.0 / np.expm1(safe_x)
+    return np.where(small, 0.5 - x / 12.0 + x ** 3 / 720.0, fraction)
+
+
 def truncated_exp_midpoint(t1, t2, rate):
     """Calculates the mean coalescence point between t1 and t2
     from a truncated exponential distribution.
 
+    All arguments can be arrays, in which case a mean is computed for each interval.
+
     :param t1: Beginning of the interval.
-    :type t1: float
+    :type t1: float | numpy.ndarray
     :param t2: End of the interval.
-    :type t2: float
+    :type t2: float | numpy.ndarray
     :param rate: Coalescence rate within the interval. Used for computing the mean.
-    :type rate: float
+    :type rate: float | numpy.ndarray
 
-    :returns: a list of time points from which to emit the alignment.
+    :returns: the mean coalescence point in each interval.
     """
-    delta_t = t2 - t1
-    return t1 + 1.0 / rate - (delta_t * exp(-delta_t * rate)) / (1 - exp(-delta_t * rate))
+    delta_t = np.asarray(t2, dtype=np.float64) - t1
+    return t1 + delta_t * _truncated_exp_fraction(delta_t * rate)
 
 
 def exp_midpoint(t, rate):
@@ -46,23 +63,23 @@ def coalescence_points(break_points, rates):
     each time break point and after the last break point.
 
     :param break_points: Break points between the HMM states.
-    :type break_points: list[float]
+    :type break_points: list[float] | numpy.ndarray
     :param rates: A coalescence rate or a list of rates for each interval.
-    :type rates: float | list[float]
+    :type rates: float | list[float] | numpy.ndarray
 
-    :rtype: list[float]
+    :rtype: numpy.ndarray
     """
+    break_points = np.asarray(break_points, dtype=np.float64)
     if hasattr(rates, '__iter__'):
         assert len(rates) == len(break_points), \
             "You must have the same number of rates as break points."
+        rates = np.asarray(rates, dtype=np.float64)
     else:
-        rates = [rates] * len(break_points)
+        rates = np.repeat(np.float64(rates), len(break_points))
 
-    result = []
-    for i in xrange(1, len(break_points)):
-        t = truncated_exp_midpoint(break_points[i - 1], break_points[i], rates[i-1])
-        result.append(t)
-    result.append(exp_midpoint(break_points[-1], rates[-1]))
+    result = np.empty(len(break_points))
+    result[:-1] = truncated_exp_midpoint(break_points[:-1], break_points[1:], rates[:-1])
+    result[-1] = exp_midpoint(break_points[-1], rates[-1])
     return result
 
 
@@ -77,13 +94,15 @@ def jukes_cantor(a, b, dt):
     :type b: object
 
     :param dt: the time distance between the two leaves in the tree.
-    :type dt: float
+    :type dt: float | numpy.ndarray
 
     :returns: the probability of changing from a to b in time dt."""
+    # 0.75 - 0.75 * exp(-4/3 dt), computed without cancellation for small dt.
+    change = -0.75 * np.expm1(-4.0 / 3 * np.asarray(dt, dtype=np.float64))
     if a == b:
-        return 0.25 + 0.75 * exp(-4.0 / 3 * dt)
+        return 1.0 - change
     else:
-        return 0.75 - 0.75 * exp(-4.0 / 3 * dt)
+        return change
 
 
 def emission_matrix(coal_points):
@@ -91,12 +110,13 @@ def emission_matrix(coal_points):
     rate.
 
     :param coal_points: List coalescence points to emit from.
+    :type coal_points: list[float] | numpy.ndarray
     """
-    emission_probabilities = np.zeros((len(coal_points), 3))
-    for state in xrange(len(coal_points)):
-        emission_probabilities[state, 0] = jukes_cantor(0, 0, 2 * coal_points[state])
-        emission_probabilities[state, 1] = jukes_cantor(0, 1, 2 * coal_points[state])
-        emission_probabilities[state, 2] = 1.0  # Dummy for missing data
+    change = jukes_cantor(0, 1, 2 * np.asarray(coal_points, dtype=np.float64))
+    emission_probabilities = np.empty((len(change), 3))
+    emission_probabilities[:, 0] = 1.0 - change
+    emission_probabilities[:, 1] = change
+    emission_probabilities[:, 2] = 1.0  # Dummy for missing data
     return emission_probabilities
 
 
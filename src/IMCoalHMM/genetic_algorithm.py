@@ -7,10 +7,14 @@ import datetime
 import math
 import random
 
+import numpy
+
+from IMCoalHMM.parallel import EvaluationPool
+
 
 class Individual(object):
     """
-    An individual in a population processed by the Genetic Algorithm.
+    An individual in a population processed by the Genetic Algorithm; a view of its row in the arrays of a population.
     """
 
     def __init__(self, genome, fitness):
@@ -29,8 +33,21 @@ class Individual(object):
         assert fitness is not None
         assert type(fitness) in (int, float)
 
-        self.__genome = tuple(genome)
-        self.__fitness = float('-inf') if math.isnan(fitness) else fitness
+        self.__population = Population([genome], [fitness])
+        self.__index = 0
+
+    @classmethod
+    def view(cls, population, index):
+        """
+        Return an individual whose genome and fitness are a row of the arrays of a population.
+        :param population: The population.
+        :param index: The index of the individual in the population.
+        :return: An individual viewing the population.
+        """
+        individual = cls.__new__(cls)
+        individual.__population = population
+        individual.__index = index
+        return individual
 
     def __str__(self):
         """
@@ -55,7 +72,7 @@ class Individual(object):
         Return the fitness associated with this instance.
         :return: The fitness associated with this instance.
         """
-        return self.__fitness
+        return float(self.__population.fitness[self.__index])
 
     @property
     def genome(self):
@@ -63,7 +80,52 @@ class Individual(object):
         Return the tuple of values associated with this instance.
         :return: A tuple of values associated with this instance.
         """
-        return self.__genome
+        return tuple(self.__population.genomes[self.__index].tolist())
+
+
+class Population(object):
+    """
+    A population processed by the Genetic Algorithm, stored as a two-dimensional array of genomes with a row for each
+    individual and an array of their fitness, so the operators can process the entire population together.  Indexing
+    and iterating a population gives instances of type Individual viewing its rows.
+    """
+
+    def __init__(self, genomes, fitness):
+        """
+        Initialise a new population.
+        :param genomes: The sequence of genomes of the individuals.
+        :param fitness: The sequence of the fitness of the individuals, where NaN indicates a very bad fitness.
+        :return: An initialised population.
+        """
+        self.genomes = numpy.array(genomes)
+        self.fitness = numpy.array(fitness, dtype=float)
+        assert self.genomes.ndim == 2 and self.genomes.shape[1] >= 1
+        assert self.fitness.shape == (len(self.genomes),)
+        self.fitness[numpy.isnan(self.fitness)] = float('-inf')
+
+    def __len__(self):
+        """
+        Return the number of individuals in this instance.
+        :return: The number of individuals in this instance.
+        """
+        return len(self.fitness)
+
+    def __getitem__(self, index):
+        """
+        Return the individual at the specified index.
+        :param index: The index of the individual.
+        :return: The individual viewing its row of this instance.
+        """
+        if not -len(self) <= index < len(self):
+            raise IndexError('population index out of range')
+        return Individual.view(self, index % len(self))
+
+    def __iter__(self):
+        """
+        Iterate over the individuals of this instance.
+        :return: An iterator over the individuals viewing the rows of this instance.
+        """
+        return (Individual.view(self, index) for index in xrange(len(self)))
 
 
 #######################################################################################################################
@@ -78,15 +140,26 @@ class Initialisation(object):
 
     __metaclass__ = abc.ABCMeta
 
-    @abc.abstractmethod
-    def initialise(self, population_size, genome_length, fitness_function):
+    def initialise(self, population_size, genome_length, evaluate):
         """
-        Initialise and return a population for a Genetic Algorithm.
+        Initialise and return a population for a Genetic Algorithm; the genomes of the entire population are created
+        first and then evaluated together.
         :param population_size: The size of the population.
         :param genome_length: The length of the genome for each individual in the population.
-        :param fitness_function: The fitness function.
+        :param evaluate: A function returning the fitness of each genome in a list of genomes.
         :return: A list of individuals in the initial population of the Genetic Algorithm.
         """
+        genomes = self.create_genomes(population_size, genome_length)
+        return list(Population(genomes, evaluate(genomes)))
+
+    @abc.abstractmethod
+    def create_genomes(self, population_size, genome_length):
+        """
+        Create the genomes of the initial population for a Genetic Algorithm.
+        :param population_size: The size of the population.
+        :param genome_length: The length of the genome for each individual in the population.
+        :return: A list of genomes for the initial population.
+        """
         pass
 
 
@@ -103,29 +176,21 @@ class FixedInitialisation(Initialisation):
         super(FixedInitialisation, self).__init__()
         self.initial_value = 0.5
 
-    def initialise(self, population_size, genome_length, fitness_function):
+    def create_genomes(self, population_size, genome_length):
         """
-        Initialise and return a population for a Genetic Algorithm based on a Fixed Initialization.  Initialise each
-        data point of each genome of each individual to initial_value; call the fitness function only once for the
-        entire initial population because all individuals are the same.
+        Create the genomes of the initial population for a Genetic Algorithm based on a Fixed Initialization.
+        Initialise each data point of each genome of each individual to initial_value; the fitness is evaluated only
+        once for the entire initial population because all genomes are the same.
         :param population_size: The size of the population.
         :param genome_length: The length of the genome for each individual in the population.
-        :param fitness_function: The fitness function, evaluated once for the entire population.
-        :return: A list of individuals in the initial population of the Genetic Algorithm.
+        :return: A list of genomes for the initial population.
         """
         assert 0.0 <= self.initial_value <= 1.0
         assert population_size > 0
         assert genome_length > 0
 
         genome = [self.initial_value] * genome_length
-        fitness = fitness_function(genome)
-
-        population = []
-        while len(population) < population_size:
-            individual = Individual(genome, fitness)
-            population.append(individual)
-
-        return population
+        return [genome] * population_size
 
 
 class GaussianInitialisation(Initialisation):
@@ -143,15 +208,13 @@ class GaussianInitialisation(Initialisation):
         self.mu = 0.5
         self.sigma = 0.15
 
-    def initialise(self, population_size, genome_length, fitness_function):
+    def create_genomes(self, population_size, genome_length):
         """
-        Initialise and return a population for a Genetic Algorithm based on a Gaussian Initialization.  Initialise each
-        data point of each genome of each individual to a random Gaussian value; call the fitness function once for
-        every member of the initial population.
+        Create the genomes of the initial population for a Genetic Algorithm based on a Gaussian Initialization.
+        Initialise each data point of each genome of each individual to a random Gaussian value.
         :param population_size: The size of the population.
         :param genome_length: The length of the genome for each individual in the population.
-        :param fitness_function: The fitness function, evaluated once for every member of the initial population.
-        :return: A list of individuals in the initial population of the Genetic Algorithm.
+        :return: A list of genomes for the initial population.
         """
         assert population_size > 0
         assert genome_length > 0
@@ -160,14 +223,7 @@ class GaussianInitialisation(Initialisation):
             rnd = self.random.gauss(self.mu, self.sigma)
             return min(max(0.0, rnd), 1.0)
 
-        population = []
-        while len(population) < population_size:
-            genome = [generate() for _ in xrange(genome_length)]
-            fitness = fitness_function(genome)
-            individual = Individual(genome, fitness)
-            population.append(individual)
-
-        return population
+        return [[generate() for _ in xrange(genome_length)] for _ in xrange(population_size)]
 
 
 class UniformInitialisation(Initialisation):
@@ -183,15 +239,13 @@ class UniformInitialisation(Initialisation):
         super(UniformInitialisation, self).__init__()
         self.random = random
 
-    def initialise(self, population_size, genome_length, fitness_function):
+    def create_genomes(self, population_size, genome_length):
         """
-        Initialise and return a population for a Genetic Algorithm based on a Uniform Initialization.  Initialise each
-        data point of each genome of each individual to a random number between 0.0 and 1.0; call the fitness function
-        once for every member of the initial population.
+        Create the genomes of the initial population for a Genetic Algorithm based on a Uniform Initialization.
+        Initialise each data point of each genome of each individual to a random number between 0.0 and 1.0.
         :param population_size: The size of the population.
         :param genome_length: The length of the genome for each individual in the population.
-        :param fitness_function: The fitness function, evaluated once for every member of the initial population.
-        :return: A list of individuals in the initial population of the Genetic Algorithm.
+        :return: A list of genomes for the initial population.
         """
         assert population_size > 0
         assert genome_length > 0
@@ -199,14 +253,7 @@ class UniformInitialisation(Initialisation):
         def generate():
             return self.random.uniform(0.0, 1.0)
 
-        population = []
-        while len(population) < population_size:
-            genome = [generate() for _ in xrange(genome_length)]
-            fitness = fitness_function(genome)
-            individual = Individual(genome, fitness)
-            population.append(individual)
-
-        return population
+        return [[generate() for _ in xrange(genome_length)] for _ in xrange(population_size)]
 
 
 #######################################################################################################################
@@ -237,6 +284,17 @@ class Selection(object):
         """
         pass
 
+    def select_indices(self, population):
+        """
+        Select a subset of the specified population for breeding the next generation, as the indices of the selected
+        individuals; subclasses can override this method to select from the arrays of the population directly.
+        :param population: The population from which to select a subset for breeding the next generation.
+        :return: An array of indices into the population.
+        """
+        individuals = list(population)
+        indices = dict((id(individual), index) for index, individual in enumerate(individuals))
+        return numpy.array([indices[id(individual)] for individual in self.select(individuals)], dtype=int)
+
     def compute_selection_size(self, population):
         """
         Compute and return the size of the subset of a specified population based on the selection ratio.
@@ -285,6 +343,21 @@ class RouletteSelection(Selection):
 
         return breeders
 
+    def select_indices(self, population):
+        """
+        Select a subset of the specified population for breeding the next generation, as the indices of the selected
+        individuals.
+        :param population: The population from which to select a subset for breeding the next generation.
+        :return: An array of indices into the population.
+        """
+        size = self.compute_selection_size(population)
+        assert numpy.all(population.fitness >= 0.0)
+
+        cumulative = numpy.cumsum(population.fitness)
+        random_state = _numpy_random_state(self.random)
+        points = random_state.uniform(0.0, cumulative[-1], size)
+        return numpy.minimum(numpy.searchsorted(cumulative, points), len(population) - 1)
+
 
 class StochasticSelection(Selection):
     """
@@ -324,6 +397,22 @@ class StochasticSelection(Selection):
                         return breeders
                     rnd += interval
 
+    def select_indices(self, population):
+        """
+        Select a subset of the specified population for breeding the next generation, as the indices of the selected
+        individuals.
+        :param population: The population from which to select a subset for breeding the next generation.
+        :return: An array of indices into the population.
+        """
+        size = self.compute_selection_size(population)
+        assert numpy.all(population.fitness >= 0.0)
+
+        cumulative = numpy.cumsum(population.fitness)
+        interval = cumulative[-1] / float(size)
+        random_state = _numpy_random_state(self.random)
+        points = random_state.uniform(0.0, interval) + interval * numpy.arange(size)
+        return numpy.minimum(numpy.searchsorted(cumulative, points), len(population) - 1)
+
 
 class TournamentSelection(Selection):
     """
@@ -366,6 +455,24 @@ class TournamentSelection(Selection):
 
         return breeders
 
+    def select_indices(self, population):
+        """
+        Select a subset of the specified population for breeding the next generation, as the indices of the selected
+        individuals.
+        :param population: The population from which to select a subset for breeding the next generation.
+        :return: An array of indices into the population.
+        """
+        assert 0.0 <= self.tournament_ratio < 1.0
+
+        size = self.compute_selection_size(population)
+        tournament_size = int(round(len(population) * self.tournament_ratio))
+
+        # Each tournament is a window of consecutive individuals; the first of the fittest wins.
+        random_state = _numpy_random_state(self.random)
+        starts = random_state.randint(0, len(population) - tournament_size + 1, size)
+        tournaments = starts[:, numpy.newaxis] + numpy.arange(max(1, tournament_size))
+        return starts + numpy.argmax(population.fitness[tournaments], axis=1)
+
 
 class TruncationSelection(Selection):
     """
@@ -386,6 +493,16 @@ class TruncationSelection(Selection):
 
         return available[:size]
 
+    def select_indices(self, population):
+        """
+        Select a subset of the specified population for breeding the next generation, as the indices of the selected
+        individuals.
+        :param population: The population from which to select a subset for breeding the next generation.
+        :return: An array of indices into the population.
+        """
+        size = self.compute_selection_size(population)
+        return numpy.argsort(-population.fitness, kind='mergesort')[:size]
+
 
 #######################################################################################################################
 # CROSSOVER
@@ -409,6 +526,18 @@ class Crossover(object):
         """
         pass
 
+    def crossover_genomes(self, first, second):
+        """
+        Return new genomes based on pairs of genomes, given as the rows of two arrays; subclasses can override this
+        method to process the arrays directly.
+        :param first: The two-dimensional array of the genomes of the first individual in each pair.
+        :param second: The two-dimensional array of the genomes of the second individual in each pair.
+        :return: A two-dimensional array of the new genomes.
+        """
+        population = Population(numpy.concatenate((first, second)), numpy.zeros(2 * len(first)))
+        return numpy.array([self.crossover((population[k], population[len(first) + k]))
+                            for k in xrange(len(first))])
+
 
 class OnePointCrossover(Crossover):
     """
@@ -444,6 +573,21 @@ class OnePointCrossover(Crossover):
 
         return list(left.genome[:i] + right.genome[i:])
 
+    def crossover_genomes(self, first, second):
+        """
+        Return new genomes based on pairs of genomes, given as the rows of two arrays.
+        :param first: The two-dimensional array of the genomes of the left individual in each pair.
+        :param second: The two-dimensional array of the genomes of the right individual in each pair.
+        :return: A two-dimensional array of the new genomes.
+        """
+        count, n = first.shape
+        assert second.shape == first.shape
+        assert n >= 2
+
+        random_state = _numpy_random_state(self.random)
+        i = random_state.randint(1, n, count)
+        return numpy.where(numpy.arange(n) < i[:, numpy.newaxis], first, second)
+
 
 class TwoPointCrossover(Crossover):
     """
@@ -480,6 +624,24 @@ class TwoPointCrossover(Crossover):
 
         return list(outer.genome[:i] + inner.genome[i:j] + outer.genome[j:])
 
+    def crossover_genomes(self, first, second):
+        """
+        Return new genomes based on pairs of genomes, given as the rows of two arrays.
+        :param first: The two-dimensional array of the genomes of the outer individual in each pair.
+        :param second: The two-dimensional array of the genomes of the inner individual in each pair.
+        :return: A two-dimensional array of the new genomes.
+        """
+        count, n = first.shape
+        assert second.shape == first.shape
+        assert n >= 3
+
+        random_state = _numpy_random_state(self.random)
+        i = random_state.randint(1, n - 1, count)
+        j = i + 1 + (random_state.random_sample(count) * (n - 1 - i)).astype(int)
+        points = numpy.arange(n)
+        inner = (points >= i[:, numpy.newaxis]) & (points < j[:, numpy.newaxis])
+        return numpy.where(inner, second, first)
+
 
 class UniformCrossover(Crossover):
     """
@@ -536,6 +698,28 @@ class UniformCrossover(Crossover):
 
         return genome
 
+    def crossover_genomes(self, first, second):
+        """
+        Return new genomes based on pairs of genomes, given as the rows of two arrays.
+        :param first: The two-dimensional array of the genomes of the first individual in each pair.
+        :param second: The two-dimensional array of the genomes of the second individual in each pair.
+        :return: A two-dimensional array of the new genomes.
+        """
+        assert 0.0 <= self.first_parent_ratio <= 1.0
+        count, n = first.shape
+        assert second.shape == first.shape
+        assert n >= 2
+
+        random_state = _numpy_random_state(self.random)
+        from_first = random_state.random_sample((count, n)) < self.first_parent_ratio
+
+        # The last value comes from the parent that has not contributed any other value, if any.
+        all_first = numpy.all(from_first[:, :-1], axis=1)
+        all_second = ~numpy.any(from_first[:, :-1], axis=1)
+        from_first[all_first, -1] = False
+        from_first[all_second, -1] = True
+        return numpy.where(from_first, first, second)
+
 
 #######################################################################################################################
 # MUTATION
@@ -555,6 +739,7 @@ class Mutation(object):
         :return:
         """
         self.point_mutation_ratio = 0.15
+        self.random = random
 
     @abc.abstractmethod
     def mutate(self, genome0):
@@ -565,6 +750,25 @@ class Mutation(object):
         """
         pass
 
+    def mutate_genomes(self, genomes0):
+        """
+        Return mutations of the genomes given as the rows of an array; subclasses can override this method to process
+        the array directly.
+        :param genomes0: The two-dimensional array of genomes before mutation; this method does not affect the array.
+        :return: A new two-dimensional array of genomes, possibly mutated.
+        """
+        return numpy.array([self.mutate(genome0) for genome0 in genomes0.tolist()])
+
+    def choose_points(self, shape):
+        """
+        Choose the values to mutate in an array of genomes, each with a probability of the point mutation ratio.
+        :param shape: The shape of the array.
+        :return: A boolean array that is true for the values to mutate.
+        """
+        assert 0.0 <= self.point_mutation_ratio <= 1.0
+        random_state = _numpy_random_state(self.random)
+        return random_state.random_sample(shape) < self.point_mutation_ratio
+
 
 class BoundaryMutation(Mutation):
     """
@@ -601,6 +805,17 @@ class BoundaryMutation(Mutation):
 
         return genome
 
+    def mutate_genomes(self, genomes0):
+        """
+        Return mutations of the genomes given as the rows of an array.
+        :param genomes0: The two-dimensional array of genomes before mutation; this method does not affect the array.
+        :return: A new two-dimensional array of genomes, possibly mutated.
+        """
+        points = self.choose_points(genomes0.shape)
+        random_state = _numpy_random_state(self.random)
+        boundaries = numpy.where(random_state.random_sample(genomes0.shape) < 0.5, 0.0, 1.0)
+        return numpy.where(points, boundaries, genomes0)
+
 
 class GaussianMutation(Mutation):
     """
@@ -639,6 +854,17 @@ class GaussianMutation(Mutation):
 
         return genome
 
+    def mutate_genomes(self, genomes0):
+        """
+        Return mutations of the genomes given as the rows of an array.
+        :param genomes0: The two-dimensional array of genomes before mutation; this method does not affect the array.
+        :return: A new two-dimensional array of genomes, possibly mutated.
+        """
+        points = self.choose_points(genomes0.shape)
+        random_state = _numpy_random_state(self.random)
+        mutated = numpy.clip(genomes0 + random_state.normal(self.mu, self.sigma, genomes0.shape), 0.0, 1.0)
+        return numpy.where(points, mutated, genomes0)
+
 
 class UniformMutation(Mutation):
     """
@@ -674,6 +900,16 @@ class UniformMutation(Mutation):
 
         return genome
 
+    def mutate_genomes(self, genomes0):
+        """
+        Return mutations of the genomes given as the rows of an array.
+        :param genomes0: The two-dimensional array of genomes before mutation; this method does not affect the array.
+        :return: A new two-dimensional array of genomes, possibly mutated.
+        """
+        points = self.choose_points(genomes0.shape)
+        random_state = _numpy_random_state(self.random)
+        return numpy.where(points, random_state.random_sample(genomes0.shape), genomes0)
+
 
 #######################################################################################################################
 # OPTIMISER
@@ -685,7 +921,9 @@ class ExitCondition(object):
     """
 
     ABORT = 'ABORT'
+    CONVERGED = 'CONVERGED'
     GENERATIONS = 'GENERATIONS'
+    STALLED = 'STALLED'
     TIMEOUT = 'TIMEOUT'
 
 
@@ -704,17 +942,21 @@ class Context(object):
         assert isinstance(optimiser, Optimiser)
 
         self.aborted = False
+        self.diversity = None
         self.elapsed = datetime.timedelta(seconds=0)
+        self.evaluations = 0
         self.exit_condition = None
         self.generation = 0
         self.hall_of_fame = []
         self.optimiser = optimiser
         self.population = []
+        self.reference_fitness = float('-inf')
+        self.stalled_generations = 0
         self.start = datetime.datetime.now()
 
     def submit_to_hall_of_fame(self, individual, max_size):
         """
-        Submits an individual to the hall of fame.
+        Submits an individual to the hall of fame, unless an individual with the same genome is already there.
         :param individual: The individual submitted to the hall of fame.
         :param max_size: The maximum-allowed size of the hall of fame.
         :return: None
@@ -722,7 +964,8 @@ class Context(object):
         assert isinstance(individual, Individual)
         assert max_size > 0
 
-        if individual in self.hall_of_fame:
+        genome = individual.genome
+        if any(genome == x.genome for x in self.hall_of_fame):
             return
 
         self.hall_of_fame.append(individual)
@@ -738,8 +981,13 @@ class Optimiser(object):
     def __init__(self):
         """
         Initialise a new instance of the class, with an initial population size of 100, an initial hall-of-fame size
-        of 5, an initial elite count of 1, a maximum of 500 generations, and no maximum execution time.  By default,
-        Uniform Initialization, Tournament Selection, One-Point Crossover, and Gaussian Mutation are used.
+        of 5, an initial elite count of 1, a maximum of 500 generations, no maximum execution time, and evaluation
+        in the optimiser's own process.  By default, Uniform Initialization, Tournament Selection, One-Point
+        Crossover, and Gaussian Mutation are used.
+
+        By default, the optimisation does not stop early.  With a stall generation count, it stops once the fitness of
+        the best individual has not improved by more than the stall tolerance for that many generations; with a
+        minimum diversity, it stops once the mean standard deviation of the genomes over their genes falls below it.
         :return: A new instance of the class.
         """
         self.mutation = GaussianMutation()
@@ -752,14 +1000,26 @@ class Optimiser(object):
         self.elite_count = 1
         self.log = None
         self.max_generations = 500
+        self.min_diversity = None
+        self.processes = None
+        self.stall_generations = None
+        self.stall_tolerance = 0.0
         self.timeout = None
 
-    def maximise(self, fitness_function, genome_length):
+    def maximise(self, fitness_function, genome_length, batch_fitness_function=None):
         """
         Attempt to find a maximum set of values for a specified fitness function; the number of dimensions in the
         problem domain is represented by the specified length of 'genome'.
+
+        The offspring of each generation are created first and then evaluated together, spread over the configured
+        number of worker processes, forked when the optimisation starts.  The fitness of every evaluated genome is
+        cached, so clones of earlier individuals, such as the elite, are never evaluated again; the fitness function
+        must therefore always return the same fitness for the same genome.  A batch fitness function can instead
+        evaluate the genomes of each generation at once; its values are not cached, since it may only estimate some
+        of them, as a SurrogateScreen does, and every genome passed to it counts as an evaluation.
         :param fitness_function: The fitness function to maximise.
         :param genome_length: The length of the 'genome'; i.e. the number of dimensions in the problem domain.
+        :param batch_fitness_function: An optional function returning the fitness of each of a list of genomes.
         :return: An instance of type Context that encapsulates the final state of the algorithm.
         """
         assert hasattr(fitness_function, '__call__')
@@ -767,19 +1027,54 @@ class Optimiser(object):
         assert self.elite_count < self.population_size
 
         context = Context(self)
+        if batch_fitness_function is not None:
+            return self.__maximise(context, batch_fitness_function, genome_length, cache=False)
+
+        pool = EvaluationPool(fitness_function, self.processes)
+        try:
+            return self.__maximise(context, pool.map, genome_length, cache=True)
+        finally:
+            pool.terminate()
+
+    def __maximise(self, context, evaluate_genomes, genome_length, cache):
+        fitness_cache = {}
+
+        def evaluate(genomes):
+            if not cache:
+                genomes = numpy.asarray(genomes).tolist()
+                context.evaluations += len(genomes)
+                return list(evaluate_genomes(genomes))
+
+            # Evaluate each distinct genome not seen before, all at once.
+            keys = [tuple(genome) for genome in numpy.asarray(genomes).tolist()]
+            new_keys = []
+            for key in keys:
+                if key not in fitness_cache:
+                    fitness_cache[key] = None
+                    new_keys.append(key)
+            for key, fitness in zip(new_keys, evaluate_genomes([list(key) for key in new_keys])):
+                fitness_cache[key] = fitness
+            context.evaluations += len(new_keys)
+            return [fitness_cache[key] for key in keys]
 
         # Create the initial population.
-        context.population = self.initialisation.initialise(
-            self.population_size,
-            genome_length,
-            fitness_function)
+        genomes = self.initialisation.create_genomes(self.population_size, genome_length)
+        context.population = Population(genomes, evaluate(genomes))
 
         # Update the hall of fame.
-        for individual in context.population:
-            context.submit_to_hall_of_fame(individual, self.hall_of_fame_size)
+        self.__submit_to_hall_of_fame(context)
 
         # Loop until an exit condition occurs.
         while True:
+            # Measure the progress of the population.
+            context.diversity = _diversity(context.population.genomes)
+            best_fitness = context.hall_of_fame[0].fitness
+            if best_fitness > context.reference_fitness + self.stall_tolerance:
+                context.reference_fitness = best_fitness
+                context.stalled_generations = 0
+            else:
+                context.stalled_generations += 1
+
             context.elapsed = datetime.datetime.now() - context.start
             context.generation += 1
 
@@ -794,50 +1089,80 @@ class Optimiser(object):
             if self.timeout is not None and context.elapsed > self.timeout:
                 context.exit_condition = ExitCondition.TIMEOUT
                 return context
+            if self.stall_generations is not None and context.stalled_generations >= self.stall_generations:
+                context.exit_condition = ExitCondition.STALLED
+                return context
+            if self.min_diversity is not None and context.diversity < self.min_diversity:
+                context.exit_condition = ExitCondition.CONVERGED
+                return context
 
-            # Select breeders for the next generation.
-            breeders = self.selection.select(context.population)
+            population = context.population
+            fitness = population.fitness
+
+            # Select breeders for the next generation, fittest first.
+            breeders = self.selection.select_indices(population)
             assert len(breeders) >= 2
-            list.sort(breeders, key=lambda x: x.fitness, reverse=True)
+            breeders = breeders[numpy.argsort(-fitness[breeders], kind='mergesort')]
 
             # Select the elite, if any.
-            elite = []
-            for individual in sorted(context.population, key=lambda x: x.fitness, reverse=True):
-                if len(elite) >= self.elite_count:
-                    break
-                elite.append(individual)
+            elite = numpy.argsort(-fitness, kind='mergesort')[:self.elite_count]
 
-            # Prepare a new population that initially contains the elite.
-            context.population = elite
+            # Pair each breeder with the non-adjacent breeder half the breeders away, until enough offspring are
+            # produced, with the fitter breeder of each pair first.
+            offspring_count = self.population_size - len(elite)
+            i = breeders[numpy.arange(offspring_count) % len(breeders)]
+            j = breeders[(numpy.arange(offspring_count) + len(breeders) // 2) % len(breeders)]
+            first = numpy.where(fitness[i] >= fitness[j], i, j)
+            second = numpy.where(fitness[i] >= fitness[j], j, i)
 
-            # Initialise indices for two non-adjacent breeders.
-            i = 0
-            j = len(breeders) // 2
+            # Always perform crossover (recombination).
+            offspring = self.crossover.crossover_genomes(population.genomes[first], population.genomes[second])
 
-            # Loop until enough offspring are produced.
-            while len(context.population) < self.population_size:
+            # Perform mutation optionally.
+            if self.mutation is not None:
+                offspring = self.mutation.mutate_genomes(offspring)
 
-                # Always perform crossover (recombination).
-                genome = self.crossover.crossover(
-                    sorted((breeders[i], breeders[j]), key=lambda x: x.fitness, reverse=True))
-
-                # Perform mutation optionally.
-                if self.mutation is not None:
-                    genome = self.mutation.mutate(genome)
-
-                # Add this individual to the population of the next generation.
-                fitness = fitness_function(genome)
-                individual = Individual(genome, fitness)
-                context.population.append(individual)
-
-                # Advance to the next breeders.
-                i = (i + 1) % len(breeders)
-                j = (j + 1) % len(breeders)
+            # The population of the next generation is the elite and the offspring.
+            context.population = Population(
+                numpy.concatenate((population.genomes[elite], offspring)),
+                numpy.concatenate((fitness[elite], evaluate(offspring))))
 
             # Update the hall of fame.
-            for individual in context.population:
+            self.__submit_to_hall_of_fame(context)
+
+    def __submit_to_hall_of_fame(self, context):
+        # Only the fittest individuals of the population can enter the hall of fame, but individuals with the same
+        # genome are submitted only once.
+        population = context.population
+        order = numpy.argsort(-population.fitness, kind='mergesort')
+        submitted = set()
+        for index in order:
+            if len(submitted) >= self.hall_of_fame_size:
+                break
+            individual = population[index]
+            if individual.genome not in submitted:
+                submitted.add(individual.genome)
                 context.submit_to_hall_of_fame(individual, self.hall_of_fame_size)
 
     def __log(self, context):
         if self.log is not None:
             self.log(context)
+
+
+def _diversity(genomes):
+    """
+    Measure the diversity of a population.
+    :param genomes: An array of genomes, one per row.
+    :return: The mean over the genes of the standard deviation of the genomes.
+    """
+    return float(numpy.mean(numpy.std(genomes, axis=0)))
+
+
+def _numpy_random_state(rng):
+    """
+    Create a numpy random state seeded from a random number generator, so the operators processing arrays draw from
+    the same generator as the operators processing single individuals, and seeding it makes a run reproducible.
+    :param rng: The random number generator, such as the random module or an instance of random.Random.
+    :return: A new numpy random state.
+    """
+    return numpy.random.RandomState(rng.randint(0, 2 ** 32 - 1))
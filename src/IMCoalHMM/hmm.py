@@ -2,21 +2,227 @@
 
 The code here just wrap the hmm likelihood computation from the ziphmm module in a Forwarder
 class that matches the interface there was in the earlier pyZipHMM package.
+
+Before the ziphmm pair compression, long runs of a single symbol are run-length encoded
+(see IMCoalHMM.observations). A run symbol standing for 2**k copies of symbol s gets the
+matrix for s raised to the power 2**k, computed by repeated squaring, so a run of length r
+costs about log2(r) matrix products once per HMM and a few matrix-vector products per run.
 """
 
 import ziphmm
+from ziphmm.cython_funcs import zip_forward
 import numpy as np
 
-class Forwarder:
+from IMCoalHMM.observations import run_length_encode, DEFAULT_MIN_RUN_LENGTH
+from IMCoalHMM.observations import read_observations, is_segment_directory, read_segment_index
+from IMCoalHMM.dataset import Dataset, is_dataset
+
+
+def _symbol_matrices(trans_probs, emission_probs):
+    """Compute the scaled matrices for moving one step in the forward algorithm
+    while emitting each symbol.
+
+    :returns: the matrices, indexed by symbol, and the log of their scales.
+    """
+    # matrices[s, j, k] = T[k, j] * E[j, s]
+    matrices = emission_probs.T[:, :, np.newaxis] * trans_probs.T[np.newaxis, :, :]
+    scales = matrices.sum(axis=(1, 2))
+    matrices /= scales[:, np.newaxis, np.newaxis]
+    return matrices, np.log(scales)
+
+
+class _RunMatrices(object):
+    """The matrices for the run symbols of one HMM.
+
+    The matrix for 2**k copies of a symbol is found by squaring the matrix for 2**(k-1)
+    copies, so all the run symbols of all the forwarders used in one likelihood evaluation
+    share the squarings.
+    """
+
+    def __init__(self, trans_probs, emission_probs):
+        self.trans_probs = trans_probs
+        self.emission_probs = emission_probs
+        self.symbol_matrices, self.symbol_scales = _symbol_matrices(trans_probs, emission_probs)
+        self.powers = {}
+
+    def matches(self, trans_probs, emission_probs):
+        """Check if these are the run matrices for the given HMM."""
+        return self.trans_probs is trans_probs and self.emission_probs is emission_probs
+
+    def power(self, symbol, exponent):
+        """The scaled matrix for 2**exponent copies of symbol and the log of its scale."""
+        if exponent == 0:
+            return self.symbol_matrices[symbol], self.symbol_scales[symbol]
+        key = (symbol, exponent)
+        if key not in self.powers:
+            half, half_scale = self.power(symbol, exponent - 1)
+            matrix = np.dot(half, half)
+            scale = matrix.sum()
+            self.powers[key] = matrix / scale, np.log(scale) + 2 * half_scale
+        return self.powers[key]
+
+
+# Run matrices for the most recent HMM. The Likelihood class passes the same matrices to
+# all its forwarders, so within one evaluation they are only computed once.
+_RUN_MATRICES = None
+
+
+def _run_matrices(trans_probs, emission_probs):
+    global _RUN_MATRICES
+    if _RUN_MATRICES is None or not _RUN_MATRICES.matches(trans_probs, emission_probs):
+        _RUN_MATRICES = _RunMatrices(trans_probs, emission_probs)
+    return _RUN_MATRICES
+
+
+class Forwarder(object):
+
+    def __init__(self, input_filename, NSYM, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+        self._preprocess(read_observations(input_filename), NSYM, min_run_length)
+
+    @classmethod
+    def from_observations(cls, obs, NSYM, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+        """Build a forwarder from an observation sequence already in memory."""
+        forwarder = cls.__new__(cls)
+        forwarder._preprocess(np.asarray(obs, dtype=np.int32), NSYM, min_run_length)
+        return forwarder
+
+    @classmethod
+    def from_preprocessed(cls, NSYM, sequence_length, min_run_length, run_symbols, new_obs, pairs):
+        """Build a forwarder from the output of preprocessed_state."""
+        forwarder = cls.__new__(cls)
+        forwarder.NSYM = NSYM
+        forwarder.sequence_length = sequence_length
+        forwarder.min_run_length = min_run_length
+        forwarder.run_symbols = [tuple(run_symbol) for run_symbol in run_symbols]
+        forwarder.run_nsyms = NSYM + len(forwarder.run_symbols)
+        forwarder.new_obs = np.array(new_obs, dtype=np.int32)
+        forwarder.new_nsyms = forwarder.run_nsyms + len(pairs)
+        forwarder.sym2pair = dict((forwarder.run_nsyms + i, (int(left), int(right)))
+                                  for i, (left, right) in enumerate(pairs))
+        return forwarder
+
+    def preprocessed_state(self):
+        """The result of preprocessing the observations, so it can be stored and
+        the forwarder rebuilt with from_preprocessed.
+
+        :returns: the run symbol table, the compressed observations and the pair
+         of symbols each new symbol replaces.
+        :rtype: (list[(int, int)], numpy.ndarray, numpy.ndarray)
+        """
+        pairs = np.array([self.sym2pair[i] for i in xrange(self.run_nsyms, self.new_nsyms)],
+                         dtype=np.int32).reshape(-1, 2)
+        return self.run_symbols, self.new_obs, pairs
+
+    def _preprocess(self, obs, NSYM, min_run_length):
+        self.NSYM = NSYM
+        self.min_run_length = min_run_length
+        self.sequence_length = len(obs)
+        encoded_obs, self.run_symbols = run_length_encode(obs, NSYM, min_run_length)
+        self.run_nsyms = NSYM + len(self.run_symbols)
+        self.new_obs, self.sym2pair, self.new_nsyms = \
+            ziphmm.preprocess_raw_observations(encoded_obs, self.run_nsyms)
+
+    def forward(self, init_probs, trans_probs, emission_probs):
+        if not self.run_symbols:
+            return ziphmm.zip_forward(init_probs, trans_probs, emission_probs,
+                                      self.sym2pair, self.new_obs, self.NSYM, self.new_nsyms)
+
+        run_matrices = _run_matrices(trans_probs, emission_probs)
+        sym2mat = list(run_matrices.symbol_matrices)
+        sym2scale = list(run_matrices.symbol_scales)
+        for symbol, exponent in self.run_symbols:
+            matrix, scale = run_matrices.power(symbol, exponent)
+            sym2mat.append(matrix)
+            sym2scale.append(scale)
+        for i in xrange(self.run_nsyms, self.new_nsyms):
+            left, right = self.sym2pair[i]
+            matrix = np.dot(sym2mat[right], sym2mat[left])  # <- reverse order of seq
+            scale = matrix.sum()
+            sym2mat.append(matrix / scale)
+            sym2scale.append(np.log(scale) + sym2scale[left] + sym2scale[right])
+
+        return zip_forward(init_probs, trans_probs, emission_probs, self.new_obs,
+                           np.array(sym2mat), np.array(sym2scale))
+
+
+class DatasetForwarder(object):
+    """A forwarder for one segment of a dataset file.
+
+    The segment is only read and preprocessed the first time the likelihood is
+    computed, so when the forwarders are handed out to worker processes, each
+    worker only reads the segments it is given.
+    """
+
+    def __init__(self, dataset, segment_no, NSYM, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+        self.dataset = dataset
+        self.segment_no = segment_no
+        self.NSYM = NSYM
+        self.min_run_length = min_run_length
+        self.sequence_length = dataset.segments[segment_no]['length']
+        self.forwarder = None
+
+    def forward(self, init_probs, trans_probs, emission_probs):
+        if self.forwarder is None:
+            self.forwarder = self._stored_forwarder()
+        if self.forwarder is None:
+            obs = self.dataset.observations(self.segment_no)
+            self.forwarder = Forwarder.from_observations(obs, self.NSYM, self.min_run_length)
+        return self.forwarder.forward(init_probs, trans_probs, emission_probs)
+
+    def _stored_forwarder(self):
+        """The forwarder preprocessed when the dataset was written, if it matches this one."""
+        stored = self.dataset.segments[self.segment_no].get('preprocessed')
+        if stored is None or stored['NSYM'] != self.NSYM or stored['min_run_length'] != self.min_run_length:
+            return None
+        return Forwarder.from_preprocessed(self.NSYM, self.sequence_length, self.min_run_length,
+                                           stored['run_symbols'],
+                                           self.dataset.array(stored['obs']),
+                                           self.dataset.array(stored['pairs']))
+
+
+def store_preprocessed(writer, forwarder):
+    """Store a forwarder's preprocessed observations with the last segment added to a dataset.
+
+    :param writer: The dataset being written.
+    :type writer: IMCoalHMM.dataset.DatasetWriter
+    :param forwarder: A forwarder for the observations of the last segment.
+    :type forwarder: Forwarder
+    """
+    run_symbols, new_obs, pairs = forwarder.preprocessed_state()
+    writer.segments[-1]['preprocessed'] = {
+        'NSYM': forwarder.NSYM,
+        'min_run_length': forwarder.min_run_length,
+        'run_symbols': [list(run_symbol) for run_symbol in run_symbols],
+        'obs': writer.add_array(new_obs),
+        'pairs': writer.add_array(pairs),
+    }
+
 
-	def __init__(self, input_filename, NSYM):
-		with open(input_filename) as finp:
-			obs = np.array(map(int, finp.read().split()), dtype=np.int32)
-			self.NSYM = NSYM
-			self.new_obs, self.sym2pair, self.new_nsyms = ziphmm.preprocess_raw_observations(obs, self.NSYM)
+def make_forwarders(alignments, NSYM, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+    """Build forwarders for the alignments given on a command line.
 
+    Each alignment is either a file in the ziphmm text format, a dataset file
+    or a directory of segments. There is a forwarder per segment in the
+    latter two cases.
 
-	def forward(self, init_probs, trans_probs, emission_probs):
-		return ziphmm.zip_forward(init_probs, trans_probs, emission_probs, 
-			   		              self.sym2pair, self.new_obs, self.NSYM, self.new_nsyms)
+    :param alignments: Paths to alignments.
+    :type alignments: list[str]
+    :param NSYM: The size of the alphabet in the alignments.
+    :type NSYM: int
 
+    :rtype: list[Forwarder | DatasetForwarder]
+    """
+    forwarders = []
+    for path in alignments:
+        if is_dataset(path):
+            dataset = Dataset(path)
+            if dataset.no_symbols > NSYM:
+                raise ValueError('{0} has {1} symbols, expected at most {2}.'.format(path, dataset.no_symbols, NSYM))
+            for segment_no in xrange(len(dataset)):
+                forwarders.append(DatasetForwarder(dataset, segment_no, NSYM, min_run_length))
+        elif is_segment_directory(path):
+            for filename, _, _, _ in read_segment_index(path):
+                forwarders.append(Forwarder(filename, NSYM, min_run_length))
+        else:
+            forwarders.append(Forwarder(path, NSYM, min_run_length))
+    return forwarders
@@ -2,41 +2,229 @@
 likelihoods.
 """
 
+import numpy
 import scipy.optimize
+from multiprocessing import Process, Queue
+
+from IMCoalHMM.cache import Cache
+from IMCoalHMM.parallel import EvaluationPool
+
+# The optimisation methods that use gradients, which we compute by finite differences.
+GRADIENT_METHODS = ('L-BFGS-B', 'TNC', 'SLSQP')
+
+
+class RemoteForwarders(object):
+    """A group of forwarders evaluated in another process.
+
+    The forwarders are inherited by the new process when it is forked, so only the
+    HMM matrices and the resulting log-likelihoods are sent between processes.
+    """
+
+    def __init__(self, forwarders):
+        self.forwarders = forwarders
+        self.task_queue = Queue()
+        self.response_queue = Queue()
+        self.process = Process(target=self)
+        self.process.daemon = True
+        self.process.start()
+
+    def __call__(self):
+        while True:
+            init_probs, trans_probs, emission_probs = self.task_queue.get()
+            try:
+                self.response_queue.put(sum(forwarder.forward(init_probs, trans_probs, emission_probs)
+                                            for forwarder in self.forwarders))
+            except Exception as ex:
+                self.response_queue.put(ex)
+
+    def remote_start(self, init_probs, trans_probs, emission_probs):
+        self.task_queue.put((init_probs, trans_probs, emission_probs))
+
+    def remote_complete(self):
+        result = self.response_queue.get()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def remote_terminate(self):
+        self.process.terminate()
+
+
+def partition_forwarders(forwarders, no_groups):
+    """Split forwarders into groups of roughly the same total sequence length,
+    by giving each forwarder, longest first, to the group with the least sequence so far.
+
+    :rtype: list[list[IMCoalHMM.hmm.Forwarder]]
+    """
+    groups = [[] for _ in xrange(min(no_groups, len(forwarders)))]
+    loads = [0] * len(groups)
+    for forwarder in sorted(forwarders, key=lambda f: getattr(f, 'sequence_length', 1), reverse=True):
+        smallest = loads.index(min(loads))
+        groups[smallest].append(forwarder)
+        loads[smallest] += getattr(forwarder, 'sequence_length', 1)
+    return groups
+
+
+def _memo_key(parameters):
+    """The exact parameter values as a hashable key."""
+    return tuple(float(value) for value in numpy.ravel(parameters))
 
 
 class Likelihood(object):
     """Combining model and data."""
 
-    def __init__(self, model, forwarders):
+    def __init__(self, model, forwarders, processes=None, memo_size=None):
         """Bind a model to sequence data in the form of ZipHMM Forwarders.
 
+        If more than one process is requested, the forwarders are split between
+        that many worker processes and evaluated in parallel.
+
+        If a memo size is given, the hidden Markov model and log-likelihood of
+        recently evaluated parameter points are remembered, so evaluating the
+        exact same parameters again is just a lookup. Between memo_size and
+        twice that many points are kept, the most recently used ones.
+
         :param model: Any demographic model that can build a hidden Markov model.
         :type model: IMCoalHMM.model.Model
         :param forwarders: ZipHMM forwarder or forwarders for computing the HMM likelihood.
-        :type forwarders: pyZipHMM.Forwarder | list[pyZipHMM.Forwarder]
+        :type forwarders: IMCoalHMM.hmm.Forwarder | list[IMCoalHMM.hmm.Forwarder]
+        :param processes: Number of worker processes to evaluate the forwarders in.
+        :type processes: int | None
+        :param memo_size: Number of parameter points to remember, or None to remember none.
+        :type memo_size: int | None
         """
         super(Likelihood, self).__init__()
         self.model = model
 
+        self.memo = Cache(memo_size) if memo_size else None
+        self.memo_hits = 0
+        self.memo_misses = 0
+
         if hasattr(forwarders, '__iter__'):
             self.forwarders = forwarders
         else:
             self.forwarders = [forwarders]
 
+        self.workers = None
+        if processes is not None and processes > 1 and len(self.forwarders) > 1:
+            self.workers = [RemoteForwarders(group) for group in partition_forwarders(self.forwarders, processes)]
+
     def __call__(self, *parameters):
         """Compute the log-likelihood at a set of parameters."""
         if not self.model.valid_parameters(*parameters):
             return -float('inf')
 
-        init_probs, trans_probs, emission_probs = self.model.build_hidden_markov_model(*parameters)
-        return sum(forwarder.forward(init_probs, trans_probs, emission_probs) for forwarder in self.forwarders)
+        if self.memo is None:
+            return self.forward(*self.model.build_hidden_markov_model(*parameters))
+
+        key = _memo_key(parameters)
+        if key in self.memo:
+            self.memo_hits += 1
+            return self.memo[key][1]
+        self.memo_misses += 1
+        hmm = self.model.build_hidden_markov_model(*parameters)
+        log_likelihood = self.forward(*hmm)
+        self.memo[key] = hmm, log_likelihood
+        return log_likelihood
+
+    def hidden_markov_model(self, *parameters):
+        """The hidden Markov model at a set of parameters, from the memo if it is there.
+
+        :returns: the initial, transition and emission probabilities.
+        """
+        if self.memo is not None:
+            key = _memo_key(parameters)
+            if key in self.memo:
+                return self.memo[key][0]
+        return self.model.build_hidden_markov_model(*parameters)
+
+    def forward(self, init_probs, trans_probs, emission_probs):
+        """Compute the log-likelihood of the data in a hidden Markov model."""
+        if self.workers is None:
+            return sum(forwarder.forward(init_probs, trans_probs, emission_probs) for forwarder in self.forwarders)
+
+        for worker in self.workers:
+            worker.remote_start(init_probs, trans_probs, emission_probs)
+        # Collect the response of every worker before raising an error from any of them,
+        # so no response is left behind to be mistaken for the result of the next call.
+        log_likelihood = 0.0
+        error = None
+        for worker in self.workers:
+            try:
+                log_likelihood += worker.remote_complete()
+            except Exception as ex:
+                if error is None:
+                    error = ex
+        if error is not None:
+            raise error
+        return log_likelihood
+
+    def memo_report(self):
+        """Describe how many evaluations were answered from the memo.
+
+        :rtype: str
+        """
+        evaluations = self.memo_hits + self.memo_misses
+        hit_rate = 100.0 * self.memo_hits / evaluations if evaluations else 0.0
+        return 'Likelihood memo: {0} of {1} evaluations reused ({2:.1f}%)'.format(self.memo_hits, evaluations,
+                                                                                   hit_rate)
+
+    def terminate(self):
+        """Stop the worker processes, if any."""
+        if self.workers is not None:
+            for worker in self.workers:
+                worker.remote_terminate()
+            self.workers = None
+
+
+def finite_difference_steps(point):
+    """Step sizes for forward differences, relative to the magnitude of each coordinate
+    so parameters on different scales are perturbed equally in relative terms.
+    Gradients are taken in the coordinates of a ParameterTransform, where values near
+    zero are common and have no scale of their own, so coordinates below one in
+    magnitude get the step of a coordinate of one; a smaller step would leave only
+    rounding noise in the difference.
+
+    :rtype: numpy.ndarray
+    """
+    magnitudes = numpy.abs(numpy.asarray(point, dtype=float))
+    return numpy.sqrt(numpy.finfo(float).eps) * numpy.maximum(magnitudes, 1.0)
+
+
+def value_and_gradient(pool, point):
+    """Compute a function and its forward-difference gradient at a point.
+
+    The point and its p perturbations are evaluated together in the pool, so with
+    p + 1 processes this takes about as long as one evaluation. Where a forward step
+    gives an invalid value the gradient is computed from a backward step instead.
+
+    :param pool: The pool evaluating the function.
+    :type pool: IMCoalHMM.parallel.EvaluationPool
+    :param point: The point.
+    :type point: numpy.ndarray
+
+    :returns: the value and the gradient.
+    """
+    point = numpy.asarray(point, dtype=float)
+    steps = finite_difference_steps(point)
+    perturbations = numpy.diag(steps)
+    values = numpy.array(pool.map([point] + list(point + perturbations)), dtype=float)
+    value = values[0]
+    gradient = (values[1:] - value) / steps
+
+    backward = numpy.flatnonzero(~numpy.isfinite(values[1:]))
+    if len(backward) > 0 and numpy.isfinite(value):
+        backward_values = numpy.array(pool.map(list(point - perturbations[backward])), dtype=float)
+        gradient[backward] = (value - backward_values) / steps[backward]
+    return value, gradient
 
 
 def maximum_likelihood_estimate(log_likelihood, initial_parameters,
                                 optimizer_method="Nelder-Mead",
                                 log_file=None,
-                                log_param_transform=lambda x: x):
+                                log_param_transform=lambda x: x,
+                                transform=None,
+                                processes=None):
     """Maximum likelihood estimation.
 
     This function requires a wrapper around the likelihood computation
@@ -50,38 +238,69 @@ def maximum_likelihood_estimate(log_likelihood, initial_parameters,
     It also requires an initial parameter point for the optimization, and a numerical
     algorithm for optimisation (a default from scipy is fmin).
 
+    If a parameter transform is given, the optimiser works on the transformed
+    parameters, e.g. the logarithms of rates and times, which puts them on
+    comparable scales and keeps them valid. The parameters are mapped back before
+    each likelihood evaluation, before logging and in the result.
+
+    For the gradient based methods, the gradient is computed by forward differences
+    with all the perturbed points evaluated together, spread over the given number
+    of processes. The log-likelihood should not use worker processes of its own then.
+
     :param log_likelihood: The Likelihood wrapper needed for computing the likelihood.
     :type log_likelihood: Likelihood
     :param initial_parameters: The initial set of parameters. Model specific.
     :param log_file: Progress will be logged to this file/stream.
     :param log_param_transform: A function to map the optimization parameter space
      into a model parameter space.
+    :param transform: The transform between model parameters and the space they are optimised in.
+    :type transform: IMCoalHMM.transforms.ParameterTransform | None
+    :param processes: The number of processes to compute finite-difference gradients in.
+    :type processes: int | None
 
     :returns: the maximum likelihood parameters.
     """
+    if transform is None:
+        model_parameters = numpy.asarray
+        initial_point = initial_parameters
+        bounds = [(0, None)] * len(initial_parameters)
+    else:
+        model_parameters = transform.from_optimiser
+        initial_point = transform.to_optimiser(initial_parameters)
+        bounds = transform.bounds()
+
     log_callback = None
     if log_file:
         def log_callback(parameters):
-            log_params = [str(param) for param in log_param_transform(parameters)]
+            log_params = [str(param) for param in log_param_transform(model_parameters(parameters))]
             print >> log_file, '\t'.join(log_params)
 
     def minimize_wrapper(parameters):
-        return -log_likelihood(parameters)
+        return -log_likelihood(model_parameters(parameters))
 
     options = {'disp': False}
     # Set optimizer specific options
 
     #FIXME: if I have other ways of checking valid parameters for later models, this
     # really needs to be updated as well!
-    if optimizer_method in ['Anneal', 'L-BFGS-B', 'TNC', 'SLSQP']:
-        bounds = [(0, None)] * len(initial_parameters)
-        result = scipy.optimize.minimize(fun=minimize_wrapper, x0=initial_parameters,
-                                         method=optimizer_method, bounds=bounds,
-                                         callback=log_callback, options=options)
-    else:
-        result = scipy.optimize.minimize(fun=minimize_wrapper, x0=initial_parameters,
-                                         method=optimizer_method,
-                                         callback=log_callback, options=options)
+    pool = None
+    try:
+        if optimizer_method in GRADIENT_METHODS:
+            pool = EvaluationPool(minimize_wrapper, processes)
+            result = scipy.optimize.minimize(fun=lambda point: value_and_gradient(pool, point), x0=initial_point,
+                                             method=optimizer_method, jac=True, bounds=bounds,
+                                             callback=log_callback, options=options)
+        elif optimizer_method in ['Anneal']:
+            result = scipy.optimize.minimize(fun=minimize_wrapper, x0=initial_point,
+                                             method=optimizer_method, bounds=bounds,
+                                             callback=log_callback, options=options)
+        else:
+            result = scipy.optimize.minimize(fun=minimize_wrapper, x0=initial_point,
+                                             method=optimizer_method,
+                                             callback=log_callback, options=options)
+    finally:
+        if pool is not None:
+            pool.terminate()
 
     #print result
-    return result.x
+    return model_parameters(result.x)
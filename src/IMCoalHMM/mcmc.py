@@ -3,7 +3,7 @@ Module for generic MCMC code.
 
 """
 
-from IMCoalHMM.hmm import Forwarder
+from IMCoalHMM.hmm import make_forwarders
 from IMCoalHMM.likelihood import Likelihood
 
 from scipy.stats import norm, expon
@@ -59,12 +59,17 @@ class ExpLogNormPrior(object):
 
 
 class MCMC(object):
-    def __init__(self, priors, log_likelihood, thinning):
+    def __init__(self, priors, log_likelihood, thinning, initial_theta=None):
         self.priors = priors
         self.log_likelihood = log_likelihood
         self.thinning = thinning
 
-        self.current_theta = array([pi.sample() for pi in self.priors])
+        # The chain starts from a sample of the priors unless a starting point is given,
+        # such as an estimate on a subset of the data.
+        if initial_theta is not None:
+            self.current_theta = array(initial_theta, dtype=float)
+        else:
+            self.current_theta = array([pi.sample() for pi in self.priors])
         self.current_prior = self.log_prior(self.current_theta)
         self.current_likelihood = self.log_likelihood(self.current_theta)
         self.current_posterior = self.current_prior + self.current_likelihood
@@ -101,19 +106,21 @@ class RemoteMCMC(object):
     """ MCMC that is designed to run in another process for parallel execution.
     """
 
-    def __init__(self, priors, input_files, model, thinning):
+    def __init__(self, priors, input_files, model, thinning, initial_theta=None):
         self.priors = priors
         self.input_files = input_files
         self.model = model
         self.thinning = thinning
+        self.initial_theta = initial_theta
         self.chain = None
         self.task_queue = Queue()
         self.response_queue = Queue()
 
     def _set_chain(self):
-        forwarders = [Forwarder(arg, NSYM = 3) for arg in self.input_files]
+        forwarders = make_forwarders(self.input_files, NSYM=3)
         log_likelihood = Likelihood(self.model, forwarders)
-        self.chain = MCMC(priors=self.priors, log_likelihood=log_likelihood, thinning=self.thinning)
+        self.chain = MCMC(priors=self.priors, log_likelihood=log_likelihood, thinning=self.thinning,
+                          initial_theta=self.initial_theta)
 
     def __call__(self):
         self._set_chain()
@@ -125,8 +132,8 @@ class RemoteMCMC(object):
 class RemoteMCMCProxy(object):
     """Local handle to a remote MCMC object."""
 
-    def __init__(self, priors, input_files, model, thinning):
-        self.remote_chain = RemoteMCMC(priors, input_files, model, thinning)
+    def __init__(self, priors, input_files, model, thinning, initial_theta=None):
+        self.remote_chain = RemoteMCMC(priors, input_files, model, thinning, initial_theta)
         self.remote_process = Process(target=self.remote_chain)
         self.current_theta = None
         self.current_prior = None
@@ -149,10 +156,12 @@ class RemoteMCMCProxy(object):
 class MC3(object):
     """A Metropolis-Coupled MCMC."""
 
-    def __init__(self, priors, input_files, model, no_chains, thinning, switching, temperature_scale):
+    def __init__(self, priors, input_files, model, no_chains, thinning, switching, temperature_scale,
+                 initial_theta=None):
 
         self.no_chains = no_chains
-        self.chains = [RemoteMCMCProxy(priors, input_files, model, switching) for _ in xrange(no_chains)]
+        self.chains = [RemoteMCMCProxy(priors, input_files, model, switching, initial_theta)
+                       for _ in xrange(no_chains)]
         self.thinning = thinning
         self.switching = switching
         self.temperature_scale = temperature_scale
@@ -14,6 +14,10 @@ class Model(object):
     """
     __metaclass__ = ABCMeta
 
+    # The CTMC system from the last HMM built, which build_ctmc_system passes on to the
+    # new system so it can reuse the matrices that do not depend on changed parameters.
+    previous_ctmc_system = None
+
     @abstractmethod
     def build_ctmc_system(self, *parameters):
         """Build the CTMC system from the model-specific parameters."""
@@ -45,5 +49,6 @@ class Model(object):
         """Build the hidden Markov model matrices from the model-specific parameters."""
         ctmc_system = self.build_ctmc_system(*parameters)
         initial_probs, transition_probs = compute_transition_probabilities(ctmc_system)
+        self.previous_ctmc_system = ctmc_system
         emission_probs = emission_matrix(self.emission_points(*parameters))
         return initial_probs, transition_probs, emission_probs
@@ -0,0 +1,426 @@
+"""Multi-fidelity maximum likelihood estimation.
+
+Building the hidden Markov model and running the forward algorithm gets more
+expensive with the number of time intervals, but the first steps of an
+optimisation only need to get near the optimum, which a model with a coarse
+time discretisation does as well at a fraction of the cost. The estimation is
+therefore run with a coarse version of the model first, and each finer version
+starts from the estimate of the previous one, up to the model at the target
+resolution. Coarse levels can also use a subset of the data.
+
+The same warm start works along the data alone: the target model is first fitted
+to a random subset of the alignment segments, with the log-likelihood scaled up
+to the length of all the data, and the subset grows until the estimates on
+consecutive subsets agree, before the fit continues on all the data.
+"""
+
+import functools
+import time
+from multiprocessing import Value
+
+import numpy
+
+from IMCoalHMM.likelihood import Likelihood, maximum_likelihood_estimate
+
+
+def coarse_intervals(intervals, fraction, min_intervals=2):
+    """Scale the interval counts of a model.
+
+    :param intervals: The interval counts of the model at the target resolution:
+     a count or a list of counts, such as the counts of each epoch, or a tuple
+     of those.
+    :param fraction: The fraction of the intervals to keep.
+    :type fraction: float
+    :param min_intervals: Counts are not scaled below this unless they are below it already.
+    :type min_intervals: int
+
+    :returns: the scaled counts, in the same structure. Zero counts stay zero.
+    """
+    if isinstance(intervals, (list, tuple)):
+        return type(intervals)(coarse_intervals(count, fraction, min_intervals) for count in intervals)
+    if intervals <= min_intervals:
+        return intervals
+    return max(min_intervals, int(round(intervals * fraction)))
+
+
+def fidelity_fractions(no_levels, factor=0.5):
+    """The fractions of the intervals at each level, from the coarsest to the target.
+
+    :param no_levels: The number of levels.
+    :type no_levels: int
+    :param factor: The ratio between the resolutions of consecutive levels.
+    :type factor: float
+
+    :rtype: list[float]
+    """
+    return [factor ** (no_levels - 1 - level) for level in xrange(no_levels)]
+
+
+def subset_indices(forwarders, fraction, order):
+    """Choose a subset of the forwarders with a fraction of the sequence length.
+
+    :param forwarders: All the forwarders.
+    :type forwarders: list[IMCoalHMM.hmm.Forwarder]
+    :param fraction: The fraction of the total sequence length to choose.
+    :type fraction: float
+    :param order: A random permutation of the indices of the forwarders; the subset
+     is the shortest prefix of it covering the fraction, so subsets of increasing
+     fractions are nested.
+
+    :returns: the sorted indices of the chosen forwarders.
+    :rtype: list[int]
+    """
+    lengths = [getattr(forwarder, 'sequence_length', 1) for forwarder in forwarders]
+    target = fraction * sum(lengths)
+    covered = 0
+    count = 0
+    for index in order:
+        covered += lengths[index]
+        count += 1
+        if covered >= target:
+            break
+    return sorted(order[:count])
+
+
+class SubsetLikelihood(object):
+    """The log-likelihood of a subset of the data, scaled up to the length of all the data.
+
+    Scaling by the fraction of the sequence length keeps the log-likelihood on the
+    scale of the full data, so it can be compared between subsets, and its curvature
+    matches the full data for optimisers and samplers.
+
+    :ivar log_likelihood: The Likelihood of the subset.
+    :ivar forwarders: The forwarders of the subset.
+    :ivar fraction: The fraction of the sequence length in the subset.
+    """
+
+    def __init__(self, model, forwarders, indices, processes=None, memo_size=None):
+        """
+        :param model: The demographic model.
+        :type model: IMCoalHMM.model.Model
+        :param forwarders: All the forwarders.
+        :type forwarders: list[IMCoalHMM.hmm.Forwarder]
+        :param indices: The indices of the forwarders in the subset.
+        :type indices: list[int]
+        :param processes: The number of processes of the Likelihood.
+        :type processes: int | None
+        :param memo_size: The memo size of the Likelihood.
+        :type memo_size: int | None
+        """
+        self.forwarders = [forwarders[index] for index in indices]
+        total = sum(getattr(forwarder, 'sequence_length', 1) for forwarder in forwarders)
+        self.fraction = float(sum(getattr(forwarder, 'sequence_length', 1)
+                                  for forwarder in self.forwarders)) / total
+        self.log_likelihood = Likelihood(model, self.forwarders, processes=processes, memo_size=memo_size)
+
+    def __call__(self, parameters):
+        return self.log_likelihood(parameters) / self.fraction
+
+    def terminate(self):
+        """Stop the worker processes, if any."""
+        self.log_likelihood.terminate()
+
+
+class FidelityLevel(object):
+    """A version of the log-likelihood to optimise at one level.
+
+    The log-likelihood is only built when it is first used, so the worker
+    processes of a level only run while the level is optimised.
+
+    :ivar description: A description of the level for reports.
+    """
+
+    def __init__(self, make_log_likelihood, description):
+        """
+        :param make_log_likelihood: A function building the log-likelihood at this level.
+        :param description: A description of the level for reports.
+        :type description: str
+        """
+        self.make_log_likelihood = make_log_likelihood
+        self.description = description
+        self._log_likelihood = None
+
+    @property
+    def log_likelihood(self):
+        """The log-likelihood at this level, built on first use."""
+        if self._log_likelihood is None:
+            self._log_likelihood = self.make_log_likelihood()
+        return self._log_likelihood
+
+    def terminate(self):
+        """Stop the worker processes of the log-likelihood, if it was built."""
+        if self._log_likelihood is not None:
+            self._log_likelihood.terminate()
+            self._log_likelihood = None
+
+
+def fidelity_levels(make_model, arguments, interval_arguments, forwarders, no_levels=3, factor=0.5,
+                    data_fractions=None, processes=None, memo_size=None, random_state=None):
+    """Build the levels of a multi-fidelity estimation for a model class.
+
+    Only the arguments of make_model that are interval counts are scaled; others,
+    such as a number of epochs, would change the parameters of the model. The
+    log-likelihood of each level is built when the level is first used.
+
+    :param make_model: A function making the model, such as the model class.
+    :param arguments: The arguments of make_model at the target resolution.
+    :type arguments: tuple
+    :param interval_arguments: The indices of the arguments that are interval counts.
+    :type interval_arguments: list[int]
+    :param forwarders: The forwarders of the data.
+    :type forwarders: list[IMCoalHMM.hmm.Forwarder]
+    :param no_levels: The number of levels.
+    :type no_levels: int
+    :param factor: The ratio between the resolutions of consecutive levels.
+    :type factor: float
+    :param data_fractions: The fraction of the sequence length, in forwarders chosen at random,
+     to use at each level, or None to use all data at all levels. The last level always uses
+     all data. The log-likelihood of a subset is scaled up to the length of all the data.
+    :type data_fractions: list[float] | None
+    :param processes: The number of processes of each Likelihood.
+    :type processes: int | None
+    :param memo_size: The memo size of each Likelihood.
+    :type memo_size: int | None
+    :param random_state: The source of random numbers for choosing the data subsets.
+    :type random_state: numpy.random.RandomState | None
+
+    :rtype: list[FidelityLevel]
+    """
+    if random_state is None:
+        random_state = numpy.random
+    # The subsets of the data are nested, so each level adds to the data of the level before.
+    order = random_state.permutation(len(forwarders))
+
+    def make_log_likelihood(level_arguments, indices):
+        model = make_model(*level_arguments)
+        if indices is None:
+            return Likelihood(model, forwarders, processes=processes, memo_size=memo_size)
+        return SubsetLikelihood(model, forwarders, indices, processes=processes, memo_size=memo_size)
+
+    levels = []
+    for level, fraction in enumerate(fidelity_fractions(no_levels, factor)):
+        level_arguments = tuple(coarse_intervals(argument, fraction) if index in interval_arguments else argument
+                                for index, argument in enumerate(arguments))
+        description = 'intervals={0}'.format(', '.join(str(level_arguments[index])
+                                                       for index in sorted(interval_arguments)))
+        indices = None
+        if data_fractions is not None and level < no_levels - 1 and data_fractions[level] < 1.0:
+            indices = subset_indices(forwarders, data_fractions[level], order)
+            description += ' data={0}/{1}'.format(len(indices), len(forwarders))
+        levels.append(FidelityLevel(functools.partial(make_log_likelihood, level_arguments, indices), description))
+    return levels
+
+
+class LevelResult(object):
+    """The outcome of the estimation at one level.
+
+    :ivar description: The description of the level.
+    :ivar estimate: The estimate at the level.
+    :ivar log_likelihood: The log-likelihood of the estimate at the level.
+    :ivar evaluations: The number of likelihood evaluations at the level.
+    :ivar elapsed: The time spent at the level, in seconds.
+    """
+
+    def __init__(self, description, estimate, log_likelihood, evaluations, elapsed):
+        self.description = description
+        self.estimate = estimate
+        self.log_likelihood = log_likelihood
+        self.evaluations = evaluations
+        self.elapsed = elapsed
+
+
+class MultiFidelityResult(object):
+    """The outcome of a multi-fidelity estimation.
+
+    :ivar levels: The result of each level, from the coarsest to the target.
+    """
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @property
+    def estimate(self):
+        """The estimate at the target resolution."""
+        return self.levels[-1].estimate
+
+    @property
+    def log_likelihood(self):
+        """The log-likelihood of the estimate at the target resolution."""
+        return self.levels[-1].log_likelihood
+
+    @property
+    def evaluations(self):
+        """The number of likelihood evaluations at all levels."""
+        return sum(level.evaluations for level in self.levels)
+
+
+class _CountedLikelihood(object):
+    """Log-likelihood wrapper counting the evaluations, also those in forked worker processes."""
+
+    def __init__(self, log_likelihood):
+        self.log_likelihood = log_likelihood
+        self.count = Value('i', 0)
+
+    def __call__(self, parameters):
+        with self.count.get_lock():
+            self.count.value += 1
+        return self.log_likelihood(parameters)
+
+
+def multi_fidelity_estimate(levels, initial_parameters,
+                            optimizer_method="Nelder-Mead",
+                            log_file=None,
+                            log_param_transform=lambda x: x,
+                            transform=None,
+                            processes=None):
+    """Maximum likelihood estimation from coarse to fine versions of a model.
+
+    The estimate at each level, found with maximum_likelihood_estimate, is the
+    starting point at the next level. The log-likelihoods of the levels before
+    the target are terminated once their estimate is found.
+
+    :param levels: The levels, from the coarsest to the target.
+    :type levels: list[FidelityLevel]
+    :param initial_parameters: The initial guess. Model specific.
+    :param optimizer_method: The scipy optimisation method.
+    :type optimizer_method: str
+    :param log_file: Progress at all levels will be logged to this file/stream.
+    :param log_param_transform: A function to map the model parameters for logging.
+    :param transform: The transform between model parameters and the space they are optimised in.
+    :type transform: IMCoalHMM.transforms.ParameterTransform | None
+    :param processes: The number of processes to compute finite-difference gradients in.
+    :type processes: int | None
+
+    :rtype: MultiFidelityResult
+    """
+    results = []
+    estimate = initial_parameters
+    for number, level in enumerate(levels):
+        try:
+            results.append(_estimate_level(level, estimate, optimizer_method, log_file, log_param_transform,
+                                           transform, processes))
+        finally:
+            if number < len(levels) - 1:
+                level.terminate()
+        estimate = results[-1].estimate
+    return MultiFidelityResult(results)
+
+
+def subsample_estimate(model, forwarders, initial_parameters,
+                       initial_fraction=0.1,
+                       growth=2.0,
+                       tolerance=0.01,
+                       optimizer_method="Nelder-Mead",
+                       log_file=None,
+                       log_param_transform=lambda x: x,
+                       transform=None,
+                       processes=None,
+                       likelihood_processes=None,
+                       memo_size=None,
+                       random_state=None,
+                       log_likelihood=None,
+                       full_data=True):
+    """Maximum likelihood estimation warm started on growing random subsets of the data.
+
+    The model is fitted to a random subset of the forwarders with the given fraction
+    of the sequence length, then to subsets growing by the given factor, each fit
+    starting from the estimate of the one before. Once the estimates of two
+    consecutive subsets agree within the tolerance, or the subset would cover all
+    the data, the fit continues on all the data.
+
+    :param model: The demographic model.
+    :type model: IMCoalHMM.model.Model
+    :param forwarders: The forwarders of the data.
+    :type forwarders: list[IMCoalHMM.hmm.Forwarder]
+    :param initial_parameters: The initial guess. Model specific.
+    :param initial_fraction: The fraction of the sequence length in the first subset.
+    :type initial_fraction: float
+    :param growth: The factor the subset grows by between fits.
+    :type growth: float
+    :param tolerance: The largest change of any parameter between the estimates of two
+     subsets for them to agree, in the optimisation space of the transform if one is given
+     and relative to the parameter otherwise.
+    :type tolerance: float
+    :param optimizer_method: The scipy optimisation method.
+    :type optimizer_method: str
+    :param log_file: Progress on all subsets will be logged to this file/stream.
+    :param log_param_transform: A function to map the model parameters for logging.
+    :param transform: The transform between model parameters and the space they are optimised in.
+    :type transform: IMCoalHMM.transforms.ParameterTransform | None
+    :param processes: The number of processes to compute finite-difference gradients in.
+    :type processes: int | None
+    :param likelihood_processes: The number of processes of each Likelihood.
+    :type likelihood_processes: int | None
+    :param memo_size: The memo size of each Likelihood.
+    :type memo_size: int | None
+    :param random_state: The source of random numbers for choosing the subsets.
+    :type random_state: numpy.random.RandomState | None
+    :param log_likelihood: The log-likelihood of all the data, or None to build it.
+    :type log_likelihood: IMCoalHMM.likelihood.Likelihood | None
+    :param full_data: Whether to finish with the fit on all the data. Without it the
+     estimate of the last subset is the result, e.g. as the starting point of an MCMC.
+    :type full_data: bool
+
+    :rtype: MultiFidelityResult
+    """
+    assert 0.0 < initial_fraction and growth > 1.0
+    if random_state is None:
+        random_state = numpy.random
+    order = random_state.permutation(len(forwarders))
+
+    results = []
+    estimate = initial_parameters
+    fraction = initial_fraction
+    while fraction < 1.0:
+        indices = subset_indices(forwarders, fraction, order)
+        if len(indices) == len(forwarders):
+            break
+        subset = SubsetLikelihood(model, forwarders, indices, processes=likelihood_processes, memo_size=memo_size)
+        try:
+            level = FidelityLevel(lambda: subset, 'data={0}/{1}'.format(len(indices), len(forwarders)))
+            results.append(_estimate_level(level, estimate, optimizer_method, log_file, log_param_transform,
+                                           transform, processes))
+        finally:
+            subset.terminate()
+        if len(results) > 1 and _agree(estimate, results[-1].estimate, transform, tolerance):
+            estimate = results[-1].estimate
+            break
+        estimate = results[-1].estimate
+        fraction *= growth
+
+    if full_data:
+        if log_likelihood is None:
+            log_likelihood = Likelihood(model, forwarders, processes=likelihood_processes, memo_size=memo_size)
+        level = FidelityLevel(lambda: log_likelihood, 'data={0}/{0}'.format(len(forwarders)))
+        results.append(_estimate_level(level, estimate, optimizer_method, log_file, log_param_transform,
+                                       transform, processes))
+    return MultiFidelityResult(results)
+
+
+def _estimate_level(level, initial_parameters, optimizer_method, log_file, log_param_transform,
+                    transform, processes):
+    """Run maximum_likelihood_estimate at one level, counting the evaluations.
+
+    :rtype: LevelResult
+    """
+    start = time.time()
+    counted = _CountedLikelihood(level.log_likelihood)
+    estimate = maximum_likelihood_estimate(counted, numpy.asarray(initial_parameters, dtype=float),
+                                           optimizer_method=optimizer_method,
+                                           log_file=log_file, log_param_transform=log_param_transform,
+                                           transform=transform, processes=processes)
+    return LevelResult(level.description, estimate, level.log_likelihood(estimate),
+                       counted.count.value, time.time() - start)
+
+
+def _agree(first, second, transform, tolerance):
+    """Whether two estimates agree within the tolerance.
+
+    :rtype: bool
+    """
+    first = numpy.asarray(first, dtype=float)
+    second = numpy.asarray(second, dtype=float)
+    if transform is not None:
+        return numpy.max(numpy.abs(transform.to_optimiser(first) - transform.to_optimiser(second))) < tolerance
+    scale = numpy.maximum(numpy.abs(first), numpy.finfo(float).tiny)
+    return numpy.max(numpy.abs(first - second) / scale) < tolerance
@@ -0,0 +1,238 @@
+"""Maximum likelihood estimation from several starting points.
+
+Local optimisers can get stuck in local optima, so the estimation is run from a
+number of starting points spread around the initial guess by a Latin hypercube
+design, and the best estimate is kept. The runs are spread over worker processes
+forked after the data is loaded, so they all share the one loaded dataset.
+
+All runs report the best log-likelihood they have seen, and a run that has
+fallen far behind the best of all runs is stopped early since it is not going
+to give the estimate.
+"""
+
+import numpy
+from multiprocessing import Pool, Value
+
+from IMCoalHMM.likelihood import maximum_likelihood_estimate
+
+# Runs are stopped when their best log-likelihood is this much below the best of all runs...
+DEFAULT_DOMINANCE = 100.0
+# ... after at least this many likelihood evaluations.
+DEFAULT_MIN_EVALUATIONS = 50
+
+
+def latin_hypercube(no_points, no_dimensions, random_state=None):
+    """Sample points in the unit hypercube such that each dimension, divided into
+    no_points equal slices, has exactly one point in each slice.
+
+    :param no_points: The number of points.
+    :type no_points: int
+    :param no_dimensions: The number of dimensions.
+    :type no_dimensions: int
+    :param random_state: The source of random numbers.
+    :type random_state: numpy.random.RandomState | None
+
+    :returns: the points as the rows of a no_points x no_dimensions array.
+    :rtype: numpy.ndarray
+    """
+    if random_state is None:
+        random_state = numpy.random
+    points = (random_state.random_sample((no_points, no_dimensions)) + numpy.arange(no_points)[:, None]) / no_points
+    for dimension in xrange(no_dimensions):
+        points[:, dimension] = points[random_state.permutation(no_points), dimension]
+    return points
+
+
+def starting_points(initial_parameters, no_starts, spread, transform=None, random_state=None):
+    """Spread starting points around an initial guess.
+
+    The first point is the initial guess itself. The others are placed by a Latin
+    hypercube design in a box of half-width spread around the guess in the
+    optimisation space of the transform, or on a log scale if there is no
+    transform, so a spread of log(10) gives points between a tenth and ten times
+    each parameter.
+
+    :param initial_parameters: The initial guess.
+    :param no_starts: The number of starting points.
+    :type no_starts: int
+    :param spread: The half-width of the box.
+    :type spread: float
+    :param transform: The transform of the parameters used in the optimisation.
+    :type transform: IMCoalHMM.transforms.ParameterTransform | None
+    :param random_state: The source of random numbers.
+    :type random_state: numpy.random.RandomState | None
+
+    :returns: the starting points, in model parameters, as rows.
+    :rtype: numpy.ndarray
+    """
+    initial_parameters = numpy.asarray(initial_parameters, dtype=float)
+    if transform is None:
+        centre = numpy.log(initial_parameters)
+    else:
+        centre = transform.to_optimiser(initial_parameters)
+
+    offsets = spread * (2.0 * latin_hypercube(no_starts - 1, len(centre), random_state) - 1.0)
+    points = [initial_parameters]
+    for offset in offsets:
+        if transform is None:
+            points.append(numpy.exp(centre + offset))
+        else:
+            points.append(transform.from_optimiser(centre + offset))
+    return numpy.array(points)
+
+
+class StartResult(object):
+    """The outcome of the estimation from one starting point.
+
+    :ivar start: The starting point.
+    :ivar estimate: The best point the run evaluated, normally the one the optimiser ended in.
+    :ivar log_likelihood: The log-likelihood of the estimate.
+    :ivar trace: The parameters and log-likelihood of every evaluation of the run.
+    :ivar dominated: True if the run was stopped because other runs were far better.
+    """
+
+    def __init__(self, start, estimate, log_likelihood, trace, dominated):
+        self.start = start
+        self.estimate = estimate
+        self.log_likelihood = log_likelihood
+        self.trace = trace
+        self.dominated = dominated
+
+    @property
+    def evaluations(self):
+        """The number of likelihood evaluations of the run."""
+        return len(self.trace)
+
+
+class MultiStartResult(object):
+    """The outcome of a multi-start estimation.
+
+    :ivar runs: The result of each start, in the order of the starting points.
+    """
+
+    def __init__(self, runs):
+        self.runs = runs
+        self.best = max(runs, key=lambda run: run.log_likelihood)
+
+    @property
+    def estimate(self):
+        """The best estimate of all runs."""
+        return self.best.estimate
+
+    @property
+    def log_likelihood(self):
+        """The log-likelihood of the best estimate."""
+        return self.best.log_likelihood
+
+
+class _DominatedStart(Exception):
+    """Raised inside the optimiser to stop a run that is far behind the others."""
+    pass
+
+
+class _TracedLikelihood(object):
+    """Log-likelihood wrapper that records the evaluations of a run and stops it
+    when it is dominated by the best of all runs."""
+
+    def __init__(self, log_likelihood, best_so_far, dominance, min_evaluations):
+        self.log_likelihood = log_likelihood
+        self.best_so_far = best_so_far
+        self.dominance = dominance
+        self.min_evaluations = min_evaluations
+        self.trace = []
+        self.best = None
+
+    def __call__(self, parameters):
+        value = self.log_likelihood(parameters)
+        self.trace.append((numpy.array(parameters), value))
+        if self.best is None or value > self.trace[self.best][1]:
+            self.best = len(self.trace) - 1
+            with self.best_so_far.get_lock():
+                if value > self.best_so_far.value:
+                    self.best_so_far.value = value
+
+        if (self.dominance is not None and len(self.trace) >= self.min_evaluations and
+                self.trace[self.best][1] < self.best_so_far.value - self.dominance):
+            raise _DominatedStart()
+        return value
+
+
+# The state of a multi-start estimation, set before the worker processes are forked
+# so they inherit it, data and all, instead of having it sent to them.
+_multi_start_state = None
+
+
+def _run_start(start):
+    log_likelihood, best_so_far, options = _multi_start_state
+    traced = _TracedLikelihood(log_likelihood, best_so_far, options['dominance'], options['min_evaluations'])
+    # The best evaluation is recorded in the trace, so the estimate is not evaluated again.
+    try:
+        maximum_likelihood_estimate(traced, start, optimizer_method=options['optimizer_method'],
+                                    transform=options['transform'])
+        dominated = False
+    except _DominatedStart:
+        dominated = True
+    estimate, value = traced.trace[traced.best]
+    return StartResult(start, estimate, value, traced.trace, dominated)
+
+
+def multi_start_estimate(log_likelihood, initial_parameters, no_starts,
+                         spread=numpy.log(10.0),
+                         optimizer_method="Nelder-Mead",
+                         transform=None,
+                         processes=None,
+                         dominance=DEFAULT_DOMINANCE,
+                         min_evaluations=DEFAULT_MIN_EVALUATIONS,
+                         random_state=None):
+    """Maximum likelihood estimation from several starting points.
+
+    The starting points are the initial guess and points spread around it, see
+    starting_points. From each, the estimate is found with
+    maximum_likelihood_estimate, and the runs are spread over the given number
+    of processes. The log-likelihood should not use worker processes of its own
+    then; the runs are already evaluated in parallel.
+
+    :param log_likelihood: The Likelihood wrapper needed for computing the likelihood.
+    :type log_likelihood: IMCoalHMM.likelihood.Likelihood
+    :param initial_parameters: The initial guess. Model specific.
+    :param no_starts: The number of starting points.
+    :type no_starts: int
+    :param spread: The half-width of the box the starting points are spread in,
+     in the optimisation space.
+    :type spread: float
+    :param optimizer_method: The scipy optimisation method of each run.
+    :type optimizer_method: str
+    :param transform: The transform between model parameters and the space they are optimised in.
+    :type transform: IMCoalHMM.transforms.ParameterTransform | None
+    :param processes: The number of processes to run the starts in.
+    :type processes: int | None
+    :param dominance: Runs whose best log-likelihood is this much below the best of
+     all runs are stopped, or None to always run to the end.
+    :type dominance: float | None
+    :param min_evaluations: The number of evaluations a run gets before it can be stopped.
+    :type min_evaluations: int
+    :param random_state: The source of random numbers for the starting points.
+    :type random_state: numpy.random.RandomState | None
+
+    :rtype: MultiStartResult
+    """
+    global _multi_start_state
+    starts = starting_points(initial_parameters, no_starts, spread, transform, random_state)
+    best_so_far = Value('d', -float('inf'))
+    options = {'optimizer_method': optimizer_method, 'transform': transform,
+               'dominance': dominance, 'min_evaluations': min_evaluations}
+
+    _multi_start_state = log_likelihood, best_so_far, options
+    try:
+        if processes is None or processes <= 1:
+            runs = [_run_start(start) for start in starts]
+        else:
+            pool = Pool(processes)
+            try:
+                runs = pool.map(_run_start, starts, chunksize=1)
+            finally:
+                pool.terminate()
+    finally:
+        _multi_start_state = None
+
+    return MultiStartResult(runs)
@@ -0,0 +1,190 @@
+"""Code for preprocessing observation sequences before they are handed to the
+forward algorithm.
+
+Alignments prepared for CoalHMM contain long stretches of a single symbol --
+typically missing data (2) or identical sites (0) in pairwise alignments. Such
+stretches are run-length encoded here, so the forward algorithm can move
+through a run of length r with a handful of matrix products rather than
+r matrix-vector products. Very long runs of missing data are instead cut out,
+splitting an alignment into independent segments.
+"""
+
+import os
+import numpy as np
+
+# Runs shorter than this are left for the ziphmm pair compression to handle.
+DEFAULT_MIN_RUN_LENGTH = 1000
+
+
+def run_length_encode(obs, no_symbols, min_run_length=DEFAULT_MIN_RUN_LENGTH):
+    """Replace long runs of a single symbol with run symbols.
+
+    A run of length r of symbol s is written as one new symbol for each bit set
+    in the binary representation of r; the new symbol for bit k stands for
+    2**k consecutive occurrences of s, so its transition matrix can be computed
+    by k squarings of the matrix for s. The first observation is always left
+    as it is since the forward algorithm emits it directly from the initial
+    probabilities.
+
+    :param obs: The observation sequence.
+    :type obs: numpy.ndarray
+    :param no_symbols: The size of the alphabet of obs. New symbols are
+     numbered from here.
+    :type no_symbols: int
+    :param min_run_length: Runs shorter than this are kept as they are.
+     If None, no encoding is done.
+    :type min_run_length: int | None
+
+    :returns: the encoded observation sequence together with a list mapping
+     each new symbol, counting from no_symbols, to a (symbol, exponent) pair.
+    :rtype: (numpy.ndarray, list[(int, int)])
+    """
+    obs = np.asarray(obs, dtype=np.int32)
+    if min_run_length is None or len(obs) < 2:
+        return obs, []
+
+    boundaries = np.flatnonzero(obs[1:] != obs[:-1]) + 1
+    starts = np.concatenate(([1], boundaries))
+    ends = np.concatenate((boundaries, [len(obs)]))
+    long_runs = np.flatnonzero(ends - starts >= max(min_run_length, 1))
+    if len(long_runs) == 0:
+        return obs, []
+
+    run_symbols = {}
+    pieces = []
+    previous_end = 0
+    for run in long_runs:
+        start, end = starts[run], ends[run]
+        pieces.append(obs[previous_end:start])
+
+        symbol, length, exponent = int(obs[start]), end - start, 0
+        codes = []
+        while length:
+            if length & 1:
+                codes.append(run_symbols.setdefault((symbol, exponent), no_symbols + len(run_symbols)))
+            length >>= 1
+            exponent += 1
+        pieces.append(np.array(codes, dtype=np.int32))
+        previous_end = end
+    pieces.append(obs[previous_end:])
+
+    symbol_table = [None] * len(run_symbols)
+    for run_symbol, code in run_symbols.items():
+        symbol_table[code - no_symbols] = run_symbol
+
+    return np.concatenate(pieces), symbol_table
+
+
+def run_length_decode(obs, no_symbols, run_symbols):
+    """Expand the run symbols in a run-length encoded sequence.
+
+    :param obs: An encoded observation sequence.
+    :type obs: numpy.ndarray
+    :param no_symbols: The size of the alphabet of the original sequence.
+    :type no_symbols: int
+    :param run_symbols: The (symbol, exponent) table from run_length_encode.
+    :type run_symbols: list[(int, int)]
+
+    :returns: the original observation sequence.
+    :rtype: numpy.ndarray
+    """
+    obs = np.asarray(obs, dtype=np.int32)
+    if not run_symbols:
+        return obs
+    symbols = np.array([s for s, _ in run_symbols], dtype=np.int32)
+    lengths = np.array([2 ** k for _, k in run_symbols], dtype=np.int64)
+
+    is_run = obs >= no_symbols
+    repeats = np.ones(len(obs), dtype=np.int64)
+    repeats[is_run] = lengths[obs[is_run] - no_symbols]
+    decoded = obs.copy()
+    decoded[is_run] = symbols[obs[is_run] - no_symbols]
+    return np.repeat(decoded, repeats)
+
+
+## Splitting alignments into segments ################################
+
+# The symbol used for missing data in pairwise alignments.
+MISSING_SYMBOL = 2
+
+# Name of the index file in a segment directory.
+SEGMENT_INDEX = 'segments.txt'
+
+
+def find_segments(obs, min_gap_length, missing_symbol=MISSING_SYMBOL):
+    """Find the stretches of an observation sequence between long runs of missing data.
+
+    Runs of missing data at least min_gap_length long are left out; the HMM
+    has forgotten where it was long before it gets through one of those, so the
+    stretches on either side can be treated as independent sequences that each
+    start from the stationary distribution.
+
+    :param obs: The observation sequence.
+    :type obs: numpy.ndarray
+    :param min_gap_length: The shortest run of missing data to split at.
+    :type min_gap_length: int
+    :param missing_symbol: The symbol used for missing data.
+    :type missing_symbol: int
+
+    :returns: a list of (start, end) half-open intervals of the segments.
+    :rtype: list[(int, int)]
+    """
+    obs = np.asarray(obs)
+    padded = np.concatenate(([False], obs == missing_symbol, [False]))
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    gap_starts, gap_ends = edges[0::2], edges[1::2]
+    is_long = gap_ends - gap_starts >= min_gap_length
+    segment_starts = np.concatenate(([0], gap_ends[is_long]))
+    segment_ends = np.concatenate((gap_starts[is_long], [len(obs)]))
+    return [(int(start), int(end)) for start, end in zip(segment_starts, segment_ends) if end > start]
+
+
+def read_observations(filename):
+    """Read an observation sequence in the text format used for ziphmm."""
+    with open(filename) as infile:
+        return np.fromstring(infile.read(), dtype=np.int32, sep=' ')
+
+
+def write_observations(filename, obs):
+    """Write an observation sequence in the text format used for ziphmm."""
+    np.savetxt(filename, np.asarray(obs).reshape(1, -1), fmt='%d', delimiter=' ', newline='')
+
+
+def is_segment_directory(path):
+    """Check if path is a directory of segments written by write_segment_directory."""
+    return os.path.isdir(path) and os.path.exists(os.path.join(path, SEGMENT_INDEX))
+
+
+def write_segment_directory(directory, segments):
+    """Write segments to a directory, one observation file per segment plus an index.
+
+    :param directory: The directory to write to. It is created if it doesn't exist.
+    :type directory: str
+    :param segments: The segments as (chromosome, start, observations) triples.
+    :type segments: list[(str, int, numpy.ndarray)]
+    """
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(os.path.join(directory, SEGMENT_INDEX), 'w') as index:
+        print >> index, '\t'.join(['#file', 'chromosome', 'start', 'length'])
+        for segment_no, (chromosome, start, obs) in enumerate(segments):
+            filename = 'segment-{0:05d}.txt'.format(segment_no)
+            write_observations(os.path.join(directory, filename), obs)
+            print >> index, '\t'.join(map(str, [filename, chromosome, start, len(obs)]))
+
+
+def read_segment_index(directory):
+    """Read the index of a segment directory.
+
+    :returns: a list of (filename, chromosome, start, length) tuples, with the
+     filenames including the directory.
+    :rtype: list[(str, str, int, int)]
+    """
+    segments = []
+    with open(os.path.join(directory, SEGMENT_INDEX)) as index:
+        for line in index:
+            if line.startswith('#') or not line.strip():
+                continue
+            filename, chromosome, start, length = line.split()
+            segments.append((os.path.join(directory, filename), chromosome, int(start), int(length)))
+    return segments
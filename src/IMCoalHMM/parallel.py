@@ -0,0 +1,103 @@
+"""Evaluating a function, typically a log-likelihood, at many points in parallel.
+
+The worker processes are forked when the pool is created and inherit the
+function together with everything it refers to, such as the loaded data, so
+only the points and the values are sent between processes. The function
+should not use worker processes of its own.
+"""
+
+from multiprocessing import Pool
+from Queue import Queue
+
+# The functions of the pools, set before their worker processes are forked and kept
+# while the pools live, in case a worker process needs replacing.
+_pool_functions = dict()
+_next_pool_key = [0]
+
+
+def _evaluate(job):
+    key, point = job
+    return _pool_functions[key](point)
+
+
+def _evaluate_reporting_errors(job):
+    # Asynchronous evaluations only report back through a callback, which is not
+    # called for an exception, so exceptions are returned instead.
+    try:
+        return True, _evaluate(job)
+    except Exception as ex:
+        return False, ex
+
+
+class EvaluationPool(object):
+    """A pool of worker processes evaluating a function.
+
+    With no more than one process the function is evaluated in this process, so
+    code using the pool does not need a special case for serial evaluation.
+    """
+
+    def __init__(self, function, processes=None):
+        """
+        :param function: The function to evaluate. It takes a single point.
+        :param processes: The number of worker processes.
+        :type processes: int | None
+        """
+        self.function = function
+        self.processes = processes if processes is not None and processes > 1 else 1
+        self.results = Queue()
+        self.pending = 0
+
+        self.key = _next_pool_key[0]
+        _next_pool_key[0] += 1
+        self.pool = None
+        if self.processes > 1:
+            _pool_functions[self.key] = function
+            self.pool = Pool(self.processes)
+
+    def map(self, points):
+        """Evaluate the function at all the points.
+
+        :returns: the values in the order of the points.
+        :rtype: list
+        """
+        if self.pool is None:
+            return [self.function(point) for point in points]
+        return self.pool.map(_evaluate, [(self.key, point) for point in points], chunksize=1)
+
+    def submit(self, tag, point):
+        """Start evaluating the function at a point. The value is collected with next_result.
+
+        :param tag: Anything identifying the evaluation to the caller.
+        """
+        self.pending += 1
+        if self.pool is None:
+            self.results.put((tag, (True, self.function(point))))
+        else:
+            self.pool.apply_async(_evaluate_reporting_errors, ((self.key, point),),
+                                  callback=lambda result: self.results.put((tag, result)))
+
+    def next_result(self):
+        """Wait for the next submitted evaluation to finish, in the order they finish.
+
+        :returns: the tag and the value of the evaluation.
+        """
+        if self.pending == 0:
+            raise ValueError('No evaluations are pending.')
+        self.pending -= 1
+        tag, (succeeded, value) = self.results.get()
+        if not succeeded:
+            raise value
+        return tag, value
+
+    def terminate(self):
+        """Stop the worker processes, if any."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+            del _pool_functions[self.key]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.terminate()
@@ -6,6 +6,10 @@ import datetime
 import math
 import random
 
+import numpy
+
+from IMCoalHMM.parallel import EvaluationPool
+
 
 class Solution(object):
     """
@@ -29,19 +33,100 @@ class Solution(object):
         return 'fitness:{0} positions:[{1}]'.format(self.fitness, token)
 
 
+class Swarm(object):
+    """
+    The state of all particles in a swarm, stored in arrays with a row for each particle so the optimiser can update
+    the particles together.
+    """
+
+    def __init__(self, particle_count, parameter_count):
+        """
+        Initialise a new instance of the class with all positions, velocities, and fitness set to zero.
+        :param particle_count: The number of particles in the swarm.
+        :param parameter_count: The number of dimensions in the problem domain.
+        :return: A new instance of the class.
+        """
+        self.positions = numpy.zeros((particle_count, parameter_count))
+        self.velocities = numpy.zeros((particle_count, parameter_count))
+        self.fitness = numpy.zeros(particle_count)
+        self.best_positions = numpy.zeros((particle_count, parameter_count))
+        self.best_fitness = numpy.zeros(particle_count)
+
+    def __len__(self):
+        """
+        Return the number of particles in the swarm.
+        :return: The number of particles in the swarm.
+        """
+        return len(self.fitness)
+
+    def update_bests(self, indices):
+        """
+        Update the best-known positions of the specified particles to their current positions where these are fitter.
+        :param indices: An array of indices of particles.
+        :return: None
+        """
+        improved = indices[self.fitness[indices] > self.best_fitness[indices]]
+        self.best_fitness[improved] = self.fitness[improved]
+        self.best_positions[improved] = self.positions[improved]
+
+
+class _SolutionView(Solution):
+    """
+    A solution whose positions and fitness are a row of the arrays of a swarm.
+    """
+
+    def __init__(self, positions, fitness, index):
+        """
+        Initialise a new instance of the class.
+        :param positions: The array of positions of the swarm.
+        :param fitness: The array of fitness of the swarm.
+        :param index: The index of the particle in the arrays.
+        :return: A new instance of the class.
+        """
+        self.__positions = positions
+        self.__fitness = fitness
+        self.__index = index
+
+    @property
+    def positions(self):
+        """
+        Return the positions of this instance.
+        :return: A tuple of the positions of this instance.
+        """
+        return tuple(self.__positions[self.__index].tolist())
+
+    @positions.setter
+    def positions(self, value):
+        self.__positions[self.__index] = value
+
+    @property
+    def fitness(self):
+        """
+        Return the fitness of this instance.
+        :return: The fitness of this instance.
+        """
+        return float(self.__fitness[self.__index])
+
+    @fitness.setter
+    def fitness(self, value):
+        self.__fitness[self.__index] = value
+
+
 class Particle(object):
     """
-    Implementation of one particle in a swarm.
+    Implementation of one particle in a swarm, viewing its row of the arrays of the swarm.
     """
 
-    def __init__(self):
+    def __init__(self, swarm, index):
         """
         Initialise a new instance of the class.
+        :param swarm: The swarm of the particle.
+        :param index: The index of the particle in the swarm.
         :return: A new instance of the class.
         """
-        self.best = Solution()
-        self.current = Solution()
-        self.velocities = []
+        self.best = _SolutionView(swarm.best_positions, swarm.best_fitness, index)
+        self.current = _SolutionView(swarm.positions, swarm.fitness, index)
+        self.velocities = swarm.velocities[index]
 
 
 class ExitCondition(object):
@@ -50,10 +135,27 @@ class ExitCondition(object):
     """
 
     ABORT = 'ABORT'
+    CONVERGED = 'CONVERGED'
     ITERATIONS = 'ITERATIONS'
+    STALLED = 'STALLED'
     TIMEOUT = 'TIMEOUT'
 
 
+class EvaluationMode(object):
+    """
+    A class providing descriptions for how the fitness of the particles is evaluated.
+
+    SERIAL evaluates one particle at a time, each moving with the swarm's best position as updated by the particles
+    before it. SYNCHRONOUS moves all particles, evaluates the whole swarm in parallel and then updates the best
+    positions. ASYNCHRONOUS moves and re-dispatches each particle as soon as its evaluation returns, so slow
+    evaluations do not leave the other processes idle; an iteration then counts as one evaluation per particle.
+    """
+
+    SERIAL = 'serial'
+    SYNCHRONOUS = 'synchronous'
+    ASYNCHRONOUS = 'asynchronous'
+
+
 class Context(object):
     """
     Context information for the Particle Swarm optimiser; this instance is passed to the optional log method and
@@ -70,11 +172,15 @@ class Context(object):
 
         self.aborted = False
         self.best = Solution()
+        self.diversity = None
         self.elapsed = datetime.timedelta(seconds=0)
         self.exit_condition = None
         self.iteration = 0
         self.optimiser = optimiser
         self.particles = []
+        self.reference_fitness = float('-inf')
+        self.stalled_iterations = 0
+        self.swarm = None
         self.start = datetime.datetime.now()
 
 
@@ -86,29 +192,45 @@ class Optimiser(object):
     def __init__(self):
         """
         Initialise a new instance of the class, setting the maximum number of iterations to 500, no maximum execution
-        time, the particle count to 100, the phi_particle to 0.3, the phi_swarm to 0.1, the omega to 0.9, and the
-        maximum initial velocity to 0.02.
+        time, the particle count to 100, the phi_particle to 0.3, the phi_swarm to 0.1, the omega to 0.9, the
+        maximum initial velocity to 0.02, and serial evaluation of the particles.
+
+        By default, the optimisation does not stop early.  With a stall iteration count, it stops once the best
+        fitness has not improved by more than the stall tolerance for that many iterations; with a minimum diversity,
+        it stops once the mean standard deviation of the particle positions over the dimensions of the unit hypercube
+        falls below it.
         :return: A new instance of the class.
         """
+        self.evaluation = EvaluationMode.SERIAL
+        self.processes = None
         self.omega = 0.9
         self.phi_particle = 0.3
         self.phi_swarm = 0.1
         self.log = None
         self.max_iterations = 500
         self.max_initial_velocity = 0.02
+        self.min_diversity = None
         self.particle_count = 100
+        self.stall_iterations = None
+        self.stall_tolerance = 0.0
         self.timeout = None
 
-    def maximise(self, fitness_function, parameter_count):
+    def maximise(self, fitness_function, parameter_count, batch_fitness_function=None):
         """
         Attempt to find a maximum set of values for a specified fitness function; the number of dimensions in the
         problem domain is represented by the specified parameter count.
+
+        Unless the evaluation mode is serial, the fitness is evaluated in a pool of the configured number of worker
+        processes, forked when the optimisation starts. In synchronous mode, a batch fitness function can instead
+        evaluate the whole swarm at once.
         :param fitness_function: The fitness function to maximise.
         :param parameter_count: the number of dimensions in the problem domain.
+        :param batch_fitness_function: An optional function returning the fitness of each of a list of positions.
         :return: An instance of type Context that encapsulates the final state of the algorithm.
         """
         assert hasattr(fitness_function, '__call__')
         assert parameter_count > 0
+        assert self.evaluation in (EvaluationMode.SERIAL, EvaluationMode.SYNCHRONOUS, EvaluationMode.ASYNCHRONOUS)
 
         def fitness_function_wrapper(parameters):
             fitness = fitness_function(parameters)
@@ -116,91 +238,196 @@ class Optimiser(object):
                 fitness = float('-inf')
             return fitness
 
-        context = Context(self)
-
-        # Create the initial particles.
-        for _ in xrange(self.particle_count):
-            particle = Particle()
-            context.particles.append(particle)
-
-            # Initialise the particle's position with a uniformly distributed random vector.
-            particle.current.positions = [random.uniform(0.0, 1.0) for _ in xrange(parameter_count)]
-            particle.current.fitness = fitness_function_wrapper(tuple(particle.current.positions))
-
-            # Initialise the particle's best known position to its initial position.
-            particle.best.positions = tuple(particle.current.positions)
-            particle.best.fitness = particle.current.fitness
-
-            # Initialise the particle's velocity.
-            initialise_velocity = lambda: random.uniform(
-                -self.max_initial_velocity,
-                +self.max_initial_velocity)
-            particle.velocities = [initialise_velocity() for _ in xrange(parameter_count)]
-
-        # Initially assign the best solution for the swarm.
-        context.best.fitness = context.particles[0].best.fitness
-        context.best.positions = context.particles[0].best.positions
-        for particle in context.particles[1:]:
-            if context.best.fitness is None or particle.best.fitness > context.best.fitness:
-                context.best.fitness = particle.best.fitness
-                context.best.positions = particle.best.positions
+        pool = None
+        if self.evaluation == EvaluationMode.SERIAL:
+            def evaluate_swarm(positions):
+                return [fitness_function_wrapper(p) for p in positions]
+        elif batch_fitness_function is not None and self.evaluation == EvaluationMode.SYNCHRONOUS:
+            def evaluate_swarm(positions):
+                return [float('-inf') if math.isnan(fitness) else fitness
+                        for fitness in batch_fitness_function(positions)]
+        else:
+            pool = EvaluationPool(fitness_function_wrapper, self.processes)
+            evaluate_swarm = pool.map
+
+        try:
+            context = Context(self)
+            swarm = context.swarm = Swarm(self.particle_count, parameter_count)
+            context.particles = [Particle(swarm, i) for i in xrange(self.particle_count)]
+
+            # Initialise the particles' positions with uniformly distributed random vectors, and their velocities.
+            for i in xrange(self.particle_count):
+                swarm.positions[i] = [random.uniform(0.0, 1.0) for _ in xrange(parameter_count)]
+                swarm.velocities[i] = [random.uniform(-self.max_initial_velocity, +self.max_initial_velocity)
+                                       for _ in xrange(parameter_count)]
+            swarm.fitness[:] = evaluate_swarm(self.__parameters(swarm, xrange(self.particle_count)))
+
+            # Initialise the particles' best known positions to their initial positions.
+            swarm.best_positions[:] = swarm.positions
+            swarm.best_fitness[:] = swarm.fitness
+
+            # Initially assign the best solution for the swarm.
+            self.__set_swarm_best(context, int(numpy.argmax(swarm.best_fitness)))
+
+            if self.evaluation == EvaluationMode.SERIAL:
+                return self.__maximise_serial(context, fitness_function_wrapper)
+            if self.evaluation == EvaluationMode.SYNCHRONOUS:
+                return self.__maximise_synchronous(context, evaluate_swarm)
+            return self.__maximise_asynchronous(context, pool)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def __maximise_serial(self, context, fitness_function_wrapper):
+        swarm = context.swarm
+        best_positions = numpy.array(context.best.positions)
 
         # Loop until an exit condition occurs.
-        while True:
+        while not self.__iteration_done(context):
 
-            # Log the iteration before it's lost forever.
-            context.elapsed = datetime.datetime.now() - context.start
-            context.iteration += 1
-            self.__log(context)
+            # Loop over all particles in the swarm, each moving with the swarm's best position as it is now.
+            for i in xrange(self.particle_count):
+                r_particle, r_swarm = self.__random_coefficients(1)
+                swarm.positions[i] = self.__move(swarm, i, r_particle, r_swarm, best_positions)
 
-            # Check for exit conditions.
-            if context.aborted:
-                context.exit_condition = ExitCondition.ABORT
-                return context
-            if self.max_iterations is not None and context.iteration >= self.max_iterations:
-                context.exit_condition = ExitCondition.ITERATIONS
-                return context
-            if self.timeout is not None and context.elapsed > self.timeout:
-                context.exit_condition = ExitCondition.TIMEOUT
+                # Compute a new fitness for the particle.
+                swarm.fitness[i] = fitness_function_wrapper(self.__parameters(swarm, [i])[0])
+                if swarm.fitness[i] > swarm.best_fitness[i]:
+                    swarm.best_fitness[i] = swarm.fitness[i]
+                    swarm.best_positions[i] = swarm.positions[i]
+                    if swarm.best_fitness[i] > context.best.fitness:
+                        self.__set_swarm_best(context, i)
+                        best_positions = swarm.best_positions[i].copy()
+
+        return context
+
+    def __maximise_synchronous(self, context, evaluate_swarm):
+        swarm = context.swarm
+        indices = numpy.arange(self.particle_count)
+        while not self.__iteration_done(context):
+
+            # Move all particles with the swarm's best position from the previous iteration, then evaluate them.
+            r_particle, r_swarm = self.__random_coefficients(self.particle_count)
+            swarm.positions[:] = self.__move(swarm, indices, r_particle, r_swarm, numpy.array(context.best.positions))
+            swarm.fitness[:] = evaluate_swarm(self.__parameters(swarm, indices))
+
+            swarm.update_bests(indices)
+            i = int(numpy.argmax(swarm.best_fitness))
+            if swarm.best_fitness[i] > context.best.fitness:
+                self.__set_swarm_best(context, i)
+
+        return context
+
+    def __maximise_asynchronous(self, context, pool):
+        swarm = context.swarm
+        if self.__iteration_done(context):
+            return context
+
+        # The positions being evaluated for each particle; a particle keeps its current position until then.
+        moved_positions = {}
+        best_positions = numpy.array(context.best.positions)
+        for i in xrange(self.particle_count):
+            r_particle, r_swarm = self.__random_coefficients(1)
+            moved_positions[i] = self.__move(swarm, i, r_particle, r_swarm, best_positions)
+            pool.submit(i, tuple(moved_positions[i].tolist()))
+
+        evaluations = 0
+        while True:
+            i, fitness = pool.next_result()
+            swarm.positions[i] = moved_positions.pop(i)
+            swarm.fitness[i] = fitness
+            if swarm.fitness[i] > swarm.best_fitness[i]:
+                swarm.best_fitness[i] = swarm.fitness[i]
+                swarm.best_positions[i] = swarm.positions[i]
+                if swarm.best_fitness[i] > context.best.fitness:
+                    self.__set_swarm_best(context, i)
+                    best_positions = swarm.best_positions[i].copy()
+
+            # Every particle_count evaluations make an iteration.
+            evaluations += 1
+            if evaluations % self.particle_count == 0 and self.__iteration_done(context):
                 return context
 
-            # Loop over all particles in the swarm.
-            for particle in context.particles:
-
-                # Pick two random numbers that will be applied to each velocity.
-                r_particle = random.uniform(0.0, 1.0)
-                r_swarm = random.uniform(0.0, 1.0)
-
-                # Loop over all positions and velocities.
-                for i in xrange(parameter_count):
-                    velocity = particle.velocities[i]
-                    position = particle.current.positions[i]
-                    best_particle_position = particle.best.positions[i]
-                    best_swarm_position = context.best.positions[i]
-
-                    # Update the particle's velocity.
-                    new_velocity = 0.0
-                    new_velocity += self.omega * velocity
-                    new_velocity += self.phi_particle * r_particle * (best_particle_position - position)
-                    new_velocity += self.phi_swarm * r_swarm * (best_swarm_position - position)
-                    particle.velocities[i] = new_velocity
+            # Send the particle off again with the swarm's best position as it is now.
+            r_particle, r_swarm = self.__random_coefficients(1)
+            moved_positions[i] = self.__move(swarm, i, r_particle, r_swarm, best_positions)
+            pool.submit(i, tuple(moved_positions[i].tolist()))
 
-                    # Update the particle's position
-                    particle.current.positions[i] += new_velocity
+    @staticmethod
+    def __parameters(swarm, indices):
+        # The fitness function takes the positions as a tuple of floats.
+        return [tuple(swarm.positions[i].tolist()) for i in indices]
 
-                # Compute a new fitness for the particle.
-                particle.current.fitness = fitness_function_wrapper(tuple(particle.current.positions))
-
-                # Update the particle's best-known position.
-                if particle.current.fitness > particle.best.fitness:
-                    particle.best.fitness = particle.current.fitness
-                    particle.best.positions = tuple(particle.current.positions)
+    @staticmethod
+    def __random_coefficients(count):
+        """
+        Pick the two random numbers applied to the velocities of each of a number of particles.
+        :return: The numbers for the particles' best positions and the swarm's best position; numbers for one
+        particle, or columns of numbers for several.
+        """
+        coefficients = [(random.uniform(0.0, 1.0), random.uniform(0.0, 1.0)) for _ in xrange(count)]
+        if count == 1:
+            return coefficients[0]
+        coefficients = numpy.array(coefficients)
+        return coefficients[:, 0:1], coefficients[:, 1:2]
 
-                    # Update the swarm's best-known position.
-                    if particle.best.fitness > context.best.fitness:
-                        context.best.fitness = particle.best.fitness
-                        context.best.positions = particle.best.positions
+    def __move(self, swarm, indices, r_particle, r_swarm, best_positions):
+        """
+        Update the velocities of one or more particles of a swarm and compute their new positions.
+        :return: The new positions.
+        """
+        positions = swarm.positions[indices]
+        velocities = self.omega * swarm.velocities[indices]
+        velocities += self.phi_particle * r_particle * (swarm.best_positions[indices] - positions)
+        velocities += self.phi_swarm * r_swarm * (best_positions - positions)
+        swarm.velocities[indices] = velocities
+        return positions + velocities
+
+    @staticmethod
+    def __set_swarm_best(context, index):
+        context.best.fitness = float(context.swarm.best_fitness[index])
+        context.best.positions = tuple(context.swarm.best_positions[index].tolist())
+
+    def __iteration_done(self, context):
+        """
+        Log the finished iteration and check for exit conditions.
+        :return: True if the optimisation should stop, with the exit condition set in the context.
+        """
+        # Measure the progress of the swarm.
+        context.diversity = _diversity(context.swarm.positions)
+        if context.best.fitness > context.reference_fitness + self.stall_tolerance:
+            context.reference_fitness = context.best.fitness
+            context.stalled_iterations = 0
+        else:
+            context.stalled_iterations += 1
+
+        # Log the iteration before it's lost forever.
+        context.elapsed = datetime.datetime.now() - context.start
+        context.iteration += 1
+        self.__log(context)
+
+        # Check for exit conditions.
+        if context.aborted:
+            context.exit_condition = ExitCondition.ABORT
+        elif self.max_iterations is not None and context.iteration >= self.max_iterations:
+            context.exit_condition = ExitCondition.ITERATIONS
+        elif self.timeout is not None and context.elapsed > self.timeout:
+            context.exit_condition = ExitCondition.TIMEOUT
+        elif self.stall_iterations is not None and context.stalled_iterations >= self.stall_iterations:
+            context.exit_condition = ExitCondition.STALLED
+        elif self.min_diversity is not None and context.diversity < self.min_diversity:
+            context.exit_condition = ExitCondition.CONVERGED
+        return context.exit_condition is not None
 
     def __log(self, context):
         if self.log is not None:
             self.log(context)
+
+
+def _diversity(positions):
+    """
+    Measure the diversity of a set of positions in the unit hypercube.
+    :param positions: An array of positions, one per row.
+    :return: The mean over the dimensions of the standard deviation of the positions.
+    """
+    return float(numpy.mean(numpy.std(positions, axis=0)))
@@ -0,0 +1,473 @@
+"""
+Surrogate-assisted optimisation.
+
+A full likelihood evaluation on whole-genome data takes seconds to minutes, so
+instead of spending evaluations on regions a cheap model of the likelihood
+surface could have ruled out, a Gaussian process is fitted to the points
+evaluated so far and new points are proposed where the expected improvement
+over the best value is largest. The proposals are evaluated in batches, so the
+batch can be spread over worker processes, and the Gaussian process is refitted
+after each batch.
+
+Far from the optimum the log-likelihood falls off by orders of magnitude, which
+would dominate the fit, so values below the median of the evaluated values are
+raised to the median; the surrogate only needs to be accurate where the good
+points are.
+
+The Optimiser searches the unit hypercube like the other heuristic optimisers.
+A SurrogateScreen is a batch fitness function for the particle swarm, the
+genetic algorithm and the CMA evolution strategy, evaluating only the most
+promising of the candidates they propose.
+"""
+
+import datetime
+import math
+
+import numpy
+import scipy.linalg
+import scipy.optimize
+from scipy.stats import norm
+
+from IMCoalHMM.multistart import latin_hypercube
+from IMCoalHMM.parallel import EvaluationPool
+
+
+def _matern(points1, points2, length_scales, signal_variance):
+    """The Matern 5/2 covariance between two sets of points."""
+    differences = (points1[:, numpy.newaxis, :] - points2[numpy.newaxis, :, :]) / length_scales
+    r = numpy.sqrt(5.0 * numpy.sum(differences ** 2, axis=2))
+    return signal_variance * (1.0 + r + r ** 2 / 3.0) * numpy.exp(-r)
+
+
+class GaussianProcess(object):
+    """A Gaussian process regression model with a Matern 5/2 kernel with a length
+    scale for each dimension, fitted to the values at a set of points."""
+
+    # Bounds on the logarithms of the length scales, the signal variance and the
+    # noise variance, for values scaled to unit variance at points in the unit hypercube.
+    LOG_LENGTH_SCALE_BOUNDS = (math.log(1e-2), math.log(1e2))
+    LOG_SIGNAL_VARIANCE_BOUNDS = (math.log(1e-2), math.log(1e2))
+    LOG_NOISE_VARIANCE_BOUNDS = (math.log(1e-8), math.log(1e-1))
+
+    def __init__(self):
+        self.points = None
+        self.values = None
+        self.log_length_scales = None
+        self.log_signal_variance = 0.0
+        self.log_noise_variance = math.log(1e-6)
+        self.offset = 0.0
+        self.scale = 1.0
+        self.cholesky = None
+        self.weights = None
+
+    def fit(self, points, values, optimise=True):
+        """Fit the model to values at points.
+
+        :param points: The points as rows.
+        :type points: numpy.ndarray
+        :param values: The finite values at the points.
+        :type values: numpy.ndarray
+        :param optimise: If true, the kernel parameters are chosen by maximum marginal
+         likelihood, otherwise the current ones are kept.
+        :type optimise: bool
+        """
+        self.points = numpy.array(points, dtype=float)
+        self.values = numpy.array(values, dtype=float)
+        self.offset = numpy.mean(self.values)
+        self.scale = numpy.std(self.values) if numpy.std(self.values) > 0.0 else 1.0
+        if self.log_length_scales is None:
+            self.log_length_scales = numpy.zeros(self.points.shape[1]) + math.log(0.3)
+
+        if optimise and len(self.points) > 1:
+            initial = numpy.concatenate((self.log_length_scales, [self.log_signal_variance, self.log_noise_variance]))
+            bounds = ([self.LOG_LENGTH_SCALE_BOUNDS] * len(self.log_length_scales) +
+                      [self.LOG_SIGNAL_VARIANCE_BOUNDS, self.LOG_NOISE_VARIANCE_BOUNDS])
+            result = scipy.optimize.minimize(self.__negative_log_marginal_likelihood, initial,
+                                             method='L-BFGS-B', bounds=bounds)
+            if numpy.isfinite(result.fun):
+                self.log_length_scales = result.x[:-2]
+                self.log_signal_variance, self.log_noise_variance = result.x[-2:]
+
+        self.cholesky, self.weights = self.__decompose(self.log_length_scales, self.log_signal_variance,
+                                                       self.log_noise_variance)
+        return self
+
+    def __decompose(self, log_length_scales, log_signal_variance, log_noise_variance):
+        covariance = _matern(self.points, self.points, numpy.exp(log_length_scales), math.exp(log_signal_variance))
+        covariance[numpy.diag_indices_from(covariance)] += math.exp(log_noise_variance)
+        cholesky = numpy.linalg.cholesky(covariance)
+        targets = (self.values - self.offset) / self.scale
+        weights = scipy.linalg.cho_solve((cholesky, True), targets)
+        return cholesky, weights
+
+    def __negative_log_marginal_likelihood(self, parameters):
+        try:
+            cholesky, weights = self.__decompose(parameters[:-2], parameters[-2], parameters[-1])
+        except numpy.linalg.LinAlgError:
+            return float('inf')
+        targets = (self.values - self.offset) / self.scale
+        return 0.5 * targets.dot(weights) + numpy.sum(numpy.log(numpy.diag(cholesky)))
+
+    def predict(self, points):
+        """Predict the values at points.
+
+        :param points: The points as rows.
+        :type points: numpy.ndarray
+
+        :returns: the mean and the standard deviation of the prediction at each point.
+        :rtype: (numpy.ndarray, numpy.ndarray)
+        """
+        points = numpy.atleast_2d(points)
+        cross = _matern(points, self.points, numpy.exp(self.log_length_scales), math.exp(self.log_signal_variance))
+        mean = cross.dot(self.weights)
+        solved = scipy.linalg.solve_triangular(self.cholesky, cross.T, lower=True)
+        variance = numpy.maximum(math.exp(self.log_signal_variance) - numpy.sum(solved ** 2, axis=0), 0.0)
+        return self.offset + self.scale * mean, self.scale * numpy.sqrt(variance)
+
+
+def expected_improvement(mean, std, best):
+    """The expected improvement over the best value, for maximisation, of
+    normally distributed predictions.
+
+    :param mean: The means of the predictions.
+    :type mean: numpy.ndarray
+    :param std: The standard deviations of the predictions.
+    :type std: numpy.ndarray
+    :param best: The best value so far.
+    :type best: float
+
+    :rtype: numpy.ndarray
+    """
+    improvement = numpy.asarray(mean, dtype=float) - best
+    std = numpy.asarray(std, dtype=float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        z = numpy.where(std > 0.0, improvement / std, 0.0)
+        result = improvement * norm.cdf(z) + std * norm.pdf(z)
+    return numpy.where(std > 0.0, result, numpy.maximum(improvement, 0.0))
+
+
+def training_values(values):
+    """The values the surrogate is fitted to: values below the median, including
+    invalid ones, are raised to the median of the finite values.
+
+    :param values: The evaluated values.
+    :type values: numpy.ndarray
+
+    :rtype: numpy.ndarray
+    """
+    values = numpy.asarray(values, dtype=float)
+    finite = values[numpy.isfinite(values)]
+    if len(finite) == 0:
+        return numpy.zeros(len(values))
+    floor = numpy.median(finite)
+    return numpy.where(numpy.isfinite(values), numpy.maximum(values, floor), floor)
+
+
+def propose(process, count, candidate_count=2000, random_state=None):
+    """Propose a batch of points in the unit hypercube by expected improvement.
+
+    Candidates are sampled uniformly and around the best points so far. The point
+    with the largest expected improvement is taken, the model is told the value
+    there is its prediction, so the next point is not proposed next to it, and so
+    on until the batch is full.
+
+    :param process: The model fitted to the values so far.
+    :type process: GaussianProcess
+    :param count: The number of points to propose.
+    :type count: int
+    :param candidate_count: The number of candidate points to choose from.
+    :type candidate_count: int
+    :param random_state: The source of random numbers.
+    :type random_state: numpy.random.RandomState | None
+
+    :returns: the points as rows.
+    :rtype: numpy.ndarray
+    """
+    if random_state is None:
+        random_state = numpy.random
+    points, values = process.points, process.values
+    no_dimensions = points.shape[1]
+
+    # Half the candidates are uniform, half are around the best points at several scales.
+    best_points = points[numpy.argsort(-values, kind='mergesort')[:5]]
+    local_count = candidate_count // 2
+    centres = best_points[random_state.randint(0, len(best_points), local_count)]
+    scales = numpy.array([0.1, 0.03, 0.01, 0.003])[random_state.randint(0, 4, local_count)]
+    local = centres + scales[:, numpy.newaxis] * random_state.standard_normal((local_count, no_dimensions))
+    candidates = numpy.clip(numpy.vstack((random_state.random_sample((candidate_count - local_count, no_dimensions)),
+                                          local)), 0.0, 1.0)
+
+    believer = GaussianProcess()
+    believer.log_length_scales = process.log_length_scales
+    believer.log_signal_variance = process.log_signal_variance
+    believer.log_noise_variance = process.log_noise_variance
+    believer.fit(points, values, optimise=False)
+
+    proposals = []
+    for _ in xrange(count):
+        mean, std = believer.predict(candidates)
+        chosen = int(numpy.argmax(expected_improvement(mean, std, numpy.max(believer.values))))
+        proposals.append(candidates[chosen])
+        believer.fit(numpy.vstack((believer.points, candidates[chosen])),
+                     numpy.append(believer.values, mean[chosen]), optimise=False)
+        candidates = numpy.delete(candidates, chosen, axis=0)
+    return numpy.array(proposals)
+
+
+class Solution(object):
+    """
+    Encapsulation of a vector of positions and their corresponding fitness.
+    """
+
+    def __init__(self, positions=(), fitness=0.0):
+        """
+        Initialise a new instance of the class.
+        :param positions: The positions.
+        :param fitness: The fitness of the positions.
+        :return: A new instance of the class.
+        """
+        self.positions = tuple(positions)
+        self.fitness = fitness
+
+    def __str__(self):
+        """
+        Return a string representation of this instance.
+        :return: A string representation of this instance.
+        """
+        token = ' '.join(map(str, self.positions))
+        return 'fitness:{0} positions:[{1}]'.format(self.fitness, token)
+
+
+class ExitCondition(object):
+    """
+    A class providing descriptions for the reason the surrogate-assisted optimisation terminates.
+    """
+
+    ABORT = 'ABORT'
+    ITERATIONS = 'ITERATIONS'
+    TIMEOUT = 'TIMEOUT'
+
+
+class Context(object):
+    """
+    Context information for the surrogate-assisted optimiser; this instance is passed to the optional log method and
+    eventually returned as a result of the optimisation.
+    """
+
+    def __init__(self, optimiser):
+        """
+        Initialise a new instance of the class for the specified optimiser.
+        :param optimiser: The optimiser for this instance.
+        :return: A new instance of the class.
+        """
+        assert isinstance(optimiser, Optimiser)
+
+        self.aborted = False
+        self.best = Solution(fitness=float('-inf'))
+        self.batch = []
+        self.elapsed = datetime.timedelta(seconds=0)
+        self.evaluations = 0
+        self.exit_condition = None
+        self.iteration = 0
+        self.optimiser = optimiser
+        self.start = datetime.datetime.now()
+
+
+class Optimiser(object):
+    """
+    A surrogate-assisted optimiser searching the unit hypercube.
+    """
+
+    def __init__(self):
+        """
+        Initialise a new instance of the class, setting the maximum number of iterations to 50, no maximum execution
+        time, the batch size to 4, the number of initial points to 2n + 2 for n dimensions, and evaluation in the
+        optimiser's own process.
+        :return: A new instance of the class.
+        """
+        self.batch_size = 4
+        self.candidate_count = 2000
+        self.initial_points = None
+        self.log = None
+        self.max_iterations = 50
+        self.processes = None
+        self.random_state = numpy.random
+        self.timeout = None
+
+    def maximise(self, fitness_function, parameter_count, batch_fitness_function=None):
+        """
+        Attempt to find a maximum set of values for a specified fitness function; the number of dimensions in the
+        problem domain is represented by the specified parameter count.
+
+        The initial points are a Latin hypercube design.  Each iteration then fits the surrogate to all points so far
+        and evaluates a batch of proposals, in a pool of the configured number of worker processes, forked when the
+        optimisation starts, or by a batch fitness function if one is specified.
+        :param fitness_function: The fitness function to maximise.
+        :param parameter_count: the number of dimensions in the problem domain.
+        :param batch_fitness_function: An optional function returning the fitness of each of a list of positions.
+        :return: An instance of type Context that encapsulates the final state of the algorithm.
+        """
+        assert hasattr(fitness_function, '__call__')
+        assert parameter_count > 0
+        assert self.batch_size > 0
+
+        def fitness_function_wrapper(parameters):
+            fitness = fitness_function(parameters)
+            if math.isnan(fitness):
+                fitness = float('-inf')
+            return fitness
+
+        pool = None
+        if batch_fitness_function is not None:
+            def evaluate(positions):
+                return [float('-inf') if math.isnan(fitness) else fitness
+                        for fitness in batch_fitness_function(positions)]
+        else:
+            pool = EvaluationPool(fitness_function_wrapper, self.processes)
+            evaluate = pool.map
+
+        try:
+            return self.__maximise(Context(self), evaluate, parameter_count)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def __maximise(self, context, evaluate, parameter_count):
+        initial_points = self.initial_points
+        if initial_points is None:
+            initial_points = 2 * parameter_count + 2
+
+        points = latin_hypercube(initial_points, parameter_count, self.random_state)
+        values = numpy.array([])
+        process = GaussianProcess()
+        while True:
+            batch = points[len(values):]
+            batch_values = numpy.array(evaluate([tuple(p) for p in batch.tolist()]), dtype=float)
+            values = numpy.append(values, batch_values)
+            context.evaluations += len(batch)
+
+            context.batch = [Solution(p.tolist(), float(v)) for p, v in zip(batch, batch_values)]
+            best = int(numpy.argmax(values))
+            if values[best] > context.best.fitness:
+                context.best = Solution(points[best].tolist(), float(values[best]))
+
+            if self.__iteration_done(context):
+                return context
+
+            process.fit(points, training_values(values))
+            points = numpy.vstack((points, propose(process, self.batch_size, self.candidate_count,
+                                                   self.random_state)))
+
+    def __iteration_done(self, context):
+        """
+        Log the finished iteration and check for exit conditions.
+        :return: True if the optimisation should stop, with the exit condition set in the context.
+        """
+        # Log the iteration before it's lost forever.
+        context.elapsed = datetime.datetime.now() - context.start
+        context.iteration += 1
+        self.__log(context)
+
+        # Check for exit conditions.
+        if context.aborted:
+            context.exit_condition = ExitCondition.ABORT
+        elif self.max_iterations is not None and context.iteration >= self.max_iterations:
+            context.exit_condition = ExitCondition.ITERATIONS
+        elif self.timeout is not None and context.elapsed > self.timeout:
+            context.exit_condition = ExitCondition.TIMEOUT
+        return context.exit_condition is not None
+
+    def __log(self, context):
+        if self.log is not None:
+            self.log(context)
+
+
+class SurrogateScreen(object):
+    """A batch fitness function that evaluates only the most promising part of each batch.
+
+    All evaluated points are kept, and for each batch the surrogate fitted to them
+    ranks the positions by expected improvement. The top fraction is evaluated with
+    the fitness function, the rest are given the lower end of their prediction,
+    mean minus two standard deviations, but never more than the best evaluated
+    value, so no screened position can become the best solution. Positions
+    evaluated before get their evaluated value again, and are not counted in the
+    fraction.
+
+    Pass it as the batch_fitness_function of an optimiser, for the particle swarm
+    with synchronous evaluation. The screen evaluates in its own process pool.
+    """
+
+    def __init__(self, fitness_function, fraction=0.25, processes=None, min_points=10, max_points=200):
+        """
+        :param fitness_function: The fitness function of single positions.
+        :param fraction: The fraction of each batch to evaluate.
+        :type fraction: float
+        :param processes: The number of worker processes for the evaluations.
+        :type processes: int | None
+        :param min_points: All positions are evaluated until this many points are.
+        :type min_points: int
+        :param max_points: The surrogate is fitted to at most this many of the best points,
+         since fitting takes time cubic in the number of points.
+        :type max_points: int
+        """
+        assert 0.0 < fraction <= 1.0
+        self.fitness_function = fitness_function
+        self.fraction = fraction
+        self.processes = processes
+        self.min_points = min_points
+        self.max_points = max_points
+        self.points = []
+        self.values = []
+        self.known = {}
+        self.process = GaussianProcess()
+        self.pool = None
+
+    @property
+    def evaluations(self):
+        """The number of evaluations of the fitness function."""
+        return len(self.values)
+
+    def __call__(self, positions):
+        positions = numpy.array(positions, dtype=float)
+        keys = [tuple(p) for p in positions.tolist()]
+
+        # Only the first occurrence of each position not evaluated before is new.
+        new = []
+        seen = set(self.known)
+        for i, key in enumerate(keys):
+            if key not in seen:
+                seen.add(key)
+                new.append(i)
+        new = numpy.array(new, dtype=int)
+
+        fitness = numpy.zeros(len(positions))
+        if len(new) > 0:
+            if len(self.values) < self.min_points:
+                evaluated = new
+            else:
+                fitted = numpy.argsort(-numpy.array(self.values), kind='mergesort')[:self.max_points]
+                self.process.fit(numpy.array(self.points)[fitted],
+                                 training_values(numpy.array(self.values)[fitted]))
+                mean, std = self.process.predict(positions[new])
+                best = max(self.values)
+                order = numpy.argsort(-expected_improvement(mean, std, best), kind='mergesort')
+                evaluated = new[order[:max(1, int(math.ceil(self.fraction * len(new))))]]
+                fitness[new] = numpy.minimum(mean - 2.0 * std, best)
+
+            if self.pool is None:
+                self.pool = EvaluationPool(self.fitness_function, self.processes)
+            values = [float('-inf') if math.isnan(value) else value
+                      for value in self.pool.map([keys[i] for i in evaluated])]
+            fitness[evaluated] = values
+            self.points.extend(positions[evaluated].tolist())
+            self.values.extend(values)
+            self.known.update(zip([keys[i] for i in evaluated], values))
+
+        predicted = dict((keys[i], float(fitness[i])) for i in new)
+        return [self.known[key] if key in self.known else predicted[key] for key in keys]
+
+    def terminate(self):
+        """Stop the worker processes, if any."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
@@ -0,0 +1,103 @@
+"""Transforms between model parameters and the space they are optimised in.
+
+The parameters of the models are on very different scales, coalescence rates
+in the thousands next to times around 1e-3, and must stay positive. Optimising
+them directly gives poorly scaled simplices and steps to invalid parameters.
+Optimising the logarithm of rates and times, the logit of proportions and the
+logarithm of the differences between ordered times instead puts all parameters
+on comparable scales without any constraints.
+"""
+
+import numpy
+
+# The kinds of transforms of single parameters.
+LOG = 'log'
+LOGIT = 'logit'
+IDENTITY = 'identity'
+
+
+class ParameterTransform(object):
+    """Maps model parameters to an unconstrained optimisation space and back."""
+
+    def __init__(self, kinds, ordered=()):
+        """
+        :param kinds: How each parameter is transformed: LOG for positive parameters,
+         LOGIT for proportions between zero and one and IDENTITY for no transform.
+        :type kinds: list[str]
+        :param ordered: Groups of indices of time parameters that must be increasing,
+         in order. They are optimised as the first time and the differences between
+         consecutive times, each transformed as given by kinds, normally LOG.
+        :type ordered: list[list[int]]
+        """
+        for kind in kinds:
+            if kind not in (LOG, LOGIT, IDENTITY):
+                raise ValueError('Unknown parameter transform: {0}'.format(kind))
+        self.kinds = list(kinds)
+        self.ordered = [list(group) for group in ordered]
+
+        kinds = numpy.array(self.kinds)
+        self.log_indices = numpy.flatnonzero(kinds == LOG)
+        self.logit_indices = numpy.flatnonzero(kinds == LOGIT)
+
+    @classmethod
+    def log(cls, no_parameters):
+        """The transform for models whose parameters are all positive rates and durations.
+
+        :rtype: ParameterTransform
+        """
+        return cls([LOG] * no_parameters)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def to_optimiser(self, parameters):
+        """Map model parameters into the optimisation space.
+
+        :param parameters: The model parameters.
+        :type parameters: numpy.ndarray
+
+        :rtype: numpy.ndarray
+        """
+        values = numpy.array(parameters, dtype=float)
+        if len(values) != len(self):
+            raise ValueError('Expected {0} parameters but got {1}.'.format(len(self), len(values)))
+        for group in self.ordered:
+            times = values[group]
+            if numpy.any(numpy.diff(times) <= 0):
+                raise ValueError('The parameters {0} must be increasing.'.format(group))
+            values[group[1:]] = numpy.diff(times)
+
+        if numpy.any(values[self.log_indices] <= 0):
+            raise ValueError('Parameters with a log transform must be positive.')
+        proportions = values[self.logit_indices]
+        if numpy.any((proportions <= 0) | (proportions >= 1)):
+            raise ValueError('Parameters with a logit transform must be between zero and one.')
+
+        values[self.log_indices] = numpy.log(values[self.log_indices])
+        values[self.logit_indices] = numpy.log(proportions / (1.0 - proportions))
+        return values
+
+    def from_optimiser(self, values):
+        """Map a point in the optimisation space back to model parameters.
+
+        :param values: The point in the optimisation space.
+        :type values: numpy.ndarray
+
+        :rtype: numpy.ndarray
+        """
+        parameters = numpy.array(values, dtype=float)
+        parameters[self.log_indices] = numpy.exp(parameters[self.log_indices])
+        parameters[self.logit_indices] = 1.0 / (1.0 + numpy.exp(-parameters[self.logit_indices]))
+        for group in self.ordered:
+            parameters[group] = numpy.cumsum(parameters[group])
+        return parameters
+
+    def bounds(self):
+        """Bounds for the optimisation space, for the optimisers that take them.
+
+        Transformed parameters are unbounded; parameters without a transform are
+        kept non-negative, like the untransformed optimisation does.
+
+        :rtype: list[(float|None, float|None)]
+        """
+        return [(0, None) if kind == IDENTITY else (None, None) for kind in self.kinds]
@@ -31,15 +31,46 @@ def projection_matrix(from_state_space, to_state_space, state_map):
     return projection
 
 
-def compute_upto(upto_0, through):
+def changed_matrices(matrices, previous_matrices):
+    """Flag the matrices that differ from those of a previous evaluation.
+
+    Matrices taken from the CTMC probability matrix caches are the same objects
+    when the rates and time steps are unchanged, so most comparisons are just
+    identity checks.
+
+    :param matrices: The current matrices.
+    :type matrices: list[matrix]
+    :param previous_matrices: The matrices from the previous evaluation, or None.
+    :type previous_matrices: list[matrix] | None
+
+    :returns: for each matrix, True if it has changed.
+    :rtype: list[bool]
+    """
+    if previous_matrices is None or len(matrices) != len(previous_matrices):
+        return [True] * len(matrices)
+    return [not _same_matrix(current, previous) for current, previous in zip(matrices, previous_matrices)]
+
+
+def _same_matrix(current, previous):
+    return current is previous or (current.shape == previous.shape and np.array_equal(current, previous))
+
+
+def compute_upto(upto_0, through, previous_upto=None, changed_through=None):
     """Computes the probability matrices for moving from time zero up to,
     but not through, interval i.
 
+    If the matrices from a previous evaluation are given, the products that only
+    involve unchanged matrices are reused from there.
+
     :param upto_0: The probability matrix for moving up to the first break point.
         This is a basis case for the upto list that is returned.
     :type upto_0: numpy.matrix
     :param through: The probability matrices for moving through each interval.
     :type through: list[numpy.matrix]
+    :param previous_upto: The up-to matrices from the previous evaluation.
+    :type previous_upto: list[numpy.matrix] | None
+    :param changed_through: Flags for the through matrices that changed since then.
+    :type changed_through: list[bool] | None
 
     :returns: The list of transition probability matrices for moving up to
         each interval.
@@ -48,31 +79,47 @@ def compute_upto(upto_0, through):
     no_states = len(through)
     upto = [None] * no_states
     upto[0] = upto_0
+    reuse = (previous_upto is not None and changed_through is not None and
+             len(previous_upto) == no_states and _same_matrix(upto_0, previous_upto[0]))
+    if reuse:
+        upto[0] = previous_upto[0]
     for i in xrange(1, no_states):
-        upto[i] = upto[i - 1] * through[i - 1]
+        reuse = reuse and not changed_through[i - 1]
+        upto[i] = previous_upto[i] if reuse else upto[i - 1] * through[i - 1]
     return upto
 
 
-def compute_between(through):
+def compute_between(through, previous_between=None, changed_through=None):
     """Computes the matrices for moving from the end of interval i
     to the beginning of interval j.
 
+    If the matrices from a previous evaluation are given, the products that only
+    involve unchanged matrices are reused from there.
+
     :param through: The probability matrices for moving through each interval.
     :type through: list[matrix]
+    :param previous_between: The between matrices from the previous evaluation.
+    :type previous_between: dict[(int,int), matrix] | None
+    :param changed_through: Flags for the through matrices that changed since then.
+    :type changed_through: list[bool] | None
 
     :returns: A table of transition probability matrices for moving between any two
         intervals i < j.
     :rtype: dict[(int,int), matrix]
     """
     no_states = len(through)
+    if changed_through is None:
+        changed_through = [True] * no_states
     between = dict()
     # Transitions going from the endpoint of interval i to the entry point
     # of interval j
     for i in xrange(no_states - 1):
         # noinspection PyCallingNonCallable
         between[(i, i + 1)] = matrix(identity(through[i].shape[1]))
+        reuse = previous_between is not None
         for j in xrange(i + 2, no_states):
-            between[(i, j)] = between[(i, j - 1)] * through[j - 1]
+            reuse = reuse and not changed_through[j - 1]
+            between[(i, j)] = previous_between[(i, j)] if reuse else between[(i, j - 1)] * through[j - 1]
     return between
 
 
@@ -99,6 +146,37 @@ class CTMCSystem(object):
         self.upto_ = []
         self.between_ = {}
 
+        # The system from the previous evaluation, whose matrices can be reused where
+        # they are unchanged, and this system's joint matrix once it is computed.
+        self.previous = None
+        self.changed_through = None
+        self.joint_ = None
+
+    def compute_products(self, upto_0, previous=None):
+        """Compute the up-to and between matrices from the through matrices.
+
+        The sub-class's __init__ method should call this once it has set through_.
+        If the system from the previous evaluation is given, all products of
+        matrices that are unchanged since then are reused from it, and so are the
+        joint probabilities that only depend on those.
+
+        :param upto_0: The probability matrix for moving up to the first break point.
+        :type upto_0: matrix
+        :param previous: The CTMC system from the previous evaluation of the model.
+        :type previous: CTMCSystem | None
+        """
+        if previous is not None and previous.no_states != self.no_states:
+            previous = None
+        self.previous = previous
+        if previous is None:
+            self.changed_through = [True] * len(self.through_)
+            self.upto_ = compute_upto(upto_0, self.through_)
+            self.between_ = compute_between(self.through_)
+        else:
+            self.changed_through = changed_matrices(self.through_, previous.through_)
+            self.upto_ = compute_upto(upto_0, self.through_, previous.upto_, self.changed_through)
+            self.between_ = compute_between(self.through_, previous.between_, self.changed_through)
+
     @abstractmethod
     def get_state_space(self, i):
         """Return the state space used in interval i.
@@ -214,30 +292,63 @@ def compute_transition_probabilities(ctmc):
 
     no_states = ctmc.no_states
 
+    # Joint probabilities that only depend on matrices that are unchanged since the
+    # previous evaluation are taken from its joint matrix.
+    previous = getattr(ctmc, 'previous', None)
+    if previous is not None and previous.joint_ is not None:
+        previous_joint = previous.joint_
+        same_upto = [current is last for current, last in zip(ctmc.upto_, previous.upto_)]
+        same_through = [not changed for changed in ctmc.changed_through]
+    else:
+        previous_joint = None
+
+    def unchanged(i, j):
+        return (previous_joint is not None and same_upto[i] and same_through[i] and same_through[j]
+                and (j <= i + 1 or ctmc.between(i, j) is previous.between(i, j)))
+
     # Joint genealogy probabilities
     # noinspection PyCallingNonCallable
     joint = matrix(zeros((no_states, no_states)))
 
     # -- Filling in the diagonal (i == j) for the J matrix ----------------
-    joint[0, 0] = ctmc.up_to(1)[ctmc.initial, ctmc.end_states(0)].sum()
+    if previous_joint is not None and same_upto[1]:
+        joint[0, 0] = previous_joint[0, 0]
+    else:
+        joint[0, 0] = ctmc.up_to(1)[ctmc.initial, ctmc.end_states(0)].sum()
     for i in xrange(1, no_states - 1):
-        joint[i, i] = (ctmc.up_to(i)[ctmc.initial, ctmc.begin_states(i)]
-                       * ctmc.through(i)[ix_(ctmc.begin_states(i), ctmc.end_states(i + 1))]).sum()
-
-    joint[no_states - 1, no_states - 1] = ctmc.up_to(no_states - 1)[ctmc.initial,
-                                                                   ctmc.begin_states(no_states - 1)].sum()
+        if unchanged(i, i):
+            joint[i, i] = previous_joint[i, i]
+        else:
+            joint[i, i] = (ctmc.up_to(i)[ctmc.initial, ctmc.begin_states(i)]
+                           * ctmc.through(i)[ix_(ctmc.begin_states(i), ctmc.end_states(i + 1))]).sum()
+
+    last = no_states - 1
+    if previous_joint is not None and same_upto[last]:
+        joint[last, last] = previous_joint[last, last]
+    else:
+        joint[last, last] = ctmc.up_to(last)[ctmc.initial, ctmc.begin_states(last)].sum()
 
     # -- handle i < j (and j < i by symmetry) ---------------------------
     for i in xrange(no_states - 1):
-        up_through_i = ctmc.up_to(i)[ctmc.initial, ctmc.begin_states(i)] \
-            * ctmc.through(i)[ix_(ctmc.begin_states(i), ctmc.left_states(i + 1))]
+        up_through_i = None
         for j in xrange(i + 1, no_states):
+            if unchanged(i, j):
+                joint[i, j] = joint[j, i] = previous_joint[i, j]
+                continue
+            if up_through_i is None:
+                up_through_i = ctmc.up_to(i)[ctmc.initial, ctmc.begin_states(i)] \
+                    * ctmc.through(i)[ix_(ctmc.begin_states(i), ctmc.left_states(i + 1))]
             between_i_and_j = ctmc.between(i, j)[ix_(ctmc.left_states(i + 1), ctmc.left_states(j))]
             through_j = ctmc.through(j)[ix_(ctmc.left_states(j), ctmc.end_states(j + 1))]
             joint[i, j] = joint[j, i] = (up_through_i * between_i_and_j * through_j).sum()
 
     assert_almost_equal(joint.sum(), 1.0)
 
+    # Keep the joint matrix for the next evaluation but not the chain of previous systems.
+    if hasattr(ctmc, 'previous'):
+        ctmc.joint_ = joint
+        ctmc.previous = None
+
     initial_prob_vector = np.zeros((no_states,))
     transition_matrix = np.zeros((no_states, no_states))
     for i in xrange(no_states):
@@ -1,91 +1,14 @@
 """Code for constructing and optimizing the HMM for a PSMC like model.
 """
 
-from numpy import zeros, matrix
-
 from IMCoalHMM.state_spaces import Isolation, make_rates_table_isolation
 from IMCoalHMM.state_spaces import Single, make_rates_table_single
 from IMCoalHMM.CTMC import make_ctmc
-from IMCoalHMM.transitions import CTMCSystem, projection_matrix, compute_upto, compute_between
-from IMCoalHMM.break_points import psmc_break_points
+from IMCoalHMM.demography import Epoch, Demography, merge_populations, psmc_spacing
 from IMCoalHMM.emissions import coalescence_points
 from IMCoalHMM.model import Model
 
 
-## Code for computing HMM transition probabilities ####################
-
-# The way multiprocessing works means that we have to define this class for mapping in parallel
-# and we have to define the processing pool after we define the class, or it won't be able to see
-# it in the sub-processes. It breaks the flow of the code, but it is necessary.
-
-class ComputeThroughInterval(object):
-    def __init__(self, ctmcs, break_points):
-        self.ctmcs = ctmcs
-        self.break_points = break_points
-
-    def __call__(self, i):
-        return self.ctmcs[i].probability_matrix(self.break_points[i + 1] - self.break_points[i])
-
-
-def _compute_through(ctmcs, break_points):
-    """Computes the matrices for moving through an interval"""
-    no_states = len(break_points)
-
-    # Construct the transition matrices for going through each interval
-    through = map(ComputeThroughInterval(ctmcs, break_points), range(no_states - 1))
-
-    # As a hack we set up a pseudo through matrix for the last interval that
-    # just puts all probability on ending in one of the end states. This
-    # simplifies the HMM transition probability code as it avoids a special case
-    # for the last interval.
-    # noinspection PyCallingNonCallable
-    pseudo_through = matrix(zeros((len(ctmcs[-1].state_space.states),
-                                   len(ctmcs[-1].state_space.states))))
-    pseudo_through[:, ctmcs[-1].state_space.end_states[0]] = 1.0
-    through.append(pseudo_through)
-
-    return through
-
-
-def _compute_upto0(isolation, ancestral, break_points):
-    """Computes the probability matrices for moving from time zero up to,
-    but not through, interval i."""
-    def state_map(state):
-        return frozenset([(0, nucs) for (_, nucs) in state])
-    projection = projection_matrix(isolation.state_space, ancestral[0].state_space, state_map)
-    return isolation.probability_matrix(break_points[0]) * projection
-
-
-class VariableCoalRateCTMCSystem(CTMCSystem):
-    """Wrapper around CTMC transition matrices for the isolation model."""
-
-    def __init__(self, isolation_ctmc, ancestral_ctmcs, break_points):
-        """Construct all the matrices and cache them for the
-        method calls.
-
-        :param isolation_ctmc: CTMC for the initial isolation phase.
-        :type isolation_ctmc: IMCoalHMM.CTMC.CTMC
-        :param ancestral_ctmcs: CTMCs for the ancestral population.
-        :type ancestral_ctmcs: list[IMCoalHMM.CTMC.CTMC]
-        :param break_points: List of break points.
-        :type break_points: list[float]
-        """
-
-        super(VariableCoalRateCTMCSystem, self).__init__(no_hmm_states=len(ancestral_ctmcs),
-                                                         initial_ctmc_state=isolation_ctmc.state_space.i12_index)
-
-        # Even though we have different CTMCs they have the same state space
-        self.state_space = ancestral_ctmcs[0].state_space
-
-        self.through_ = _compute_through(ancestral_ctmcs, break_points)
-        self.upto_ = compute_upto(_compute_upto0(isolation_ctmc, ancestral_ctmcs, break_points), self.through_)
-        self.between_ = compute_between(self.through_)
-
-    def get_state_space(self, _):
-        """Return the state space for interval i, but it is always the same."""
-        return self.state_space
-
-
 ## Class that can construct HMMs ######################################
 class VariableCoalescenceRateIsolationModel(Model):
     """Class wrapping the code that generates an isolation model HMM
@@ -102,6 +25,13 @@ class VariableCoalescenceRateIsolationModel(Model):
         self.intervals = intervals
         self.est_split = est_split
 
+        # Each coalescence rate gets an epoch of the ancestral population, with the break
+        # points of all of them spaced together.
+        epochs = [Epoch(self.isolation_state_space, 0, merge_populations)]
+        epochs.extend(Epoch(self.single_state_space, no_intervals) for no_intervals in intervals if no_intervals > 0)
+        epochs[1].spacing = psmc_spacing
+        self.demography = Demography(epochs, initial_state=self.isolation_state_space.i12_index)
+
     def _map_rates_to_intervals(self, coal_rates):
         """Takes the coalescence rates as specified when building the CTMC
         and maps them to each interval based on the intervals specification."""
@@ -122,8 +52,7 @@ class VariableCoalescenceRateIsolationModel(Model):
             split_time = 0.0
             coal_rates = parameters[0:-1]
 
-        no_states = sum(self.intervals)
-        break_points = psmc_break_points(no_states, offset=split_time)
+        break_points = self.demography.break_points([(split_time, None, None)])
 
         return coalescence_points(break_points, self._map_rates_to_intervals(coal_rates))
 
@@ -165,14 +94,12 @@ class VariableCoalescenceRateIsolationModel(Model):
         isolation_rates = make_rates_table_isolation(coal_rates[0], coal_rates[0], recomb_rate)
         isolation_ctmc = make_ctmc(self.isolation_state_space, isolation_rates)
 
-        ancestral_ctmcs = []
+        ctmcs = [isolation_ctmc]
         for epoch, coal_rate in enumerate(coal_rates):
-            single_rates = make_rates_table_single(coal_rate, recomb_rate)
-            single_ctmc = make_ctmc(self.single_state_space, single_rates)
-            for _ in xrange(self.intervals[epoch]):
-                ancestral_ctmcs.append(single_ctmc)
+            if self.intervals[epoch] > 0:
+                single_rates = make_rates_table_single(coal_rate, recomb_rate)
+                ctmcs.append(make_ctmc(self.single_state_space, single_rates))
 
-        no_states = len(ancestral_ctmcs)
-        break_points = psmc_break_points(no_states, offset=split_time)
+        break_points = self.demography.break_points([(split_time, None, None)])
 
-        return VariableCoalRateCTMCSystem(isolation_ctmc, ancestral_ctmcs, break_points)
+        return self.demography.ctmc_system(ctmcs, break_points, previous=self.previous_ctmc_system)
@@ -2,86 +2,13 @@
 migration and coalescence.
 """
 
-from numpy import zeros, matrix, identity
-
 from IMCoalHMM.state_spaces import Migration, make_rates_table_migration
 from IMCoalHMM.CTMC import make_ctmc
-from IMCoalHMM.transitions import CTMCSystem, compute_upto, compute_between
-from IMCoalHMM.break_points import psmc_break_points
+from IMCoalHMM.demography import Epoch, Demography, psmc_spacing
 from IMCoalHMM.emissions import coalescence_points
 from IMCoalHMM.model import Model
 
 
-## Code for computing HMM transition probabilities ####################
-
-# The way multiprocessing works means that we have to define this class for mapping in parallel
-# and we have to define the processing pool after we define the class, or it won't be able to see
-# it in the sub-processes. It breaks the flow of the code, but it is necessary.
-
-class ComputeThroughInterval(object):
-    def __init__(self, ctmcs, break_points):
-        self.ctmcs = ctmcs
-        self.break_points = break_points
-
-    def __call__(self, i):
-        return self.ctmcs[i].probability_matrix(self.break_points[i + 1] - self.break_points[i])
-
-
-def _compute_through(ctmcs, break_points):
-    """Computes the matrices for moving through an interval"""
-    no_states = len(break_points)
-
-    # Construct the transition matrices for going through each interval
-    through = map(ComputeThroughInterval(ctmcs, break_points), range(no_states - 1))
-
-    # As a hack we set up a pseudo through matrix for the last interval that
-    # just puts all probability on ending in one of the end states. This
-    # simplifies the HMM transition probability code as it avoids a special case
-    # for the last interval.
-    # noinspection PyCallingNonCallable
-    pseudo_through = matrix(zeros((len(ctmcs[-1].state_space.states),
-                                   len(ctmcs[-1].state_space.states))))
-    pseudo_through[:, ctmcs[-1].state_space.end_states[0]] = 1.0
-    through.append(pseudo_through)
-
-    return through
-
-
-class VariableCoalAndMigrationRateCTMCSystem(CTMCSystem):
-    """Wrapper around CTMC transition matrices for the isolation model."""
-
-    def __init__(self, initial_state, ctmcs, break_points):
-        """Construct all the matrices and cache them for the
-        method calls.
-
-        :param initial_state: The initial state for this CTMC system.
-            We include it in the constructor for this model because we want to handle
-            both samples from each population and between them.
-        :param ctmcs: CTMCs for each interval.
-        :type ctmcs: list[IMCoalHMM.CTMC.CTMC]
-        :param break_points: List of break points.
-        :type break_points: list[float]
-        """
-
-        super(VariableCoalAndMigrationRateCTMCSystem, self).__init__(no_hmm_states=len(ctmcs),
-                                                                     initial_ctmc_state=initial_state)
-
-        # Even though we have different CTMCs they have the same state space
-        self.state_space = ctmcs[0].state_space
-
-        self.through_ = _compute_through(ctmcs, break_points)
-
-        # noinspection PyCallingNonCallable
-        upto0 = matrix(identity(len(ctmcs[0].state_space.states)))
-        self.upto_ = compute_upto(upto0, self.through_)
-
-        self.between_ = compute_between(self.through_)
-
-    def get_state_space(self, _):
-        """Return the state space for interval i, but it is always the same."""
-        return self.state_space
-
-
 ## Class that can construct HMMs ######################################
 class VariableCoalAndMigrationRateModel(Model):
     """Class wrapping the code that generates an isolation model HMM
@@ -113,6 +40,12 @@ class VariableCoalAndMigrationRateModel(Model):
         self.intervals = intervals
         self.no_states = sum(intervals)
 
+        # Each set of rates gets an epoch, all over the same state space and with the break
+        # points of all of them spaced together.
+        epochs = [Epoch(self.migration_state_space, no_intervals) for no_intervals in intervals if no_intervals > 0]
+        epochs[0].spacing = psmc_spacing
+        self.demography = Demography(epochs, initial_state=self.initial_state)
+
     def unpack_parameters(self, parameters):
         """Unpack the rate parameters for the model from the linear representation
         used in optimizations to the specific rate parameters.
@@ -142,7 +75,7 @@ class VariableCoalAndMigrationRateModel(Model):
         # and it will depend on the starting point. This is a compromise at least.
         coal_rates_1, coal_rates_2, _, _, _ = self.unpack_parameters(parameters)
         mean_coal_rates = [(c1+c2)/2.0 for c1, c2 in zip(coal_rates_1, coal_rates_2)]
-        break_points = psmc_break_points(self.no_states)
+        break_points = self.demography.break_points([(0.0, None, None)])
         return coalescence_points(break_points, self._map_rates_to_intervals(mean_coal_rates))
 
     def build_ctmc_system(self, *parameters):
@@ -169,13 +102,12 @@ class VariableCoalAndMigrationRateModel(Model):
 
         ctmcs = []
         for epoch, states_in_interval in enumerate(self.intervals):
-            rates = make_rates_table_migration(coal_rates_1[epoch], coal_rates_2[epoch],
-                                               mig_rates_12[epoch], mig_rates_21[epoch],
-                                               recomb_rate)
-            ctmc = make_ctmc(self.migration_state_space, rates)
-            for _ in xrange(states_in_interval):
-                ctmcs.append(ctmc)
+            if states_in_interval > 0:
+                rates = make_rates_table_migration(coal_rates_1[epoch], coal_rates_2[epoch],
+                                                   mig_rates_12[epoch], mig_rates_21[epoch],
+                                                   recomb_rate)
+                ctmcs.append(make_ctmc(self.migration_state_space, rates))
 
-        break_points = psmc_break_points(self.no_states)
+        break_points = self.demography.break_points([(0.0, None, None)])
 
-        return VariableCoalAndMigrationRateCTMCSystem(self.initial_state, ctmcs, break_points)
+        return self.demography.ctmc_system(ctmcs, break_points, previous=self.previous_ctmc_system)
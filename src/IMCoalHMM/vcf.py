@@ -0,0 +1,242 @@
+"""Code for building pairwise observations directly from VCF files and callable-region masks.
+
+A pair of haplotypes is compared at the variant positions listed in the VCF
+files only. Every other site inside the callable regions is taken to match the
+reference in both haplotypes, so it gets the symbol 0, and every site outside
+the callable regions is missing data, symbol 2. The observations are produced a
+chunk of sites at a time, so the full sequences are never built.
+
+Only single-nucleotide records are used. Sites of other records (indels,
+structural variants), records that did not pass filters and missing genotypes
+are treated as missing data.
+"""
+
+import gzip
+from collections import OrderedDict
+import numpy as np
+
+from IMCoalHMM.observations import MISSING_SYMBOL
+
+# Number of sites produced at a time.
+DEFAULT_CHUNK_SIZE = 1 << 22
+
+# Allele code used for a missing or unusable genotype.
+_MISSING_ALLELE = 0
+
+
+def _open(filename):
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def parse_haplotype(spec):
+    """Parse a haplotype given as SAMPLE or SAMPLE:INDEX, where INDEX counts the
+    alleles of the sample's genotype from zero.
+
+    :rtype: (str, int)
+    """
+    if ':' in spec:
+        sample, index = spec.rsplit(':', 1)
+        return sample, int(index)
+    return spec, 0
+
+
+def read_mask(filename):
+    """Read callable regions from a BED file.
+
+    :returns: for each chromosome, the sorted start and end arrays of its
+     regions as 0-based half-open intervals.
+    :rtype: dict[str, (numpy.ndarray, numpy.ndarray)]
+    """
+    regions = OrderedDict()
+    with _open(filename) as infile:
+        for line in infile:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            chromosome, start, end = line.split('\t', 3)[:3]
+            regions.setdefault(chromosome, []).append((int(start), int(end)))
+    mask = OrderedDict()
+    for chromosome, intervals in regions.items():
+        intervals = np.array(sorted(intervals), dtype=np.int64).reshape(-1, 2)
+        mask[chromosome] = intervals[:, 0], intervals[:, 1]
+    return mask
+
+
+class _Calls(object):
+    """The alleles of the haplotypes read from one VCF file, for one chromosome, while reading."""
+
+    def __init__(self, no_haplotypes):
+        self.positions = []
+        self.references = []
+        self.alleles = [[] for _ in xrange(no_haplotypes)]
+
+
+class VcfCalls(object):
+    """The calls of some haplotypes read from a VCF file.
+
+    :ivar lengths: The chromosome lengths given in the header.
+    :ivar haplotypes: The haplotypes that were found in the file.
+    :ivar calls: For each chromosome, the 0-based positions, the reference base and, for
+     each haplotype, its allele at each position. Bases are ASCII codes with 0 for missing data.
+    """
+
+    def __init__(self, lengths, haplotypes, calls):
+        self.lengths = lengths
+        self.haplotypes = haplotypes
+        self.calls = calls
+
+    def chromosome(self, chromosome):
+        """The calls on a chromosome, which is empty if the file has no records for it.
+
+        :rtype: (numpy.ndarray, numpy.ndarray, dict[(str, int), numpy.ndarray])
+        """
+        if chromosome in self.calls:
+            return self.calls[chromosome]
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8),
+                dict((haplotype, np.zeros(0, dtype=np.uint8)) for haplotype in self.haplotypes))
+
+
+def read_vcf(filename, haplotypes):
+    """Read the alleles of some haplotypes at the variant positions of a VCF file.
+
+    :param filename: The VCF file, gzipped if the name ends with .gz.
+    :type filename: str
+    :param haplotypes: The (sample, allele index) pairs to read. Haplotypes of
+     samples that are not in the file are skipped.
+    :type haplotypes: list[(str, int)]
+
+    :rtype: VcfCalls
+    """
+    lengths = OrderedDict()
+    calls = OrderedDict()
+    columns = None
+    with _open(filename) as infile:
+        for line in infile:
+            if line.startswith('##'):
+                if line.startswith('##contig=<'):
+                    fields = dict(field.split('=', 1) for field in line.strip()[10:-1].split(',') if '=' in field)
+                    if 'ID' in fields and 'length' in fields:
+                        lengths[fields['ID']] = int(fields['length'])
+                continue
+            if line.startswith('#'):
+                samples = line.rstrip('\n').split('\t')[9:]
+                found = [haplotype for haplotype in haplotypes if haplotype[0] in samples]
+                columns = [9 + samples.index(sample) for sample, _ in found]
+                indices = [index for _, index in found]
+                continue
+
+            if columns is None:
+                raise ValueError('{0} has no #CHROM header line.'.format(filename))
+            fields = line.rstrip('\n').split('\t')
+            chromosome, position, reference, alternatives, filters = \
+                fields[0], int(fields[1]) - 1, fields[3].upper(), fields[4].upper(), fields[6]
+            if chromosome not in calls:
+                calls[chromosome] = _Calls(len(columns))
+            chromosome_calls = calls[chromosome]
+            chromosome_calls.positions.append(position)
+
+            alleles = [reference] + alternatives.split(',')
+            usable = all(len(allele) == 1 for allele in alleles) and filters in ('PASS', '.')
+            chromosome_calls.references.append(ord(reference) if usable else _MISSING_ALLELE)
+            # Without a GT key, or with a sample field truncated before it, the calls are missing.
+            format_keys = fields[8].split(':') if usable and len(fields) > 8 else []
+            gt_index = format_keys.index('GT') if 'GT' in format_keys else None
+            for haplotype_no, (column, index) in enumerate(zip(columns, indices)):
+                allele = _MISSING_ALLELE
+                sample_values = fields[column].split(':') if gt_index is not None and column < len(fields) else []
+                if gt_index is not None and gt_index < len(sample_values):
+                    genotype = sample_values[gt_index].replace('|', '/').split('/')
+                    if index < len(genotype) and genotype[index] != '.':
+                        base = alleles[int(genotype[index])]
+                        if base != '*':
+                            allele = ord(base)
+                chromosome_calls.alleles[haplotype_no].append(allele)
+
+    result = OrderedDict()
+    for chromosome, chromosome_calls in calls.items():
+        positions = np.array(chromosome_calls.positions, dtype=np.int64)
+        order = np.argsort(positions, kind='mergesort')
+        result[chromosome] = (positions[order],
+                              np.array(chromosome_calls.references, dtype=np.uint8)[order],
+                              dict((haplotype, np.array(alleles, dtype=np.uint8)[order])
+                                   for haplotype, alleles in zip(found, chromosome_calls.alleles)))
+    return VcfCalls(lengths, found if columns is not None else [], result)
+
+
+def compare_haplotypes(vcf_calls, haplotypes):
+    """Compare two haplotypes at the variant positions of one chromosome.
+
+    :param vcf_calls: The calls for the chromosome from each VCF file, from VcfCalls.chromosome.
+    :param haplotypes: The two haplotypes to compare.
+    :type haplotypes: list[(str, int)]
+
+    :returns: the sorted 0-based positions of all variant records and the
+     observation (0, 1 or 2) at each.
+    :rtype: (numpy.ndarray, numpy.ndarray)
+    """
+    positions = np.unique(np.concatenate([calls[0] for calls in vcf_calls]))
+
+    # Where a haplotype's file has no record for a position, the haplotype has
+    # the reference base, so first find the reference base at every position.
+    references = np.zeros(len(positions), dtype=np.uint8)
+    for file_positions, file_references, _ in vcf_calls:
+        index = np.searchsorted(positions, file_positions)
+        references[index] = np.maximum(references[index], file_references)
+
+    haplotype_alleles = []
+    for haplotype in haplotypes:
+        alleles = None
+        for file_positions, _, file_alleles in vcf_calls:
+            if haplotype in file_alleles:
+                alleles = references.copy()
+                alleles[np.searchsorted(positions, file_positions)] = file_alleles[haplotype]
+        if alleles is None:
+            raise ValueError('No VCF file has the sample {0}.'.format(haplotype[0]))
+        haplotype_alleles.append(alleles)
+
+    first, second = haplotype_alleles
+    observations = (first != second).astype(np.uint8)
+    observations[(first == _MISSING_ALLELE) | (second == _MISSING_ALLELE)] = MISSING_SYMBOL
+    return positions, observations
+
+
+def pairwise_observations(length, mask, positions, observations, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Produce the observations of a chromosome a chunk at a time.
+
+    :param length: The length of the chromosome.
+    :type length: int
+    :param mask: The start and end arrays of the callable regions, or None if everything is callable.
+    :type mask: (numpy.ndarray, numpy.ndarray) | None
+    :param positions: The sorted 0-based variant positions.
+    :type positions: numpy.ndarray
+    :param observations: The observation at each variant position.
+    :type observations: numpy.ndarray
+    :param chunk_size: The number of sites in each chunk.
+    :type chunk_size: int
+
+    :rtype: collections.Iterable[numpy.ndarray]
+    """
+    for chunk_start in xrange(0, length, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, length)
+        size = chunk_end - chunk_start
+
+        if mask is None:
+            callable_sites = np.ones(size, dtype=bool)
+        else:
+            starts, ends = mask
+            # Regions overlapping the chunk, clipped to it and counted with a running sum.
+            overlapping = (starts < chunk_end) & (ends > chunk_start)
+            region_starts = np.clip(starts[overlapping], chunk_start, chunk_end) - chunk_start
+            region_ends = np.clip(ends[overlapping], chunk_start, chunk_end) - chunk_start
+            coverage = np.zeros(size + 1, dtype=np.int32)
+            np.add.at(coverage, region_starts, 1)
+            np.add.at(coverage, region_ends, -1)
+            callable_sites = np.cumsum(coverage[:-1]) > 0
+
+        chunk = np.where(callable_sites, 0, MISSING_SYMBOL).astype(np.uint8)
+        first, last = np.searchsorted(positions, [chunk_start, chunk_end])
+        variant_sites = positions[first:last] - chunk_start
+        chunk[variant_sites] = np.where(callable_sites[variant_sites],
+                                        observations[first:last], MISSING_SYMBOL)
+        yield chunk
@@ -0,0 +1,53 @@
+import unittest
+import numpy
+from scipy.linalg import expm
+from IMCoalHMM.break_points import exp_break_points
+from IMCoalHMM.CTMC import CTMC, make_ctmc, probability_matrices
+from IMCoalHMM.state_spaces import Isolation, make_rates_table_isolation
+from IMCoalHMM.state_spaces import Migration, make_rates_table_migration
+from IMCoalHMM.state_spaces import Single, make_rates_table_single
+
+
+class ModuleTests(unittest.TestCase):
+    def test_probability_matrices(self):
+        ctmc = CTMC(Migration(), make_rates_table_migration(1000.0, 500.0, 0.4, 200.0, 50.0))
+        self.assertIsNotNone(ctmc.eigen_decomposition())
+
+        deltas = [1e-4, 5e-4, 1e-4, 2e-3, 1e-7]
+        matrices = ctmc.probability_matrices(deltas)
+        self.assertEqual(len(matrices), len(deltas))
+        self.assertIs(matrices[0], matrices[2])
+        self.assertIs(ctmc.probability_matrix(5e-4), matrices[1])
+        for delta_t, probabilities in zip(deltas, matrices):
+            expected = expm(ctmc.rate_matrix * delta_t)
+            self.assertTrue(numpy.allclose(probabilities, expected, rtol=1e-8, atol=1e-12))
+            self.assertTrue(numpy.allclose(probabilities.sum(axis=1), 1.0))
+
+    def test_relative_accuracy(self):
+        # The intervals of a small isolation model, where the probabilities of reaching some
+        # states are many orders of magnitude below one.
+        deltas = list(numpy.diff(exp_break_points(5, 1000.0, 0.001)))
+        for ctmc in (CTMC(Isolation(), make_rates_table_isolation(1000.0, 1000.0, 0.4)),
+                     CTMC(Single(), make_rates_table_single(1000.0, 0.4))):
+            for delta_t, probabilities in zip(deltas, ctmc.probability_matrices(deltas)):
+                expected = numpy.asarray(expm(ctmc.rate_matrix * delta_t))
+                probabilities = numpy.asarray(probabilities)
+                reachable = ctmc.reachable()
+                self.assertTrue(numpy.all(probabilities[reachable] > 0.0))
+                self.assertTrue(numpy.all(probabilities[~reachable] == 0.0))
+                self.assertTrue(numpy.allclose(probabilities[reachable], expected[reachable], rtol=1e-6, atol=0.0))
+
+    def test_grouped_probability_matrices(self):
+        state_space = Single()
+        first = make_ctmc(state_space, make_rates_table_single(1000.0, 0.4))
+        second = make_ctmc(state_space, make_rates_table_single(2000.0, 0.4))
+        # Equal rates give the same CTMC, so its time steps are shared.
+        self.assertIs(make_ctmc(state_space, make_rates_table_single(1000.0, 0.4)), first)
+
+        ctmcs = [first, second, first, first]
+        deltas = [1e-4, 1e-4, 3e-4, 1e-4]
+        matrices = probability_matrices(ctmcs, deltas)
+        self.assertIs(matrices[0], matrices[3])
+        self.assertFalse(numpy.allclose(matrices[0], matrices[1]))
+        for ctmc, delta_t, probabilities in zip(ctmcs, deltas, matrices):
+            self.assertTrue(numpy.allclose(probabilities, expm(ctmc.rate_matrix * delta_t), rtol=1e-8, atol=1e-12))
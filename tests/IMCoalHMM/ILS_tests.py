@@ -0,0 +1,102 @@
+import unittest
+from math import exp
+import numpy
+from IMCoalHMM.ILS import ILSModel
+
+
+def _subst_model(s):
+    x = 1 / 4.0 + 3 / 4.0 * exp(-4 * s)
+    y = 1 / 4.0 - 1 / 4.0 * exp(-4 * s)
+    return [[x if i == j else y for j in range(4)] for i in range(4)]
+
+
+def _prob_tree(node, i):
+    if 'chld' in node:
+        p = 1.0
+        for child, brlen in zip(node['chld'], node['len']):
+            mat = _subst_model(brlen)
+            p *= sum(mat[i][j] * _prob_tree(child, j) for j in range(4))
+        return p
+    return 1.0 if node['leaf'] == i else 0.0
+
+
+def _column_likelihood(model, state, bases, times):
+    path = model.reverse_tree_map[state]
+    if len(path) == 1:
+        star = times[path[0][1]]
+        tree = {'len': [star] * 3, 'chld': [{'leaf': b} for b in bases]}
+    else:
+        short, long_ = times[path[0][1]], times[path[1][1]]
+        outer = list(sorted(path[0][2], key=len)[0])[0]
+        first, second = [leaf for leaf in (1, 2, 3) if leaf != outer]
+        tree = {'len': [long_ - short, long_],
+                'chld': [{'len': [short, short], 'chld': [{'leaf': bases[first - 1]}, {'leaf': bases[second - 1]}]},
+                         {'leaf': bases[outer - 1]}]}
+    return sum(0.25 * _prob_tree(tree, i) for i in range(4))
+
+
+class ModuleTests(unittest.TestCase):
+    def test_emission_matrix(self):
+        model = ILSModel(2, 2)
+        parameters = numpy.array([0.001, 0.001, 1000.0, 1000.0, 1000.0, 1000.0, 1000.0, 0.4])
+        model.build_ctmc_system(*parameters)
+        emissions = model.emission_matrix(*parameters)
+        times, _ = model.emission_points(*parameters)
+
+        self.assertEqual(emissions.shape, (len(model.tree_map), 65))
+        self.assertTrue(numpy.allclose(emissions.sum(axis=1), 1.0))
+        for state in xrange(len(model.tree_map)):
+            likelihoods = [_column_likelihood(model, state, [column % 4, column // 4 % 4, column // 16], times)
+                           for column in xrange(64)] + [1.0]
+            expected = numpy.array(likelihoods) / sum(likelihoods)
+            self.assertTrue(numpy.allclose(emissions[state], expected))
+
+            # The cherry leaves sharing a base is more likely than any other pair doing so.
+            if not model.is_star[state]:
+                outer = model.outer_leaf[state]
+                first, second = [leaf for leaf in (1, 2, 3) if leaf != outer]
+                cherry = [0, 0, 0]
+                cherry[outer - 1] = 1
+                other = [1, 1, 1]
+                other[first - 1] = 0
+                cherry_column = cherry[0] + 4 * cherry[1] + 16 * cherry[2]
+                other_column = other[0] + 4 * other[1] + 16 * other[2]
+                self.assertGreater(emissions[state, cherry_column], emissions[state, other_column])
+
+        emissions = model.emission_matrix(*numpy.append(parameters, 0.002))
+        self.assertEqual(emissions.shape, (len(model.tree_map), 257))
+        self.assertTrue(numpy.allclose(emissions.sum(axis=1), 1.0))
+
+    def test_hidden_markov_model(self):
+        model = ILSModel(2, 2)
+        parameters = numpy.array([0.001, 0.001, 1000.0, 1000.0, 1000.0, 1000.0, 1000.0, 0.4])
+        init_probs, trans_probs, emission_probs = model.build_hidden_markov_model(parameters)
+        self.assertAlmostEqual(init_probs.sum(), 1.0)
+        self.assertTrue(numpy.allclose(trans_probs.sum(axis=1), 1.0))
+
+    def test_joint_matrix(self):
+        model = ILSModel(3, 3)
+        parameters = numpy.array([0.001, 0.002, 800.0, 1000.0, 1200.0, 900.0, 1100.0, 0.4])
+        ctmc_system = model.build_ctmc_system(*parameters)
+        joint = ctmc_system.make_joint_matrix()
+
+        expected = numpy.zeros(joint.shape)
+        for path in model.valid_paths:
+            i, j = model.get_path_indices(path)
+            expected[i, j] = ctmc_system.get_path_probability(path)
+        self.assertTrue(numpy.allclose(joint, expected, rtol=1e-12, atol=0))
+        self.assertEqual(len(set(model.path_prefix)), model.no_paths)
+        self.assertAlmostEqual(joint.sum(), 1.0)
+
+    def test_path_index(self):
+        model = ILSModel(2, 3)
+        paths = model.valid_paths
+        trees = model.reverse_tree_map
+        self.assertEqual(len(paths), model.no_paths)
+        for path_no, path in enumerate(paths):
+            self.assertTrue(all(i < j for (_, i, _), (_, j, _) in zip(path, path[1:])))
+            left, right = model.get_path_indices(path)
+            self.assertEqual((left, right), tuple(model.path_trees[path_no]))
+            self.assertEqual(trees[left], model.get_marginal_time_path(path, 0))
+            self.assertEqual(trees[right], model.get_marginal_time_path(path, 1))
+        self.assertEqual(len(model.tree_map), model.no_trees)
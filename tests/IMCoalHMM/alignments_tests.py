@@ -0,0 +1,99 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy
+import IMCoalHMM.alignments
+
+
+def _as_bytes(sequence):
+    return numpy.frombuffer(sequence, dtype=numpy.uint8)
+
+
+class ModuleTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        random = numpy.random.RandomState(4)
+        self.sequences = [''.join(random.choice(list('ACGTacgtN-'), 157)) for _ in xrange(4)]
+        self.names = ['seq1', 'seq2', 'seq3', 'seq4']
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_encode_columns(self):
+        encode_columns = IMCoalHMM.alignments.encode_columns
+
+        self.assertListEqual(list(encode_columns([_as_bytes('AcGTN'), _as_bytes('aCTA-')])), [0, 0, 1, 1, 2])
+        self.assertListEqual(list(encode_columns([_as_bytes('ATN'), _as_bytes('CTA'), _as_bytes('GTA')])),
+                             [0 + 4 * 1 + 16 * 2, 3 + 4 * 3 + 16 * 3, 64])
+        self.assertListEqual(list(encode_columns([_as_bytes('AT-'), _as_bytes('CT-'),
+                                                  _as_bytes('GT-'), _as_bytes('TT-')])),
+                             [0 + 4 * 1 + 16 * 2 + 64 * 3, 255, 256])
+
+        counts = numpy.bincount(_as_bytes('ACGTNx-?'), minlength=256)
+        self.assertEqual(IMCoalHMM.alignments.unknown_symbols(counts), '?X')
+
+    def _check_reading(self, alignment):
+        self.assertListEqual(alignment.names, self.names)
+        for chunk_size in (1, 10, 1000):
+            chunks = list(alignment.chunks(['seq3', 'seq1'], chunk_size))
+            self.assertTrue(all(len(chunk[0]) <= chunk_size for chunk in chunks))
+            self.assertEqual(''.join(chunk[0].tostring() for chunk in chunks), self.sequences[2])
+            self.assertEqual(''.join(chunk[1].tostring() for chunk in chunks), self.sequences[0])
+
+    def test_fasta(self):
+        filename = os.path.join(self.directory, 'alignment.fa')
+        with open(filename, 'w') as outfile:
+            for name, sequence in zip(self.names, self.sequences):
+                print >> outfile, '>%s some description' % name
+                for i in xrange(0, len(sequence), 60):
+                    print >> outfile, sequence[i:i + 60]
+        self._check_reading(IMCoalHMM.alignments.open_alignment(filename, 'fasta'))
+
+    def test_phylip(self):
+        filename = os.path.join(self.directory, 'alignment.phy')
+        with open(filename, 'w') as outfile:
+            print >> outfile, len(self.names), len(self.sequences[0])
+            for name, sequence in zip(self.names, self.sequences):
+                print >> outfile, name.ljust(10) + sequence[:50]
+            for i in xrange(50, len(self.sequences[0]), 50):
+                print >> outfile
+                for sequence in self.sequences:
+                    print >> outfile, ' '.join([sequence[i:i + 25], sequence[i + 25:i + 50]])
+        self._check_reading(IMCoalHMM.alignments.open_alignment(filename, 'phylip'))
+
+    def test_different_lengths(self):
+        filename = os.path.join(self.directory, 'alignment.fa')
+        with open(filename, 'w') as outfile:
+            print >> outfile, '>a\nACGT\n>b\nACG'
+        alignment = IMCoalHMM.alignments.open_alignment(filename, 'fasta')
+        self.assertRaises(ValueError, list, alignment.chunks(['a', 'b']))
+
+    def test_write_alignment_dataset(self):
+        from IMCoalHMM.dataset import Dataset
+        from IMCoalHMM.hmm import make_forwarders, Forwarder
+        from IMCoalHMM.isolation_model import IsolationModel
+
+        filename = os.path.join(self.directory, 'alignment.fa')
+        with open(filename, 'w') as outfile:
+            for name, sequence in zip(self.names[:2], self.sequences[:2]):
+                print >> outfile, '>%s\n%s' % (name, sequence)
+        alignment = IMCoalHMM.alignments.open_alignment(filename, 'fasta')
+        expected = IMCoalHMM.alignments.encode_columns([_as_bytes(s) for s in self.sequences[:2]])
+
+        dataset_filename = os.path.join(self.directory, 'alignment.imchmm')
+        IMCoalHMM.alignments.write_alignment_dataset(alignment, self.names[:2], dataset_filename, 'chr1',
+                                                     chunk_size=7, segment_size=50,
+                                                     preprocess=True, min_run_length=2)
+        dataset = Dataset(dataset_filename)
+        self.assertListEqual([segment['start'] for segment in dataset.segments], [0, 50, 100, 150])
+        self.assertTrue(numpy.array_equal(numpy.concatenate([dataset.observations(i) for i in xrange(4)]),
+                                          expected))
+
+        init_probs, trans_probs, emission_probs = \
+            IsolationModel(4).build_hidden_markov_model(numpy.array([0.001, 1000.0, 0.4]))
+        for segment_no, forwarder in enumerate(make_forwarders([dataset_filename], 3, min_run_length=2)):
+            self.assertIsNotNone(forwarder._stored_forwarder())
+            reference = Forwarder.from_observations(dataset.observations(segment_no), 3, min_run_length=None)
+            self.assertAlmostEqual(forwarder.forward(init_probs, trans_probs, emission_probs),
+                                   reference.forward(init_probs, trans_probs, emission_probs))
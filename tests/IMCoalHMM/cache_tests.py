@@ -0,0 +1,23 @@
+import unittest
+from IMCoalHMM.cache import Cache
+
+
+class ModuleTests(unittest.TestCase):
+    def test_cleanup(self):
+        cache = Cache(3)
+        for key in 'abcdefg':
+            cache[key] = key.upper()
+        # The first cleanup keeps the three most recent, with the most recent having the highest access count.
+        self.assertListEqual(sorted(cache.table), ['e', 'f', 'g'])
+        self.assertListEqual(sorted(cache.table, key=lambda key: cache.table[key][1]), ['e', 'f', 'g'])
+
+        self.assertEqual(cache['f'], 'F')
+        self.assertIn('e', cache)
+        for key in 'hij':
+            cache[key] = key.upper()
+        self.assertListEqual(sorted(cache.table, key=lambda key: cache.table[key][1]), ['g', 'f', 'e', 'h', 'i', 'j'])
+
+        # The second cleanup keeps the three most recently used of them.
+        cache['k'] = 'K'
+        self.assertListEqual(sorted(cache.table), ['i', 'j', 'k'])
+        self.assertListEqual(sorted(cache.table, key=lambda key: cache.table[key][1]), ['i', 'j', 'k'])
@@ -0,0 +1,55 @@
+import unittest
+import numpy
+from IMCoalHMM.cma_es import Optimiser, ExitCondition
+
+
+def ill_conditioned_fitness(positions):
+    target = numpy.linspace(0.2, 0.8, len(positions))
+    scales = numpy.logspace(0, 2, len(positions))
+    return -float(numpy.sum(scales * (numpy.array(positions) - target) ** 2))
+
+
+class ModuleTests(unittest.TestCase):
+    def test_maximise(self):
+        numpy.random.seed(1)
+        optimiser = Optimiser()
+        optimiser.max_iterations = 200
+        logged = []
+        optimiser.log = lambda context: logged.append((context.iteration, len(context.candidates)))
+        context = optimiser.maximise(ill_conditioned_fitness, 8)
+
+        self.assertEqual(context.exit_condition, ExitCondition.ITERATIONS)
+        self.assertEqual(logged, [(i, 10) for i in xrange(1, 201)])
+        self.assertEqual(context.evaluations, 200 * 10)
+        self.assertGreater(context.best.fitness, -1e-8)
+        self.assertTrue(numpy.allclose(context.best.positions, numpy.linspace(0.2, 0.8, 8), atol=1e-3))
+
+    def test_bounds_and_batches(self):
+        numpy.random.seed(2)
+        batches = []
+
+        def batch_fitness(positions):
+            positions = numpy.array(positions)
+            batches.append(positions)
+            # The maximum is in a corner of the unit hypercube.
+            return list(numpy.sum(positions, axis=1))
+
+        optimiser = Optimiser()
+        optimiser.population_size = 12
+        optimiser.max_iterations = 40
+        context = optimiser.maximise(lambda positions: float('nan'), 3, batch_fitness_function=batch_fitness)
+
+        self.assertEqual([len(batch) for batch in batches], [12] * 40)
+        for batch in batches:
+            self.assertTrue(numpy.all((batch >= 0.0) & (batch <= 1.0)))
+        self.assertGreater(context.best.fitness, 2.99)
+
+    def test_parallel(self):
+        numpy.random.seed(3)
+        optimiser = Optimiser()
+        optimiser.processes = 2
+        optimiser.max_iterations = 5
+        context = optimiser.maximise(ill_conditioned_fitness, 4)
+        self.assertEqual(context.iteration, 5)
+        self.assertGreaterEqual(context.best.fitness, max(candidate.fitness for candidate in context.candidates))
+        self.assertAlmostEqual(context.best.fitness, ill_conditioned_fitness(context.best.positions))
@@ -0,0 +1,61 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy
+import IMCoalHMM.dataset
+from IMCoalHMM.hmm import Forwarder, make_forwarders
+from IMCoalHMM.isolation_model import IsolationModel
+
+
+class ModuleTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        filename = os.path.join(self.directory, 'data.imchmm')
+        random = numpy.random.RandomState(1)
+        segments = [('chr1', 0, random.randint(0, 3, 100)),
+                    ('chr1', 500, numpy.array([2, 2, 0, 1])),
+                    ('chr2', 10, numpy.array([], dtype=int))]
+        IMCoalHMM.dataset.write_dataset(filename, segments, 3)
+
+        self.assertTrue(IMCoalHMM.dataset.is_dataset(filename))
+        self.assertFalse(IMCoalHMM.dataset.is_dataset(self.directory))
+
+        dataset = IMCoalHMM.dataset.Dataset(filename)
+        self.assertEqual(len(dataset), 3)
+        self.assertEqual(dataset.dtype, numpy.uint8)
+        for segment_no, (chromosome, start, obs) in enumerate(segments):
+            self.assertEqual(dataset.segments[segment_no]['chromosome'], chromosome)
+            self.assertEqual(dataset.segments[segment_no]['start'], start)
+            self.assertEqual(dataset.segments[segment_no]['length'], len(obs))
+            self.assertTrue(numpy.array_equal(dataset.observations(segment_no), obs))
+        self.assertAlmostEqual(dataset.segments[1]['missing'], 0.5)
+
+        # Large alphabets need more than a byte per symbol.
+        IMCoalHMM.dataset.write_dataset(filename, [('chr1', 0, [0, 300, 256])], 301)
+        dataset = IMCoalHMM.dataset.Dataset(filename)
+        self.assertEqual(dataset.dtype, numpy.uint16)
+        self.assertListEqual(list(dataset.observations(0)), [0, 300, 256])
+
+        self.assertRaises(ValueError, IMCoalHMM.dataset.write_dataset, filename, [('chr1', 0, [0, 3])], 3)
+
+    def test_dataset_forwarders(self):
+        filename = os.path.join(self.directory, 'data.imchmm')
+        random = numpy.random.RandomState(2)
+        segments = [('chr1', 0, random.choice(3, 1000, p=[0.9, 0.08, 0.02])),
+                    ('chr1', 5000, random.choice(3, 300, p=[0.9, 0.08, 0.02]))]
+        IMCoalHMM.dataset.write_dataset(filename, segments, 3)
+
+        forwarders = make_forwarders([filename], NSYM=3)
+        self.assertListEqual([f.sequence_length for f in forwarders], [1000, 300])
+
+        init_probs, trans_probs, emission_probs = \
+            IsolationModel(4).build_hidden_markov_model(numpy.array([0.001, 1000.0, 0.4]))
+        for forwarder, (_, _, obs) in zip(forwarders, segments):
+            expected = Forwarder.from_observations(obs, 3).forward(init_probs, trans_probs, emission_probs)
+            self.assertAlmostEqual(forwarder.forward(init_probs, trans_probs, emission_probs), expected)
@@ -0,0 +1,85 @@
+import unittest
+import numpy
+from scipy.linalg import expm
+from IMCoalHMM.CTMC import make_ctmc
+from IMCoalHMM.break_points import exp_break_points, uniform_break_points
+from IMCoalHMM.demography import Epoch, Demography, same_states, merge_populations
+from IMCoalHMM.demography import uniform_spacing, exponential_spacing
+from IMCoalHMM.state_spaces import Isolation, make_rates_table_isolation
+from IMCoalHMM.state_spaces import Migration, make_rates_table_migration
+from IMCoalHMM.state_spaces import Single, make_rates_table_single
+from IMCoalHMM.transitions import projection_matrix
+
+
+class ModuleTests(unittest.TestCase):
+    def test_compile(self):
+        isolation, migration, single = Isolation(), Migration(), Single()
+        demography = Demography([Epoch(isolation, 0, same_states),
+                                 Epoch(migration, 2),
+                                 Epoch(migration, 1, merge_populations),
+                                 Epoch(single, 3)],
+                                initial_state=isolation.i12_index)
+        self.assertEqual(demography.no_states, 6)
+        self.assertListEqual(list(demography.interval_epochs), [1, 1, 2, 3, 3, 3])
+        self.assertListEqual(demography.state_spaces, [migration] * 3 + [single] * 4)
+        # Only the move into the ancestral population needs a projection on a through matrix.
+        self.assertListEqual(demography.boundaries, [(2, 2)])
+        self.assertListEqual(demography.parametric_projections, [])
+
+        self.assertRaises(ValueError, Demography, [Epoch(isolation, 0, same_states), Epoch(migration, 0)], 0)
+        self.assertRaises(ValueError, Demography, [Epoch(migration, 2), Epoch(migration, 0), Epoch(migration, 2)], 0)
+
+    def test_break_points(self):
+        isolation, migration, single = Isolation(), Migration(), Single()
+        demography = Demography([Epoch(isolation, 0, same_states),
+                                 Epoch(migration, 2, spacing=uniform_spacing),
+                                 Epoch(migration, 1, merge_populations),
+                                 Epoch(single, 3, spacing=exponential_spacing)],
+                                initial_state=isolation.i12_index)
+        # The second migration epoch continues the scheme of the first, so the three
+        # intervals divide the migration period together.
+        break_points = demography.break_points([(0.001, 0.004, None), (0.004, None, 1000.0)])
+        expected = list(uniform_break_points(3, 0.001, 0.004)) + list(exp_break_points(3, 1000.0, 0.004))
+        self.assertTrue(numpy.allclose(break_points, expected))
+        self.assertRaises(ValueError, demography.break_points, [(0.001, 0.004, None)])
+
+        self.assertRaises(ValueError, Demography, [Epoch(migration, 2), Epoch(single, 2, spacing=exponential_spacing)],
+                          0)
+
+    def test_ctmc_system(self):
+        isolation, migration, single = Isolation(), Migration(), Single()
+        demography = Demography([Epoch(isolation, 0, same_states),
+                                 Epoch(migration, 2, merge_populations),
+                                 Epoch(single, 2)],
+                                initial_state=isolation.i12_index)
+        ctmcs = [make_ctmc(isolation, make_rates_table_isolation(1000.0, 1000.0, 0.4)),
+                 make_ctmc(migration, make_rates_table_migration(1000.0, 1000.0, 0.4, 200.0, 200.0)),
+                 make_ctmc(single, make_rates_table_single(1000.0, 0.4))]
+        break_points = [0.001, 0.0015, 0.002, 0.003]
+        system = demography.ctmc_system(ctmcs, break_points)
+
+        self.assertEqual(system.no_states, 4)
+        self.assertIs(system.get_state_space(1), migration)
+        self.assertIs(system.get_state_space(2), single)
+        self.assertIs(system.through(3), demography.pseudo_through)
+
+        upto0 = expm(ctmcs[0].rate_matrix * 0.001) * projection_matrix(isolation, migration, same_states)
+        self.assertTrue(numpy.allclose(system.up_to(0), upto0))
+        self.assertTrue(numpy.allclose(system.through(0), expm(ctmcs[1].rate_matrix * 0.0005)))
+        into_ancestral = expm(ctmcs[1].rate_matrix * 0.0005) * projection_matrix(migration, single, merge_populations)
+        self.assertTrue(numpy.allclose(system.through(1), into_ancestral))
+        self.assertTrue(numpy.allclose(system.through(2), expm(ctmcs[2].rate_matrix * 0.001)))
+
+    def test_parametric_projection(self):
+        isolation, single = Isolation(), Single()
+        demography = Demography([Epoch(isolation, 0), Epoch(single, 3)], initial_state=isolation.i12_index)
+        self.assertListEqual(demography.parametric_projections, [0])
+
+        ctmcs = [make_ctmc(isolation, make_rates_table_isolation(1000.0, 1000.0, 0.4)),
+                 make_ctmc(single, make_rates_table_single(1000.0, 0.4))]
+        break_points = [0.001, 0.002, 0.003]
+        self.assertRaises(ValueError, demography.ctmc_system, ctmcs, break_points)
+
+        projection = projection_matrix(isolation, single, merge_populations)
+        system = demography.ctmc_system(ctmcs, break_points, projections={0: projection})
+        self.assertTrue(numpy.allclose(system.up_to(0), expm(ctmcs[0].rate_matrix * 0.001) * projection))
@@ -0,0 +1,53 @@
+import unittest
+from math import exp
+import numpy
+import IMCoalHMM.emissions
+
+
+def _scalar_midpoint(t1, t2, rate):
+    delta_t = t2 - t1
+    return t1 + 1.0 / rate - (delta_t * exp(-delta_t * rate)) / (1 - exp(-delta_t * rate))
+
+
+class ModuleTests(unittest.TestCase):
+    def test_truncated_exp_midpoint(self):
+        truncated_exp_midpoint = IMCoalHMM.emissions.truncated_exp_midpoint
+
+        for t1, t2, rate in [(1.0, 2.0, 1.0), (0.0, 0.001, 1000.0), (0.002, 0.003, 50.0), (0.0, 10.0, 5.0)]:
+            self.assertAlmostEqual(truncated_exp_midpoint(t1, t2, rate), _scalar_midpoint(t1, t2, rate))
+
+        # Tiny intervals, where 1 - exp(-dt * rate) underflows, give the middle of the interval.
+        self.assertAlmostEqual(truncated_exp_midpoint(1.0, 1.0 + 1e-12, 1.0), 1.0 + 0.5e-12, places=15)
+        self.assertEqual(truncated_exp_midpoint(1.0, 1.0, 1.0), 1.0)
+        # Huge intervals give the mean of the exponential.
+        self.assertAlmostEqual(truncated_exp_midpoint(1.0, 1e6, 1.0), 2.0)
+
+        t1 = numpy.array([0.0, 1.0, 2.0])
+        points = truncated_exp_midpoint(t1, t1 + 1.0, numpy.array([0.5, 1.0, 2.0]))
+        self.assertEqual(points.shape, (3,))
+        self.assertAlmostEqual(points[2], _scalar_midpoint(2.0, 3.0, 2.0))
+
+    def test_coalescence_points(self):
+        coalescence_points = IMCoalHMM.emissions.coalescence_points
+
+        break_points = [0.0, 0.5, 1.5, 2.0]
+        points = coalescence_points(break_points, 2.0)
+        self.assertEqual(points.dtype, numpy.float64)
+        expected = [_scalar_midpoint(break_points[i - 1], break_points[i], 2.0) for i in xrange(1, 4)] + [2.5]
+        for point, expected_point in zip(points, expected):
+            self.assertAlmostEqual(point, expected_point)
+
+        points = coalescence_points(numpy.array(break_points), [1.0, 2.0, 3.0, 4.0])
+        self.assertAlmostEqual(points[1], _scalar_midpoint(0.5, 1.5, 2.0))
+        self.assertAlmostEqual(points[3], 2.25)
+
+    def test_emission_matrix(self):
+        emission_matrix = IMCoalHMM.emissions.emission_matrix
+
+        matrix = emission_matrix([0.0, 0.001, 1.0, 100.0])
+        self.assertEqual(matrix.shape, (4, 3))
+        self.assertTrue(numpy.allclose(matrix[:, 0] + matrix[:, 1], 1.0))
+        self.assertTrue(numpy.all(matrix[:, 2] == 1.0))
+        self.assertEqual(matrix[0, 1], 0.0)
+        self.assertAlmostEqual(matrix[1, 1], 0.75 - 0.75 * exp(-4.0 / 3 * 0.002))
+        self.assertAlmostEqual(matrix[3, 1], 0.75)
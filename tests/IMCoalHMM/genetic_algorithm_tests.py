@@ -0,0 +1,159 @@
+import unittest
+import random
+import numpy
+from IMCoalHMM.genetic_algorithm import Optimiser, FixedInitialisation, UniformInitialisation, ExitCondition
+from IMCoalHMM.genetic_algorithm import Population, Individual, Mutation
+from IMCoalHMM.genetic_algorithm import RouletteSelection, StochasticSelection, TournamentSelection, TruncationSelection
+from IMCoalHMM.genetic_algorithm import OnePointCrossover, TwoPointCrossover, UniformCrossover
+from IMCoalHMM.genetic_algorithm import BoundaryMutation, GaussianMutation, UniformMutation
+
+
+def quadratic_fitness(genome):
+    return -sum((x - 0.3) ** 2 for x in genome)
+
+
+class CountingFitness(object):
+    def __init__(self):
+        self.genomes = []
+
+    def __call__(self, genome):
+        self.genomes.append(tuple(genome))
+        return quadratic_fitness(genome)
+
+
+class ReversingMutation(Mutation):
+    def mutate(self, genome0):
+        return list(reversed(genome0))
+
+
+def make_optimiser(processes=None):
+    optimiser = Optimiser()
+    optimiser.processes = processes
+    optimiser.population_size = 20
+    optimiser.max_generations = 15
+    optimiser.elite_count = 2
+    return optimiser
+
+
+class ModuleTests(unittest.TestCase):
+    def test_maximise(self):
+        random.seed(1)
+        optimiser = make_optimiser()
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.assertEqual(context.exit_condition, ExitCondition.GENERATIONS)
+        self.assertEqual(len(context.population), optimiser.population_size)
+        best = context.hall_of_fame[0]
+        self.assertEqual(best.fitness, max(individual.fitness for individual in context.population))
+        self.assertAlmostEqual(best.fitness, quadratic_fitness(best.genome))
+
+        # Evaluating in worker processes gives the same search.
+        random.seed(1)
+        parallel_context = make_optimiser(processes=2).maximise(quadratic_fitness, 3)
+        self.assertEqual(parallel_context.hall_of_fame[0].genome, best.genome)
+        self.assertEqual(parallel_context.evaluations, context.evaluations)
+
+    def test_fitness_cache(self):
+        random.seed(2)
+        fitness = CountingFitness()
+        optimiser = make_optimiser()
+        optimiser.initialisation = FixedInitialisation()
+        optimiser.mutation = None
+        context = optimiser.maximise(fitness, 3)
+
+        # Clones, such as the elite, and the identical initial population are evaluated only once.
+        self.assertEqual(len(fitness.genomes), len(set(fitness.genomes)))
+        self.assertEqual(context.evaluations, len(fitness.genomes))
+        self.assertEqual(fitness.genomes[0], (0.5, 0.5, 0.5))
+        self.assertLess(context.evaluations, optimiser.population_size * optimiser.max_generations)
+
+    def test_initialisation(self):
+        random.seed(3)
+        batches = []
+
+        def evaluate(genomes):
+            batches.append(len(genomes))
+            return [quadratic_fitness(genome) for genome in genomes]
+
+        population = UniformInitialisation().initialise(10, 4, evaluate)
+        self.assertEqual(batches, [10])
+        self.assertEqual(len(population), 10)
+        for individual in population:
+            self.assertEqual(len(individual.genome), 4)
+            self.assertAlmostEqual(individual.fitness, quadratic_fitness(individual.genome))
+
+    def test_population(self):
+        population = Population([[0.1, 0.2], [0.3, 0.4]], [1.0, float('nan')])
+        self.assertEqual(len(population), 2)
+        self.assertEqual(population[1].genome, (0.3, 0.4))
+        self.assertEqual(population[1].fitness, float('-inf'))
+        self.assertEqual([individual.fitness for individual in population], [1.0, float('-inf')])
+        self.assertRaises(IndexError, population.__getitem__, 2)
+
+        # Individuals are views of the population's arrays.
+        population.fitness[0] = 2.0
+        self.assertEqual(population[0].fitness, 2.0)
+        individual = Individual([0.5, 0.6], 3.0)
+        self.assertEqual((individual.genome, individual.fitness), ((0.5, 0.6), 3.0))
+
+    def test_batch_operators(self):
+        random.seed(4)
+        numpy.random.seed(4)
+        population = Population(numpy.random.random_sample((30, 5)), numpy.random.random_sample(30))
+        for selection in (RouletteSelection(), StochasticSelection(), TournamentSelection(), TruncationSelection()):
+            indices = selection.select_indices(population)
+            self.assertEqual(len(indices), selection.compute_selection_size(population))
+            self.assertTrue(numpy.all((indices >= 0) & (indices < len(population))))
+        self.assertEqual(set(TruncationSelection().select_indices(population)),
+                         set(numpy.argsort(-population.fitness)[:23]))
+
+        first, second = numpy.zeros((50, 5)), numpy.ones((50, 5))
+        for crossover in (OnePointCrossover(), TwoPointCrossover(), UniformCrossover()):
+            offspring = crossover.crossover_genomes(first, second)
+            self.assertEqual(offspring.shape, (50, 5))
+            # Both parents contribute to each genome.
+            self.assertTrue(numpy.all((offspring.sum(axis=1) > 0) & (offspring.sum(axis=1) < 5)))
+        self.assertTrue(numpy.all(OnePointCrossover().crossover_genomes(first, second)[:, 0] == 0.0))
+
+        genomes = numpy.full((200, 5), 0.5)
+        for mutation in (BoundaryMutation(), GaussianMutation(), UniformMutation()):
+            mutated = mutation.mutate_genomes(genomes)
+            self.assertEqual(mutated.shape, genomes.shape)
+            self.assertTrue(numpy.all((mutated >= 0.0) & (mutated <= 1.0)))
+            self.assertAlmostEqual(numpy.mean(mutated != 0.5), mutation.point_mutation_ratio, delta=0.05)
+        self.assertTrue(numpy.all(genomes == 0.5))
+
+        # Operators without array versions are applied to one genome at a time.
+        self.assertTrue(numpy.array_equal(ReversingMutation().mutate_genomes(numpy.array([[0.1, 0.2, 0.3]])),
+                                          [[0.3, 0.2, 0.1]]))
+
+    def test_operator_random(self):
+        # The array versions of the operators draw from the generator of each operator.
+        genomes = numpy.full((10, 5), 0.5)
+        results = []
+        for seed in (1, 2):
+            random.seed(seed)
+            numpy.random.seed(seed)
+            selection, crossover, mutation = TournamentSelection(), UniformCrossover(), GaussianMutation()
+            for operator in (selection, crossover, mutation):
+                operator.random = random.Random(7)
+            population = Population(genomes + numpy.arange(10)[:, numpy.newaxis] / 100.0, numpy.arange(10.0))
+            results.append((selection.select_indices(population).tolist(),
+                            crossover.crossover_genomes(genomes, genomes + 0.1).tolist(),
+                            mutation.mutate_genomes(genomes).tolist()))
+        self.assertEqual(results[0], results[1])
+
+    def test_early_stopping(self):
+        random.seed(6)
+        optimiser = make_optimiser()
+        optimiser.stall_generations = 5
+        context = optimiser.maximise(lambda genome: 1.0, 3)
+        self.assertEqual(context.exit_condition, ExitCondition.STALLED)
+        self.assertEqual(context.generation, 6)
+
+        optimiser = make_optimiser()
+        optimiser.min_diversity = 0.05
+        optimiser.max_generations = 1000
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.assertEqual(context.exit_condition, ExitCondition.CONVERGED)
+        self.assertLess(context.diversity, 0.05)
+        self.assertLess(context.generation, 1000)
@@ -0,0 +1,26 @@
+import unittest
+import numpy
+import ziphmm
+import IMCoalHMM.hmm
+from IMCoalHMM.isolation_model import IsolationModel
+
+
+class ModuleTests(unittest.TestCase):
+    def test_run_length_forward(self):
+        Forwarder = IMCoalHMM.hmm.Forwarder
+
+        random = numpy.random.RandomState(3)
+        pieces = []
+        for _ in xrange(10):
+            pieces.append(random.choice(3, random.randint(1, 500), p=[0.9, 0.08, 0.02]))
+            pieces.append([random.choice([0, 2])] * random.randint(1, 20000))
+        obs = numpy.concatenate(pieces).astype(numpy.int32)
+
+        init_probs, trans_probs, emission_probs = \
+            IsolationModel(4).build_hidden_markov_model(numpy.array([0.001, 1000.0, 0.4]))
+        expected = ziphmm.hmm_forward(init_probs, trans_probs, emission_probs, obs)
+
+        for min_run_length in (None, 1, 100):
+            forwarder = Forwarder.from_observations(obs, 3, min_run_length=min_run_length)
+            self.assertEqual(forwarder.sequence_length, len(obs))
+            self.assertAlmostEqual(forwarder.forward(init_probs, trans_probs, emission_probs), expected, places=6)
@@ -0,0 +1,121 @@
+import unittest
+import numpy
+from IMCoalHMM.hmm import Forwarder
+from IMCoalHMM.isolation_model import IsolationModel
+from IMCoalHMM.likelihood import Likelihood, partition_forwarders, maximum_likelihood_estimate, value_and_gradient
+from IMCoalHMM.likelihood import finite_difference_steps
+from IMCoalHMM.parallel import EvaluationPool
+from IMCoalHMM.transforms import ParameterTransform
+
+
+class ModuleTests(unittest.TestCase):
+    def test_partition_forwarders(self):
+        class Segment(object):
+            def __init__(self, length):
+                self.sequence_length = length
+
+        groups = partition_forwarders([Segment(length) for length in (1, 5, 3, 8, 2, 4)], 3)
+        self.assertEqual(len(groups), 3)
+        self.assertListEqual(sorted(sum(f.sequence_length for f in group) for group in groups), [7, 8, 8])
+        self.assertEqual(len(partition_forwarders([Segment(1)], 4)), 1)
+
+    def test_finite_difference_steps(self):
+        steps = finite_difference_steps([1e-3, 2000.0, 0.0, -0.4, -30.0])
+        epsilon = numpy.sqrt(numpy.finfo(float).eps)
+        self.assertTrue(numpy.allclose(steps, epsilon * numpy.array([1.0, 2000.0, 1.0, 1.0, 30.0]), rtol=1e-12))
+
+        # Near zero the step stays large enough for the difference to resolve the gradient.
+        pool = EvaluationPool(lambda x: -1e3 - 1e4 * x[0] - 10.0 * x[1], 1)
+        try:
+            value, gradient = value_and_gradient(pool, numpy.array([1e-9, 1e-4]))
+        finally:
+            pool.terminate()
+        self.assertTrue(numpy.allclose(gradient, [-1e4, -10.0], rtol=1e-3))
+
+    def test_parallel_likelihood(self):
+        random = numpy.random.RandomState(5)
+        forwarders = [Forwarder.from_observations(random.choice(3, length, p=[0.9, 0.08, 0.02]), 3)
+                      for length in (2000, 500, 1200, 800)]
+        model = IsolationModel(4)
+        parameters = numpy.array([0.001, 1000.0, 0.4])
+
+        expected = Likelihood(model, forwarders)(parameters)
+        log_likelihood = Likelihood(model, forwarders, processes=2)
+        try:
+            self.assertAlmostEqual(log_likelihood(parameters), expected)
+            self.assertAlmostEqual(log_likelihood(parameters), expected)
+        finally:
+            log_likelihood.terminate()
+
+    def test_parallel_likelihood_error(self):
+        class FailingForwarder(object):
+            def __init__(self, value, fail):
+                self.sequence_length = 1
+                self.value = value
+                self.fail = fail
+
+            def forward(self, init_probs, trans_probs, emission_probs):
+                if init_probs is None and self.fail:
+                    raise ValueError('failed')
+                return self.value
+
+        log_likelihood = Likelihood(None, [FailingForwarder(1.0, True), FailingForwarder(2.0, False),
+                                           FailingForwarder(4.0, False)], processes=3)
+        try:
+            self.assertRaises(ValueError, log_likelihood.forward, None, None, None)
+            # The responses of the workers that succeeded are not left over for the next call.
+            self.assertEqual(log_likelihood.forward(1, 1, 1), 7.0)
+            self.assertEqual(log_likelihood.forward(1, 1, 1), 7.0)
+        finally:
+            log_likelihood.terminate()
+
+    def test_memo(self):
+        random = numpy.random.RandomState(7)
+        forwarders = [Forwarder.from_observations(random.choice(3, 1000, p=[0.9, 0.08, 0.02]), 3)]
+        parameters = numpy.array([0.001, 1000.0, 0.4])
+
+        expected = Likelihood(IsolationModel(4), forwarders)(parameters)
+        log_likelihood = Likelihood(IsolationModel(4), forwarders, memo_size=2)
+        self.assertAlmostEqual(log_likelihood(parameters), expected)
+        self.assertAlmostEqual(log_likelihood(parameters.copy()), expected)
+        self.assertEqual((log_likelihood.memo_hits, log_likelihood.memo_misses), (1, 1))
+
+        init_probs, _, _ = log_likelihood.hidden_markov_model(parameters)
+        self.assertAlmostEqual(init_probs.sum(), 1.0)
+
+        for split_time in numpy.linspace(0.0005, 0.002, 5):
+            log_likelihood(numpy.array([split_time, 1000.0, 0.4]))
+        self.assertLessEqual(len(log_likelihood.memo.table), 4)
+        self.assertEqual(log_likelihood.memo_misses, 6)
+        self.assertIn('1 of 7', log_likelihood.memo_report())
+
+    def test_transformed_estimate(self):
+        # A likelihood surface with parameters on very different scales, like times and rates.
+        optimum = numpy.array([0.002, 1500.0])
+
+        def log_likelihood(parameters):
+            self.assertTrue(numpy.all(parameters > 0))
+            return -numpy.sum(numpy.log(parameters / optimum) ** 2)
+
+        estimate = maximum_likelihood_estimate(log_likelihood, (0.001, 1000.0),
+                                               transform=ParameterTransform.log(2))
+        self.assertTrue(numpy.allclose(estimate, optimum, rtol=1e-3))
+
+    def test_parallel_gradient(self):
+        def function(point):
+            # Invalid beyond x = 1, so the gradient there needs a backward step.
+            return float('inf') if point[0] > 1.0 else (point[0] - 3.0) ** 2 + 1e3 * point[1] ** 2
+
+        with EvaluationPool(function, 2) as pool:
+            value, gradient = value_and_gradient(pool, numpy.array([1.0, 0.01]))
+        self.assertAlmostEqual(value, 4.1)
+        self.assertTrue(numpy.allclose(gradient, [-4.0, 20.0], rtol=1e-5))
+
+        optimum = numpy.array([0.002, 1500.0])
+
+        def log_likelihood(parameters):
+            return -numpy.sum(numpy.log(parameters / optimum) ** 2)
+
+        estimate = maximum_likelihood_estimate(log_likelihood, (0.001, 1000.0), optimizer_method='L-BFGS-B',
+                                               transform=ParameterTransform.log(2), processes=2)
+        self.assertTrue(numpy.allclose(estimate, optimum, rtol=1e-4))
@@ -0,0 +1,87 @@
+import unittest
+import numpy
+from IMCoalHMM.hmm import Forwarder
+from IMCoalHMM.isolation_model import IsolationModel
+from IMCoalHMM.likelihood import Likelihood
+from IMCoalHMM.multi_fidelity import coarse_intervals, fidelity_fractions, fidelity_levels, multi_fidelity_estimate
+from IMCoalHMM.multi_fidelity import subset_indices, SubsetLikelihood, subsample_estimate
+from IMCoalHMM.transforms import ParameterTransform
+
+
+class ModuleTests(unittest.TestCase):
+    def test_coarse_intervals(self):
+        self.assertEqual(coarse_intervals(10, 0.5), 5)
+        self.assertEqual(coarse_intervals(3, 0.25), 2)
+        self.assertEqual(coarse_intervals((12, [4, 0, 1]), 0.25), (3, [2, 0, 1]))
+        self.assertEqual(coarse_intervals((7, 9), 1.0), (7, 9))
+        self.assertListEqual(fidelity_fractions(3), [0.25, 0.5, 1.0])
+
+    def test_fidelity_levels(self):
+        random = numpy.random.RandomState(3)
+        forwarders = [Forwarder.from_observations(random.choice(3, 500, p=[0.9, 0.08, 0.02]), 3)
+                      for _ in xrange(4)]
+        levels = fidelity_levels(IsolationModel, (8,), [0], forwarders, no_levels=3, data_fractions=[0.5, 0.75],
+                                 random_state=random)
+        self.assertListEqual([level.description for level in levels],
+                             ['intervals=2 data=2/4', 'intervals=4 data=3/4', 'intervals=8'])
+        self.assertEqual(len(levels[0].log_likelihood.forwarders), 2)
+        self.assertIs(levels[2].log_likelihood.forwarders, forwarders)
+
+        # Only the interval counts are scaled, and each model is only made when its level is used.
+        arguments = []
+
+        def make_model(no_epochs, no_states):
+            arguments.append((no_epochs, no_states))
+            return IsolationModel(no_states)
+
+        levels = fidelity_levels(make_model, (3, 8), [1], forwarders, no_levels=3)
+        self.assertListEqual([level.description for level in levels], ['intervals=2', 'intervals=4', 'intervals=8'])
+        self.assertListEqual(arguments, [])
+        self.assertIs(levels[1].log_likelihood, levels[1].log_likelihood)
+        self.assertListEqual(arguments, [(3, 4)])
+
+    def test_multi_fidelity_estimate(self):
+        random = numpy.random.RandomState(5)
+        forwarders = [Forwarder.from_observations(random.choice(3, 2000, p=[0.9, 0.08, 0.02]), 3)
+                      for _ in xrange(2)]
+        levels = fidelity_levels(IsolationModel, (6,), [0], forwarders, no_levels=2)
+        result = multi_fidelity_estimate(levels, (0.001, 1000.0, 0.4), transform=ParameterTransform.log(3))
+
+        self.assertEqual(len(result.levels), 2)
+        self.assertEqual(result.evaluations, sum(level.evaluations for level in result.levels))
+        self.assertTrue(all(level.evaluations > 0 for level in result.levels))
+        self.assertAlmostEqual(result.log_likelihood, levels[-1].log_likelihood(result.estimate))
+        # The target level starts from the coarse estimate and can only improve on it.
+        self.assertGreaterEqual(result.log_likelihood, levels[-1].log_likelihood(result.levels[0].estimate))
+
+    def test_subset_likelihood(self):
+        random = numpy.random.RandomState(9)
+        forwarders = [Forwarder.from_observations(random.choice(3, length, p=[0.9, 0.08, 0.02]), 3)
+                      for length in (1000, 3000, 2000, 2000)]
+        order = [2, 0, 3, 1]
+        self.assertListEqual(subset_indices(forwarders, 0.25, order), [2])
+        self.assertListEqual(subset_indices(forwarders, 0.3, order), [0, 2])
+        self.assertListEqual(subset_indices(forwarders, 1.0, order), [0, 1, 2, 3])
+
+        parameters = numpy.array([0.001, 1000.0, 0.4])
+        subset = SubsetLikelihood(IsolationModel(4), forwarders, [0, 2])
+        self.assertAlmostEqual(subset.fraction, 3.0 / 8.0)
+        expected = Likelihood(IsolationModel(4), [forwarders[0], forwarders[2]])(parameters) * 8.0 / 3.0
+        self.assertAlmostEqual(subset(parameters), expected)
+
+    def test_subsample_estimate(self):
+        random = numpy.random.RandomState(11)
+        forwarders = [Forwarder.from_observations(random.choice(3, 1000, p=[0.9, 0.08, 0.02]), 3)
+                      for _ in xrange(8)]
+        transform = ParameterTransform.log(3)
+        result = subsample_estimate(IsolationModel(4), forwarders, (0.001, 1000.0, 0.4), initial_fraction=0.25,
+                                    tolerance=1e-6, transform=transform, random_state=random)
+
+        # Subsets of 2 and 4 segments, without agreement at this tolerance, then all 8.
+        self.assertListEqual([level.description for level in result.levels], ['data=2/8', 'data=4/8', 'data=8/8'])
+        self.assertAlmostEqual(result.log_likelihood, Likelihood(IsolationModel(4), forwarders)(result.estimate))
+
+        warm_start = subsample_estimate(IsolationModel(4), forwarders, (0.001, 1000.0, 0.4), initial_fraction=0.25,
+                                        tolerance=1e3, transform=transform, random_state=random, full_data=False)
+        # The estimates always agree at this tolerance, so the schedule stops after the second subset.
+        self.assertListEqual([level.description for level in warm_start.levels], ['data=2/8', 'data=4/8'])
@@ -0,0 +1,54 @@
+import unittest
+import numpy
+from IMCoalHMM.multistart import latin_hypercube, starting_points, multi_start_estimate
+from IMCoalHMM.transforms import ParameterTransform
+
+
+def bimodal_log_likelihood(parameters):
+    """A surface with a local optimum near (0.001, 1000) and the global one at (0.01, 100)."""
+    x = numpy.log(parameters)
+    local = -numpy.sum((x - numpy.log([0.001, 1000.0])) ** 2)
+    best = -numpy.sum((x - numpy.log([0.01, 100.0])) ** 2) / 4.0
+    return 100.0 * numpy.log(numpy.exp(local) + 2.0 * numpy.exp(best))
+
+
+class ModuleTests(unittest.TestCase):
+    def test_latin_hypercube(self):
+        points = latin_hypercube(8, 3, numpy.random.RandomState(1))
+        self.assertEqual(points.shape, (8, 3))
+        for dimension in xrange(3):
+            self.assertListEqual(sorted(numpy.floor(points[:, dimension] * 8).astype(int)), range(8))
+
+    def test_starting_points(self):
+        initial = numpy.array([0.001, 1000.0])
+        starts = starting_points(initial, 5, numpy.log(10.0), ParameterTransform.log(2), numpy.random.RandomState(2))
+        self.assertEqual(starts.shape, (5, 2))
+        self.assertTrue(numpy.array_equal(starts[0], initial))
+        self.assertTrue(numpy.all(starts >= initial / 10.0) and numpy.all(starts <= initial * 10.0))
+        self.assertTrue(numpy.allclose(starting_points(initial, 5, numpy.log(10.0), None, numpy.random.RandomState(2)),
+                                       starts))
+
+    def test_multi_start_estimate(self):
+        initial = numpy.array([0.001, 1000.0])
+        # From the initial guess alone the optimiser stays in the local optimum.
+        evaluated = []
+
+        def counted_log_likelihood(parameters):
+            evaluated.append(parameters)
+            return bimodal_log_likelihood(parameters)
+
+        result = multi_start_estimate(counted_log_likelihood, initial, 1, transform=ParameterTransform.log(2))
+        self.assertLess(result.log_likelihood, bimodal_log_likelihood(numpy.array([0.01, 100.0])) - 50.0)
+        # Every evaluation is in the trace; the estimate is not evaluated again.
+        self.assertEqual(len(evaluated), result.runs[0].evaluations)
+
+        result = multi_start_estimate(bimodal_log_likelihood, initial, 6, spread=numpy.log(20.0),
+                                      transform=ParameterTransform.log(2), processes=2, dominance=50.0,
+                                      min_evaluations=20, random_state=numpy.random.RandomState(3))
+        self.assertEqual(len(result.runs), 6)
+        self.assertTrue(numpy.allclose(result.estimate, [0.01, 100.0], rtol=1e-2))
+        self.assertAlmostEqual(result.log_likelihood, bimodal_log_likelihood(result.estimate))
+        for run in result.runs:
+            self.assertGreater(run.evaluations, 0)
+            self.assertEqual(max(value for _, value in run.trace), run.log_likelihood)
+        self.assertTrue(any(run.dominated for run in result.runs))
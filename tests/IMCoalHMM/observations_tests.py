@@ -0,0 +1,52 @@
+import unittest
+import numpy
+import IMCoalHMM.observations
+
+
+class ModuleTests(unittest.TestCase):
+    def test_run_length_encode(self):
+        run_length_encode = IMCoalHMM.observations.run_length_encode
+        run_length_decode = IMCoalHMM.observations.run_length_decode
+
+        obs = numpy.array([0, 1] + [2] * 13 + [0, 1, 0] + [0] * 8 + [1], dtype=numpy.int32)
+
+        # Without long runs nothing changes.
+        encoded, run_symbols = run_length_encode(obs, 3, min_run_length=None)
+        self.assertListEqual(list(encoded), list(obs))
+        self.assertListEqual(run_symbols, [])
+        encoded, run_symbols = run_length_encode(obs, 3, min_run_length=100)
+        self.assertListEqual(list(encoded), list(obs))
+        self.assertListEqual(run_symbols, [])
+
+        # 13 = 1 + 4 + 8 and the run of 0s is 9 = 1 + 8 long.
+        encoded, run_symbols = run_length_encode(obs, 3, min_run_length=5)
+        self.assertListEqual(run_symbols, [(2, 0), (2, 2), (2, 3), (0, 0), (0, 3)])
+        self.assertListEqual(list(encoded), [0, 1, 3, 4, 5, 0, 1, 6, 7, 1])
+        self.assertListEqual(list(run_length_decode(encoded, 3, run_symbols)), list(obs))
+
+        # The first observation is never part of a run symbol.
+        obs = numpy.array([2] * 10, dtype=numpy.int32)
+        encoded, run_symbols = run_length_encode(obs, 3, min_run_length=5)
+        self.assertEqual(encoded[0], 2)
+        self.assertListEqual(list(run_length_decode(encoded, 3, run_symbols)), list(obs))
+
+    def test_run_length_round_trip(self):
+        run_length_encode = IMCoalHMM.observations.run_length_encode
+        run_length_decode = IMCoalHMM.observations.run_length_decode
+
+        random = numpy.random.RandomState(2)
+        obs = numpy.repeat(random.randint(0, 3, 200), random.randint(1, 5000, 200)).astype(numpy.int32)
+        for min_run_length in (1, 10, 1000):
+            encoded, run_symbols = run_length_encode(obs, 3, min_run_length)
+            self.assertLess(len(encoded), len(obs))
+            self.assertTrue(numpy.array_equal(run_length_decode(encoded, 3, run_symbols), obs))
+
+    def test_find_segments(self):
+        find_segments = IMCoalHMM.observations.find_segments
+
+        obs = numpy.array([2, 2, 0, 1] + [2] * 5 + [0, 2, 2, 0] + [2] * 6, dtype=numpy.int32)
+        self.assertListEqual(find_segments(obs, 5), [(0, 4), (9, 13)])
+        self.assertListEqual(find_segments(obs, 3), [(0, 4), (9, 13)])
+        self.assertListEqual(find_segments(obs, 2), [(2, 4), (9, 10), (12, 13)])
+        self.assertListEqual(find_segments(obs, 100), [(0, len(obs))])
+        self.assertListEqual(find_segments([2] * 10, 5), [])
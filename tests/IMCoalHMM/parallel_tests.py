@@ -0,0 +1,30 @@
+import unittest
+from IMCoalHMM.parallel import EvaluationPool
+
+
+def square(x):
+    if x < 0:
+        raise ValueError('negative')
+    return x * x
+
+
+class ModuleTests(unittest.TestCase):
+    def test_map(self):
+        for processes in (None, 3):
+            with EvaluationPool(square, processes) as pool:
+                self.assertListEqual(pool.map(range(10)), [x * x for x in range(10)])
+
+    def test_submit(self):
+        for processes in (None, 2):
+            with EvaluationPool(square, processes) as pool:
+                for x in xrange(5):
+                    pool.submit(x, x)
+                results = dict(pool.next_result() for _ in xrange(5))
+                self.assertDictEqual(results, dict((x, x * x) for x in xrange(5)))
+                self.assertRaises(ValueError, pool.next_result)
+
+    def test_errors(self):
+        with EvaluationPool(square, 2) as pool:
+            self.assertRaises(ValueError, pool.map, [1, -1])
+            pool.submit('bad', -1)
+            self.assertRaises(ValueError, pool.next_result)
@@ -0,0 +1,106 @@
+import unittest
+import random
+import numpy
+from IMCoalHMM.particle_swarm import Optimiser, EvaluationMode, ExitCondition, Swarm, Particle
+
+
+def quadratic_fitness(parameters):
+    return -sum((x - 0.3) ** 2 for x in parameters)
+
+
+def make_optimiser(evaluation, processes=None):
+    optimiser = Optimiser()
+    optimiser.evaluation = evaluation
+    optimiser.processes = processes
+    optimiser.particle_count = 20
+    optimiser.max_iterations = 30
+    optimiser.omega = 0.5
+    optimiser.phi_particle = 0.5
+    optimiser.phi_swarm = 0.5
+    return optimiser
+
+
+class ModuleTests(unittest.TestCase):
+    def check_context(self, context, optimiser):
+        self.assertEqual(context.exit_condition, ExitCondition.ITERATIONS)
+        self.assertEqual(context.iteration, optimiser.max_iterations)
+        self.assertEqual(len(context.particles), optimiser.particle_count)
+        self.assertGreater(context.best.fitness, -1e-3)
+        self.assertEqual(context.best.fitness, max(particle.best.fitness for particle in context.particles))
+        self.assertAlmostEqual(context.best.fitness, quadratic_fitness(context.best.positions))
+
+    def test_serial(self):
+        random.seed(1)
+        optimiser = make_optimiser(EvaluationMode.SERIAL)
+        self.check_context(optimiser.maximise(quadratic_fitness, 3), optimiser)
+
+    def test_synchronous(self):
+        random.seed(2)
+        optimiser = make_optimiser(EvaluationMode.SYNCHRONOUS, processes=2)
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.check_context(context, optimiser)
+
+        # The same swarm evaluated by a batch function in this process.
+        batches = []
+
+        def batch_fitness(positions):
+            batches.append(len(positions))
+            return [quadratic_fitness(p) for p in positions]
+
+        random.seed(2)
+        batch_context = optimiser.maximise(quadratic_fitness, 3, batch_fitness_function=batch_fitness)
+        self.assertEqual(batches, [optimiser.particle_count] * optimiser.max_iterations)
+        self.assertEqual(batch_context.best.fitness, context.best.fitness)
+        self.assertEqual(batch_context.best.positions, context.best.positions)
+
+    def test_asynchronous(self):
+        random.seed(3)
+        optimiser = make_optimiser(EvaluationMode.ASYNCHRONOUS, processes=2)
+        self.check_context(optimiser.maximise(quadratic_fitness, 3), optimiser)
+
+    def test_nan_fitness(self):
+        random.seed(4)
+        optimiser = make_optimiser(EvaluationMode.SYNCHRONOUS)
+        optimiser.max_iterations = 2
+        context = optimiser.maximise(lambda parameters: float('nan'), 2)
+        self.assertTrue(all(particle.current.fitness == float('-inf') for particle in context.particles))
+
+    def test_particle_views(self):
+        swarm = Swarm(3, 2)
+        particle = Particle(swarm, 1)
+        particle.current.positions = [0.25, 0.75]
+        particle.current.fitness = -1.0
+        self.assertTrue(numpy.array_equal(swarm.positions[1], [0.25, 0.75]))
+        self.assertEqual(swarm.fitness[1], -1.0)
+        self.assertEqual(particle.current.positions, (0.25, 0.75))
+
+        swarm.best_fitness[:] = float('-inf')
+        swarm.update_bests(numpy.arange(3))
+        self.assertEqual(particle.best.positions, (0.25, 0.75))
+        self.assertEqual(particle.best.fitness, -1.0)
+
+    def test_early_stopping(self):
+        random.seed(6)
+        numpy.random.seed(6)
+        optimiser = make_optimiser(EvaluationMode.SERIAL)
+        optimiser.stall_iterations = 5
+        context = optimiser.maximise(lambda parameters: 1.0, 3)
+        # The first iteration sets the reference fitness, which never improves.
+        self.assertEqual(context.exit_condition, ExitCondition.STALLED)
+        self.assertEqual(context.iteration, 6)
+
+        optimiser = make_optimiser(EvaluationMode.SERIAL)
+        optimiser.stall_iterations = 5
+        optimiser.stall_tolerance = 1e-3
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.assertEqual(context.exit_condition, ExitCondition.STALLED)
+        self.assertLess(context.iteration, optimiser.max_iterations)
+        self.assertGreater(context.best.fitness, -1e-2)
+
+        optimiser = make_optimiser(EvaluationMode.SYNCHRONOUS)
+        optimiser.min_diversity = 0.05
+        optimiser.max_iterations = 1000
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.assertEqual(context.exit_condition, ExitCondition.CONVERGED)
+        self.assertLess(context.diversity, 0.05)
+        self.assertLess(context.iteration, 1000)
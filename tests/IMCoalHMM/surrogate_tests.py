@@ -0,0 +1,96 @@
+import unittest
+import random
+import numpy
+from IMCoalHMM.surrogate import GaussianProcess, expected_improvement, training_values, propose
+from IMCoalHMM.surrogate import Optimiser, SurrogateScreen
+from IMCoalHMM import genetic_algorithm, particle_swarm
+
+
+def quadratic_fitness(positions):
+    target = numpy.array([0.3, 0.6, 0.45])
+    scales = numpy.array([1.0, 10.0, 100.0])
+    return -1000.0 * float(numpy.sum(scales * (numpy.array(positions) - target) ** 2))
+
+
+class ModuleTests(unittest.TestCase):
+    def test_gaussian_process(self):
+        numpy.random.seed(1)
+        points = numpy.random.random_sample((30, 2))
+        values = numpy.sin(3.0 * points[:, 0]) + points[:, 1] ** 2
+        process = GaussianProcess().fit(points, values)
+
+        mean, std = process.predict(points)
+        self.assertTrue(numpy.allclose(mean, values, atol=1e-2))
+        self.assertTrue(numpy.all(std < 1e-1))
+        mean, std = process.predict([[0.5, 0.5]])
+        self.assertAlmostEqual(mean[0], numpy.sin(1.5) + 0.25, delta=0.05)
+
+    def test_expected_improvement(self):
+        ei = expected_improvement([0.0, 1.0, 2.0, 1.0], [1.0, 1.0, 1.0, 0.0], 1.0)
+        self.assertTrue(ei[0] < ei[1] < ei[2])
+        self.assertEqual(ei[3], 0.0)
+        self.assertAlmostEqual(ei[1], 1.0 / numpy.sqrt(2.0 * numpy.pi))
+        self.assertListEqual(list(training_values([1.0, 5.0, float('-inf'), 3.0, 4.0])), [3.5, 5.0, 3.5, 3.5, 4.0])
+
+    def test_propose(self):
+        numpy.random.seed(2)
+        points = numpy.random.random_sample((20, 3))
+        process = GaussianProcess().fit(points, [quadratic_fitness(p) for p in points])
+        proposals = propose(process, 4)
+        self.assertEqual(proposals.shape, (4, 3))
+        self.assertTrue(numpy.all((proposals >= 0.0) & (proposals <= 1.0)))
+        # The batch is spread out rather than four copies of the same point.
+        self.assertEqual(len(set(map(tuple, proposals))), 4)
+
+    def test_maximise(self):
+        numpy.random.seed(3)
+        optimiser = Optimiser()
+        optimiser.max_iterations = 20
+        context = optimiser.maximise(quadratic_fitness, 3)
+        self.assertEqual(context.evaluations, 8 + 19 * 4)
+        self.assertGreater(context.best.fitness, -0.5)
+        self.assertAlmostEqual(context.best.fitness, quadratic_fitness(context.best.positions))
+
+    def test_screen(self):
+        random.seed(4)
+        numpy.random.seed(4)
+        screen = SurrogateScreen(quadratic_fitness, fraction=0.25, min_points=20)
+        optimiser = particle_swarm.Optimiser()
+        optimiser.evaluation = particle_swarm.EvaluationMode.SYNCHRONOUS
+        optimiser.particle_count = 20
+        optimiser.max_iterations = 10
+        try:
+            context = optimiser.maximise(quadratic_fitness, 3, batch_fitness_function=screen)
+        finally:
+            screen.terminate()
+
+        # The initial swarm is evaluated in full, then a quarter of each iteration.
+        self.assertEqual(screen.evaluations, 20 + 9 * 5)
+        # Screened positions never become the best solution.
+        self.assertIn(context.best.fitness, screen.values)
+
+    def test_screen_genetic_algorithm(self):
+        random.seed(4)
+        numpy.random.seed(4)
+        screen = SurrogateScreen(quadratic_fitness, fraction=0.25, min_points=20)
+        optimiser = genetic_algorithm.Optimiser()
+        optimiser.population_size = 20
+        optimiser.max_generations = 10
+        try:
+            context = optimiser.maximise(quadratic_fitness, 3, batch_fitness_function=screen)
+
+            # Positions evaluated before get their value again without another evaluation.
+            evaluations = screen.evaluations
+            self.assertEqual(screen(screen.points[:5]), screen.values[:5])
+            self.assertEqual(screen.evaluations, evaluations)
+        finally:
+            screen.terminate()
+
+        # Every genome passed to the screen counts, the initial population and then the offspring
+        # beside the elite, although only some were evaluated.
+        self.assertEqual(context.evaluations, 20 + 9 * 19)
+        self.assertLess(screen.evaluations, context.evaluations)
+        # Predictions are not cached as fitness, so the best genome was evaluated.
+        best = context.hall_of_fame[0]
+        self.assertIn(best.fitness, screen.values)
+        self.assertAlmostEqual(best.fitness, quadratic_fitness(best.genome))
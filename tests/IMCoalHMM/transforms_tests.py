@@ -0,0 +1,27 @@
+import unittest
+import numpy
+from IMCoalHMM.transforms import ParameterTransform, LOG, LOGIT, IDENTITY
+
+
+class ModuleTests(unittest.TestCase):
+    def test_round_trip(self):
+        transform = ParameterTransform([IDENTITY, LOG, LOG, LOGIT, LOG], ordered=[[0, 1, 2]])
+        parameters = numpy.array([0.001, 0.0015, 0.004, 0.25, 1000.0])
+        values = transform.to_optimiser(parameters)
+        self.assertTrue(numpy.allclose(values, [0.001, numpy.log(0.0005), numpy.log(0.0025),
+                                                numpy.log(0.25 / 0.75), numpy.log(1000.0)]))
+        self.assertTrue(numpy.allclose(transform.from_optimiser(values), parameters))
+        self.assertListEqual(transform.bounds(), [(0, None)] + [(None, None)] * 4)
+
+        # Any point in the optimisation space keeps the times ordered and the proportion valid.
+        parameters = transform.from_optimiser([0.002, -20.0, 5.0, 40.0, -3.0])
+        self.assertTrue(parameters[0] < parameters[1] < parameters[2])
+        self.assertTrue(0.0 < parameters[3] <= 1.0)
+
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, ParameterTransform, ['exp'])
+        transform = ParameterTransform([LOG, LOG, LOGIT], ordered=[[0, 1]])
+        self.assertRaises(ValueError, transform.to_optimiser, [0.002, 0.001, 0.5])
+        self.assertRaises(ValueError, transform.to_optimiser, [0.0, 0.001, 0.5])
+        self.assertRaises(ValueError, transform.to_optimiser, [0.001, 0.002, 1.0])
+        self.assertRaises(ValueError, ParameterTransform.log(2).to_optimiser, [1.0, 2.0, 3.0])
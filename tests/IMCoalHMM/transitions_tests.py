@@ -0,0 +1,33 @@
+import unittest
+import numpy
+from IMCoalHMM.isolation_with_migration_model import IsolationMigrationModel
+from IMCoalHMM.transitions import changed_matrices
+
+
+class ModuleTests(unittest.TestCase):
+    def test_changed_matrices(self):
+        first = numpy.matrix(numpy.identity(3))
+        second = numpy.matrix(numpy.ones((3, 3)))
+        self.assertListEqual(changed_matrices([first, second], None), [True, True])
+        self.assertListEqual(changed_matrices([first, second], [first.copy(), first]), [False, True])
+        self.assertListEqual(changed_matrices([first], [first, second]), [True])
+
+    def test_incremental_rebuild(self):
+        parameters = numpy.array([0.001, 0.001, 1000.0, 0.4, 200.0])
+        model = IsolationMigrationModel(4, 4)
+        model.build_hidden_markov_model(parameters)
+        previous = model.previous_ctmc_system
+
+        # Changing the migration rate only changes the migration intervals, so the
+        # products within the ancestral intervals are reused.
+        changed = parameters.copy()
+        changed[4] = 100.0
+        init_probs, trans_probs, _ = model.build_hidden_markov_model(changed)
+        system = model.previous_ctmc_system
+        self.assertIs(system.between(4, 7), previous.between(4, 7))
+        self.assertIsNot(system.between(2, 7), previous.between(2, 7))
+        self.assertIsNone(system.previous)
+
+        expected_init, expected_trans, _ = IsolationMigrationModel(4, 4).build_hidden_markov_model(changed)
+        self.assertTrue(numpy.array_equal(init_probs, expected_init))
+        self.assertTrue(numpy.array_equal(trans_probs, expected_trans))
@@ -0,0 +1,93 @@
+import unittest
+import os
+import tempfile
+import shutil
+import numpy
+import IMCoalHMM.vcf
+
+VCF_A = """##fileformat=VCFv4.2
+##contig=<ID=chr1,length=20>
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tA\tB
+chr1\t2\t.\tA\tG\t.\tPASS\t.\tGT\t0|1\t0|0
+chr1\t5\t.\tC\tT\t.\tPASS\t.\tGT:DP\t1/1:3\t./.:0
+chr1\t7\t.\tC\tCT\t.\tPASS\t.\tGT\t0/1\t0/0
+chr1\t9\t.\tG\tA\t.\tLowQual\t.\tGT\t0/1\t0/0
+chr1\t12\t.\tT\tA,C\t.\t.\t.\tGT\t1/2\t1/1
+"""
+
+VCF_B = """##fileformat=VCFv4.2
+#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tC
+chr1\t2\t.\tA\tG\t.\tPASS\t.\tGT\t1/1
+chr1\t15\t.\tG\tT\t.\tPASS\t.\tGT\t1/1
+"""
+
+
+class ModuleTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.vcf_a = os.path.join(self.directory, 'a.vcf')
+        self.vcf_b = os.path.join(self.directory, 'b.vcf')
+        with open(self.vcf_a, 'w') as outfile:
+            outfile.write(VCF_A)
+        with open(self.vcf_b, 'w') as outfile:
+            outfile.write(VCF_B)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _observations(self, haplotypes, mask=None, chunk_size=7):
+        vcfs = [IMCoalHMM.vcf.read_vcf(filename, haplotypes) for filename in (self.vcf_a, self.vcf_b)]
+        positions, observations = IMCoalHMM.vcf.compare_haplotypes([vcf.chromosome('chr1') for vcf in vcfs],
+                                                                   haplotypes)
+        self.assertEqual(vcfs[0].lengths['chr1'], 20)
+        return list(numpy.concatenate(list(IMCoalHMM.vcf.pairwise_observations(20, mask, positions, observations,
+                                                                               chunk_size))))
+
+    def test_heterozygosity(self):
+        expected = [0] * 20
+        expected[1] = 1   # 0|1
+        expected[6] = 2   # indel
+        expected[8] = 2   # filtered
+        expected[11] = 1  # 1/2
+        self.assertListEqual(self._observations([('A', 0), ('A', 1)]), expected)
+
+    def test_across_files(self):
+        expected = [0] * 20
+        expected[1] = 0   # both have G
+        expected[4] = 1   # A has T, C has the reference C
+        expected[6] = 2
+        expected[8] = 2
+        expected[11] = 1  # A has A, C has the reference T
+        expected[14] = 1  # A has the reference G, C has T
+        self.assertListEqual(self._observations([('A', 1), ('C', 0)]), expected)
+
+        expected[1] = 1   # B has the reference A, C has G
+        expected[4] = 2   # B's genotype is missing
+        self.assertListEqual(self._observations([('B', 0), ('C', 0)]), expected)
+
+    def test_missing_genotype(self):
+        # A record without GT and a sample field truncated before its GT are missing calls.
+        with open(self.vcf_b, 'w') as outfile:
+            outfile.write(VCF_B + 'chr1\t17\t.\tC\tA\t.\tPASS\t.\tDP\t4\n'
+                                  'chr1\t18\t.\tT\tG\t.\tPASS\t.\tDP:GT\t.\n')
+        expected = [0] * 20
+        expected[1] = 1
+        expected[4] = 2
+        expected[6] = 2
+        expected[8] = 2
+        expected[11] = 1
+        expected[14] = 1
+        expected[16] = 2
+        expected[17] = 2
+        self.assertListEqual(self._observations([('B', 0), ('C', 0)]), expected)
+
+    def test_mask(self):
+        mask_filename = os.path.join(self.directory, 'mask.bed')
+        with open(mask_filename, 'w') as outfile:
+            outfile.write('chr1\t0\t3\nchr1\t10\t12\nchr1\t11\t16\n')
+        mask = IMCoalHMM.vcf.read_mask(mask_filename)['chr1']
+        expected = [2] * 20
+        expected[0:3] = [0, 1, 0]
+        expected[10:16] = [0, 1, 0, 0, 0, 0]
+        for chunk_size in (1, 7, 100):
+            self.assertListEqual(self._observations([('A', 0), ('A', 1)], mask, chunk_size), expected)